@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Unit tests for progressive-deepening template search."""
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+import adaptive_search  # noqa: E402
+from adaptive_search import is_decisive, parse_steps, plan_steps, search  # noqa: E402
+
+STEPS = [(16, 40), (50, 100), (150, 200)]
+
+
+def rows_for(scores):
+    return [{"id": f"t{i}", "card_id": card, "set_id": None, "score": score} for i, (card, score) in enumerate(scores)]
+
+
+class SteppedClient:
+    """Answers each match_count from a table; entries may be exceptions."""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = []
+
+    def rpc(self, name, payload):
+        self.calls.append((name, payload["match_count"], payload["ef_search"]))
+        answer = self.answers[payload["match_count"]]
+
+        def execute():
+            if isinstance(answer, Exception):
+                raise answer
+            return SimpleNamespace(data=answer)
+
+        return SimpleNamespace(execute=execute)
+
+
+@pytest.fixture(autouse=True)
+def reset_availability(monkeypatch):
+    monkeypatch.setattr(adaptive_search, "_available", True)
+
+
+def test_steps_are_parsed_and_capped_at_topk():
+    assert parse_steps("50:100, 16:40,150") == [(16, 40), (50, 100), (150, 300)]
+    assert plan_steps(50, STEPS) == [(16, 40), (50, 100)]
+    assert plan_steps(200, STEPS) == [(16, 40), (50, 100), (150, 200), (200, 200)]
+    assert plan_steps(10, STEPS) == [(10, 40)]
+
+
+def test_decisive_needs_enough_cards_and_a_margin():
+    clear = rows_for([("a", 0.92), ("a", 0.90), ("b", 0.85), ("c", 0.8), ("d", 0.8), ("e", 0.7)])
+    close = rows_for([("a", 0.92), ("b", 0.91), ("c", 0.8), ("d", 0.8), ("e", 0.7)])
+    narrow = rows_for([("a", 0.92), ("a", 0.91), ("b", 0.5)])
+    assert is_decisive(clear, min_cards=5, min_margin=0.03)
+    assert not is_decisive(close, min_cards=5, min_margin=0.03)
+    assert not is_decisive(narrow, min_cards=5, min_margin=0.03)
+
+
+def test_clear_queries_stop_at_the_cheap_step():
+    clear = rows_for([("a", 0.95), ("b", 0.80), ("c", 0.79), ("d", 0.78), ("e", 0.7)])
+    client = SteppedClient({16: clear})
+    assert search(client, "[0.1]", 50, steps=STEPS) == clear
+    assert client.calls == [("match_card_templates_ef", 16, 40)]
+
+
+def test_ambiguous_queries_deepen_until_topk():
+    close = rows_for([("a", 0.92), ("b", 0.91), ("c", 0.8), ("d", 0.8), ("e", 0.7)])
+    deeper = close + rows_for([("f", 0.6)])
+    client = SteppedClient({16: close, 50: deeper})
+    assert search(client, "[0.1]", 50, steps=STEPS) == deeper
+    assert [k for _, k, _ in client.calls] == [16, 50]
+
+
+def test_deeper_timeout_keeps_the_shallow_answer():
+    close = rows_for([("a", 0.92), ("b", 0.91)])
+    client = SteppedClient({16: close, 50: RuntimeError("canceling statement due to statement timeout (57014)")})
+    assert search(client, "[0.1]", 50, steps=STEPS) == close
+
+
+def test_missing_rpc_disables_adaptive_search():
+    client = SteppedClient({16: RuntimeError("PGRST202 Could not find the function public.match_card_templates_ef")})
+    assert search(client, "[0.1]", 50, steps=STEPS) is None
+    assert not adaptive_search.available()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Unit tests for the confusion-aware candidate rerank."""
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+from confusion_rerank import ConfusionIndex, contested, rerank  # noqa: E402
+
+
+class ConfusionQuery:
+    def __init__(self, client):
+        self.client = client
+        self.bounds = None
+
+    def select(self, columns):
+        return self
+
+    def gte(self, column, value):
+        self.min_count = value
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end)
+        return self
+
+    def execute(self):
+        self.client.loads.append(self.bounds)
+        if self.client.fail:
+            raise RuntimeError("relation card_confusion does not exist")
+        rows = [r for r in self.client.rows if r["confusion_count"] >= self.min_count]
+        start, end = self.bounds
+        return SimpleNamespace(data=rows[start:end + 1])
+
+
+class ConfusionClient:
+    def __init__(self, rows, template_scores=None):
+        self.rows = rows
+        self.template_scores = template_scores or {}
+        self.fail = False
+        self.loads = []
+        self.rpc_calls = []
+
+    def from_(self, table):
+        assert table == "card_confusion"
+        return ConfusionQuery(self)
+
+    def rpc(self, name, params):
+        self.rpc_calls.append((name, params))
+        data = [{"card_id": cid, "best_score": s, "mean_score": s, "templates": 4}
+                for cid, s in self.template_scores.items() if cid in params["ids"]]
+        return SimpleNamespace(execute=lambda: SimpleNamespace(data=data))
+
+
+def candidate(card_id, fused, proto=0.8):
+    return {"card_id": card_id, "template_id": f"t-{card_id}", "set_id": None,
+            "template_score": fused, "proto_score": proto, "fused": fused}
+
+
+def test_index_is_symmetric_filtered_and_paged(monkeypatch):
+    import table_cache
+
+    monkeypatch.setattr(table_cache, "PAGE_SIZE", 2)
+    rows = [
+        {"card_id_wrong": "sv1-1", "card_id_correct": "sv1-2", "confusion_count": 3},
+        {"card_id_wrong": "sv1-2", "card_id_correct": "sv1-1", "confusion_count": 2},
+        {"card_id_wrong": "sv2-5", "card_id_correct": "sv2-6", "confusion_count": 4},
+        {"card_id_wrong": "sv3-1", "card_id_correct": "sv3-2", "confusion_count": 1},
+    ]
+    client = ConfusionClient(rows)
+    index = ConfusionIndex(min_count=2)
+    index.refresh(client)
+
+    assert index.count("sv1-1", "sv1-2") == index.count("sv1-2", "sv1-1") == 5
+    assert index.count("sv2-6", "sv2-5") == 4
+    assert index.count("sv3-1", "sv3-2") == 0
+    assert client.loads == [(0, 1), (2, 3)]
+
+
+def test_index_refreshes_on_schedule_and_survives_failures():
+    now = [0.0]
+    client = ConfusionClient([{"card_id_wrong": "a", "card_id_correct": "b", "confusion_count": 5}])
+    index = ConfusionIndex(refresh_seconds=300, min_count=1, clock=lambda: now[0])
+
+    index.refresh(client)
+    index.refresh(client)
+    assert len(client.loads) == 1
+
+    now[0] = 301.0
+    client.fail = True
+    index.refresh(client)
+    assert len(client.loads) == 2 and index.count("a", "b") == 5
+
+
+def test_only_close_known_pairs_are_contested():
+    index = ConfusionIndex(min_count=1)
+    index._pairs = {"a": {"b": 3, "d": 1}, "b": {"a": 3}, "d": {"a": 1}}
+    index._loaded_at = 0.0
+
+    assert contested([candidate("a", 0.90), candidate("b", 0.88), candidate("c", 0.87)], index) == ["a", "b"]
+    assert contested([candidate("a", 0.90), candidate("b", 0.70)], index, margin=0.05) == []
+    assert contested([candidate("a", 0.90), candidate("c", 0.89)], index) == []
+    assert contested([candidate("a", 0.90), candidate("c", 0.89), candidate("d", 0.88)], index) == ["a", "d"]
+
+
+def test_second_look_reorders_only_the_contested_cards():
+    index = ConfusionIndex(refresh_seconds=1e9, min_count=1)
+    client = ConfusionClient(
+        [{"card_id_wrong": "a", "card_id_correct": "c", "confusion_count": 4}],
+        template_scores={"a": 0.70, "c": 0.86},
+    )
+    candidates = [candidate("a", 0.90), candidate("b", 0.89), candidate("c", 0.88), candidate("d", 0.60)]
+
+    reranked, looked = rerank(np.ones(4, dtype=np.float32) / 2, candidates, client, (0.7, 0.3), index=index)
+
+    assert looked
+    assert [c["card_id"] for c in reranked] == ["c", "b", "a", "d"]
+    assert reranked[0]["fused"] == 0.88 and reranked[0]["second_look"] > reranked[2]["second_look"]
+    assert client.rpc_calls[0][0] == "score_card_templates" and client.rpc_calls[0][1]["ids"] == ["a", "c"]
+
+
+def test_unambiguous_crops_skip_the_rpc():
+    index = ConfusionIndex(refresh_seconds=1e9, min_count=1)
+    client = ConfusionClient([{"card_id_wrong": "x", "card_id_correct": "y", "confusion_count": 4}])
+    candidates = [candidate("a", 0.90), candidate("b", 0.89)]
+
+    reranked, looked = rerank(np.ones(4, dtype=np.float32), candidates, client, (0.7, 0.3), index=index)
+
+    assert reranked == candidates and not looked
+    assert client.rpc_calls == []
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""Unit tests for single-cut crop artifacts."""
+
+import io
+import sys
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+from crop_artifact import cut_crop, strict_preprocess  # noqa: E402
+
+
+def _page():
+    rng = np.random.default_rng(7)
+    return Image.fromarray(rng.integers(0, 255, size=(900, 1200, 3), dtype=np.uint8))
+
+
+def test_cut_crop_produces_storage_jpeg_and_embedding_input_from_one_region():
+    page = _page()
+    box = [100, 150, 400, 570]
+
+    artifact = cut_crop(page, box)
+
+    stored = Image.open(io.BytesIO(artifact.jpeg))
+    assert stored.format == "JPEG" and stored.size == (300, 420)
+    assert artifact.size == (300, 420) and artifact.preprocessed
+    expected = strict_preprocess(page.crop(tuple(box)))
+    assert artifact.embed_input.size == (336, 336)
+    assert np.array_equal(np.asarray(artifact.embed_input), np.asarray(expected)), "must embed exactly like the old path"
+
+
+def test_legacy_cut_keeps_the_plain_rgb_crop():
+    page = _page().convert("L")
+    artifact = cut_crop(page, [0, 0, 50, 80], target_short=None)
+    assert artifact.embed_input.mode == "RGB" and artifact.embed_input.size == (50, 80)
+    assert not artifact.preprocessed
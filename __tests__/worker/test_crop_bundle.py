@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Unit tests for per-scan crop bundles."""
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+import crop_bundle  # noqa: E402
+from crop_bundle import BundleFormatError, BundleReader, CropBundle, bundle_path_for, parse_index, read_crop  # noqa: E402
+
+
+class FakeStorage:
+    def __init__(self, objects):
+        self.objects = objects
+        self.downloads = []
+        self.range_reads = []
+
+    def from_(self, bucket):
+        return self
+
+    def upload(self, path, file, file_options=None):
+        self.objects[path] = file
+
+    def download(self, path):
+        self.downloads.append(path)
+        if path not in self.objects:
+            raise FileNotFoundError(path)
+        return self.objects[path]
+
+    def range_fetch(self, bucket, path, start, end):
+        self.range_reads.append((path, start, end))
+        if path not in self.objects:
+            raise FileNotFoundError(path)
+        return self.objects[path][start:end + 1]
+
+
+class FakeClient:
+    def __init__(self, objects=None):
+        self.storage = FakeStorage(objects if objects is not None else {})
+
+
+def make_bundle(scan_id, crops):
+    bundle = CropBundle(scan_id)
+    for n, data in enumerate(crops, start=1):
+        bundle.add(f"{scan_id}/crop_{n}.jpeg", data)
+    return bundle
+
+
+def test_bundle_round_trips_every_crop():
+    crops = [bytes([n]) * (100 + n) for n in range(12)]
+    blob = make_bundle("scan-1", crops).to_bytes()
+
+    index = parse_index(blob)
+    assert list(index) == [f"crop_{n}.jpeg" for n in range(1, 13)]
+    for n, data in enumerate(crops, start=1):
+        assert read_crop(blob, f"crop_{n}.jpeg") == data
+    assert len(blob) == max(off + size for off, size in index.values())
+
+
+def test_bundle_rejects_foreign_crops_and_bad_headers():
+    with pytest.raises(ValueError):
+        CropBundle("scan-1").add("scan-2/crop_1.jpeg", b"x")
+    with pytest.raises(BundleFormatError):
+        parse_index(b"\xff\xd8\xff\xe0 a plain jpeg")
+
+
+def test_reader_uses_one_index_read_then_one_range_read_per_crop():
+    crops = [os.urandom(2000 + n) for n in range(5)]
+    client = FakeClient()
+    make_bundle("scan-1", crops).upload(client)
+    reader = BundleReader(client, range_fetch=client.storage.range_fetch)
+
+    for n, data in enumerate(crops, start=1):
+        assert reader.download(f"scan-1/crop_{n}.jpeg") == data
+
+    assert len(client.storage.range_reads) == 1 + len(crops)
+    assert all(path == bundle_path_for("scan-1") for path, _, _ in client.storage.range_reads)
+    assert client.storage.downloads == []
+
+
+def test_reader_reads_past_the_probe_for_large_indexes(monkeypatch):
+    monkeypatch.setattr(crop_bundle, "INDEX_PROBE_BYTES", 16)
+    client = FakeClient()
+    make_bundle("scan-1", [b"a" * 10, b"b" * 20]).upload(client)
+    reader = BundleReader(client, range_fetch=client.storage.range_fetch)
+
+    assert reader.download("scan-1/crop_2.jpeg") == b"b" * 20
+    assert len(client.storage.range_reads) == 3
+
+
+def test_reader_falls_back_to_per_crop_objects():
+    client = FakeClient({"scan-old/crop_1.jpeg": b"legacy"})
+    reader = BundleReader(client, range_fetch=client.storage.range_fetch)
+
+    assert reader.download("scan-old/crop_1.jpeg") == b"legacy"
+    assert reader.download("scan-old/crop_1.jpeg") == b"legacy"
+    # The missing bundle is only probed once per scan
+    assert len(client.storage.range_reads) == 1
+    assert client.storage.downloads == ["scan-old/crop_1.jpeg", "scan-old/crop_1.jpeg"]
+
+
+def test_index_cache_is_bounded():
+    client = FakeClient()
+    for n in range(4):
+        make_bundle(f"scan-{n}", [b"x"]).upload(client)
+    reader = BundleReader(client, range_fetch=client.storage.range_fetch, cache_size=2)
+
+    for n in range(4):
+        reader.download(f"scan-{n}/crop_1.jpeg")
+    assert len(reader._cache) == 2
+    assert list(reader._cache) == ["scan-2", "scan-3"]
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""Unit tests for near-duplicate crop dedupe."""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+from crop_dedupe import EmbeddingMemo  # noqa: E402
+
+
+def unit(*values):
+    vec = np.asarray(values, dtype=np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+def test_near_identical_crops_share_a_copy_of_the_result():
+    memo = EmbeddingMemo(threshold=0.97)
+    assert memo.lookup(unit(1, 0, 0)) is None
+
+    first = {"card_id": "sv1-25", "best_score": 0.91, "candidates": [{"card_id": "sv1-25"}]}
+    memo.add(unit(1, 0, 0), first)
+    shared = memo.lookup(unit(1, 0.1, 0))
+
+    assert shared["card_id"] == "sv1-25" and shared["shared_retrieval"] is True
+    shared["candidates"].append({"card_id": "other"})
+    assert len(first["candidates"]) == 1 and "shared_retrieval" not in first
+    assert memo.hits == 1 and len(memo) == 1
+
+
+def test_different_cards_below_the_threshold_are_searched_separately():
+    memo = EmbeddingMemo(threshold=0.97)
+    memo.add(unit(1, 0, 0), {"card_id": "a"})
+    memo.add(unit(0, 1, 0), {"card_id": "b"})
+
+    assert memo.lookup(unit(1, 0.3, 0)) is None  # cos ~0.958, same frame but not the same card
+    assert memo.lookup(unit(0.05, 1, 0))["card_id"] == "b"
+    assert memo.hits == 1
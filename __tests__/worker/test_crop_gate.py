@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Unit tests for the pre-embedding crop gate."""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+from crop_gate import defer_reason, screen_boxes, texture_score  # noqa: E402
+
+FIXTURE = ROOT_DIR / "__tests__" / "ocr" / "fixtures" / "pidgeot_ex_crop.jpg"
+
+
+def det(box, confidence):
+    return {"box": list(box), "confidence": confidence}
+
+
+def test_screen_boxes_rejects_non_card_geometry():
+    card = det((100, 100, 400, 520), 0.9)
+    neighbour = det((410, 100, 710, 520), 0.8)
+    sliver = det((800, 100, 880, 520), 0.7)        # 80 px wide against 420 px tall
+    speck = det((900, 900, 930, 940), 0.7)         # below 5% of the page's short side
+    artwork = det((130, 150, 370, 330), 0.6)       # inside the first card
+    kept, rejected = screen_boxes([artwork, sliver, neighbour, speck, card], (2000, 1500))
+
+    assert kept == [card, neighbour]
+    assert rejected == [(sliver, "aspect"), (speck, "too_small"), (artwork, "nested")]
+
+
+def test_rotated_and_overlapping_cards_pass():
+    tilted = det((100, 100, 500, 480), 0.8)        # near-square box of a card at ~45 degrees
+    overlapping = det((380, 100, 680, 520), 0.7)   # shares a strip with its neighbour, not nested
+    kept, rejected = screen_boxes([tilted, overlapping], (2000, 1500))
+    assert kept == [tilted, overlapping] and rejected == []
+
+
+def test_texture_separates_cards_from_blank_pockets():
+    card = Image.open(FIXTURE).convert("RGB")
+    rng = np.random.default_rng(0)
+    pocket = Image.fromarray((rng.normal(0, 2, (336, 336, 3)) + 205).clip(0, 255).astype(np.uint8))
+
+    assert texture_score(card) > 0.8
+    assert texture_score(pocket) < 0.1
+
+
+def test_only_low_confidence_blank_crops_are_deferred():
+    card = Image.open(FIXTURE).convert("RGB")
+    blank = Image.new("RGB", (336, 336), (205, 205, 210))
+
+    assert defer_reason(blank, 0.3) == "no_texture"
+    assert defer_reason(blank, 0.9) is None
+    assert defer_reason(card, 0.3) is None
+
+
+def test_padding_of_square_inputs_is_not_texture():
+    from crop_artifact import strict_preprocess
+
+    blank = strict_preprocess(Image.new("RGB", (160, 220), (205, 205, 210)))
+    assert defer_reason(blank, 0.3) is None  # the black bars look like edges
+    assert defer_reason(blank, 0.3, content_size=(160, 220)) == "no_texture"
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Unit tests for the pooled psycopg2 connection manager (services/worker/db.py)."""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+SERVICE_DIR = ROOT_DIR / "services" / "worker"
+if str(SERVICE_DIR) not in sys.path:
+    sys.path.insert(0, str(SERVICE_DIR))
+
+from db import Database, StatusBatcher  # noqa: E402
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        if self.conn.fail_next:
+            self.conn.fail_next = False
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.conn.statements.append((sql.strip(), params))
+        self.rows = [{"job_id": "job-1"}] if "dequeue" in sql else [{"id": params[0]}] if params else []
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+class FakeConnection:
+    def __init__(self, fail_next=False):
+        self.fail_next = fail_next
+        self.prepared = False
+        self.closed = 0
+        self.statements = []
+        self.commits = self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class FakePool:
+    def __init__(self, connections):
+        self.idle = list(connections)
+        self.returned = []
+
+    def getconn(self):
+        return self.idle.pop(0)
+
+    def putconn(self, conn, close=False):
+        self.returned.append((conn, close))
+        if not close:
+            self.idle.insert(0, conn)
+
+    def closeall(self):
+        pass
+
+
+def _db(pool, sleeps):
+    return Database("postgres://test", pool_factory=lambda *a, **k: pool, sleep=sleeps.append)
+
+
+def test_broken_connection_is_discarded_and_work_retried_on_a_fresh_one():
+    broken, fresh = FakeConnection(fail_next=True), FakeConnection()
+    pool, sleeps = FakePool([broken, fresh]), []
+    db = _db(pool, sleeps)
+
+    job = db.run(lambda cur: db.dequeue(cur, "w1", 60, "fair", None))
+
+    assert job == {"job_id": "job-1"}
+    assert pool.returned[0] == (broken, True)
+    assert sleeps == [1]
+    prepares = [sql for sql, _ in fresh.statements if sql.startswith("PREPARE")]
+    assert len(prepares) == 2 and fresh.prepared
+    assert fresh.statements[-1][0].startswith("EXECUTE dequeue_job")
+
+    db.run(lambda cur: db.dequeue(cur, "w1", 60, "fair", None))
+    assert len([sql for sql, _ in fresh.statements if sql.startswith("PREPARE")]) == 2, "prepared once per session"
+
+
+def test_statement_errors_roll_back_without_reconnecting():
+    conn = FakeConnection()
+    pool, sleeps = FakePool([conn]), []
+    db = _db(pool, sleeps)
+
+    def work(cur):
+        raise ValueError("bad row")
+
+    with pytest.raises(ValueError):
+        db.run(work)
+    assert conn.rollbacks == 1 and sleeps == []
+    assert pool.returned[-1] == (conn, False)
+
+
+def test_unprepared_mode_sends_plain_sql():
+    conn = FakeConnection()
+    db = Database("postgres://test", use_prepared=False, pool_factory=lambda *a, **k: FakePool([conn]))
+
+    db.run(lambda cur: db.dequeue(cur, "w1", 60, "fifo", 2))
+
+    sql, params = conn.statements[-1]
+    assert "dequeue_job_with_lease(%s, %s, %s, %s)" in sql and params == ("w1", 60, "fifo", 2)
+    assert not any(s.startswith("PREPARE") for s, _ in conn.statements)
+
+
+def test_status_batcher_keeps_statuses_when_the_transaction_fails():
+    conn = FakeConnection()
+    db = _db(FakePool([conn]), [])
+    batcher = StatusBatcher(db)
+    batcher.add("job-1", "tok-1", "completed")
+
+    batch = batcher.drain()
+    assert len(batcher) == 0
+    batcher.requeue(batch)
+    assert len(batcher) == 1
+
+    assert batcher.flush() == ["job-1"]
+    sql, params = conn.statements[-1]
+    assert sql.startswith("EXECUTE complete_job") and params == ("job-1", "tok-1", "completed", None)
+    assert len(batcher) == 0
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Load-generator tests for the fair-share queue scheduling policy."""
+
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+from fair_scheduler import (  # noqa: E402
+    QueuedJob,
+    bulk_flood_workload,
+    percentile,
+    select_next_job,
+    simulate,
+)
+
+
+def _split(latencies):
+    small = [v for k, v in latencies.items() if k.startswith("small-")]
+    bulk = [v for k, v in latencies.items() if k.startswith("bulk-")]
+    return small, bulk
+
+
+def test_interactive_p95_under_bulk_flood():
+    jobs = bulk_flood_workload(bulk_pages=200, small_users=20, service_seconds=20.0)
+
+    fifo_small, _ = _split(simulate(jobs, workers=4, mode="fifo"))
+    fair_small, fair_bulk = _split(simulate(jobs, workers=4, mode="fair"))
+
+    # FIFO makes every small user wait behind the binder; fair share serves them
+    # within about one scan time of a worker freeing up.
+    assert percentile(fifo_small, 95) > 600
+    assert percentile(fair_small, 95) <= 2 * 20.0
+    # The bulk user still gets all of its pages processed.
+    assert len(fair_bulk) == 200
+
+
+def test_priority_and_round_robin_ordering():
+    pending = [
+        QueuedJob("a1", "alice", 0.0, 1.0),
+        QueuedJob("a2", "alice", 1.0, 1.0),
+        QueuedJob("b1", "bob", 2.0, 1.0),
+        QueuedJob("c1", "carol", 3.0, 1.0, priority=-1),
+    ]
+
+    assert select_next_job(pending, {}, {}, mode="fifo").job_id == "a1"
+    # Alice already has a job running, so Bob goes next
+    assert select_next_job(pending, {"alice": 1}, {}, mode="fair").job_id == "b1"
+    # Equal running counts: the user served least recently wins
+    assert select_next_job(pending, {}, {"alice": 5.0, "bob": 9.0}, mode="fair").job_id == "a1"
+    # Low-priority work only runs when nothing else is eligible
+    assert select_next_job(pending, {"alice": 2, "bob": 2}, {}, mode="fair", max_per_user=2).job_id == "c1"
+
+
+def test_hard_cap_leaves_capped_users_waiting():
+    pending = [QueuedJob("a1", "alice", 0.0, 1.0)]
+    assert select_next_job(pending, {"alice": 2}, {}, mode="fair", max_per_user=2) is None
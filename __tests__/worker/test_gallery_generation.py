@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Unit tests for resumable gallery generation manifests."""
+
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+from gallery_generation import (  # noqa: E402
+    GalleryManifest,
+    fetch_shadow_card_ids,
+    manifest_path_for,
+)
+
+
+def test_manifest_round_trip_resumes_completed_cards(tmp_path):
+    path = manifest_path_for("ViT-L-14-336/openai/strict336-pad-v1", tmp_path)
+    assert path.parent == tmp_path
+    assert "/" not in path.name
+
+    manifest = GalleryManifest.load_or_create(path, "gen-a", meta={"model_name": "ViT-L-14-336"})
+    manifest.mark_failed("sv1-2", "timeout")
+    manifest.mark_completed(["sv1-1", "sv1-2"])
+    manifest.save()
+
+    data = json.loads(path.read_text())
+    assert data["completed_cards"] == ["sv1-1", "sv1-2"]
+    assert data["failed_cards"] == {}
+
+    resumed = GalleryManifest.load_or_create(path, "gen-a")
+    assert resumed.is_done("sv1-1")
+    assert not resumed.is_done("sv1-3")
+    assert resumed.meta["model_name"] == "ViT-L-14-336"
+    assert not list(tmp_path.glob(".manifest-*")), "temp files should be renamed away"
+
+
+def test_manifest_refuses_other_generation(tmp_path):
+    path = tmp_path / "m.json"
+    GalleryManifest.load_or_create(path, "gen-a").save()
+
+    with pytest.raises(ValueError):
+        GalleryManifest.load_or_create(path, "gen-b")
+
+
+class _RPCClient:
+    def __init__(self, rows):
+        self.rows = rows
+        self.ranges = []
+
+    def rpc(self, name, params):
+        assert name == "gallery_shadow_card_ids"
+        client = self
+
+        class _Query:
+            def order(self, column):
+                return self
+
+            def range(self, start, end):
+                client.ranges.append((start, end))
+                self.page = client.rows[start:end + 1]
+                return self
+
+            def execute(self):
+                return SimpleNamespace(data=self.page)
+
+        return _Query()
+
+
+def test_fetch_shadow_card_ids_pages_and_requires_full_template_set():
+    rows = [{"card_id": f"sv1-{i}", "template_count": 2} for i in range(5)]
+    rows.append({"card_id": "sv1-partial", "template_count": 1})
+    client = _RPCClient(rows)
+
+    done = fetch_shadow_card_ids(client, "gen-a", min_templates=2, page_size=4)
+
+    assert done == {f"sv1-{i}" for i in range(5)}
+    assert client.ranges == [(0, 3), (4, 7)]
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Unit tests for job failure fingerprinting."""
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+import stage_timing  # noqa: E402
+from job_failures import classify_failure, input_hash_for, is_transient, record_job_failure  # noqa: E402
+
+
+class ReadTimeout(Exception):
+    """Stands in for httpx.ReadTimeout (matched by class name)."""
+
+
+@pytest.mark.parametrize(
+    "error, transient",
+    [
+        (ConnectionResetError("reset by peer"), True),
+        (TimeoutError(), True),
+        (ReadTimeout("read"), True),
+        (Exception("[WinError 10054] An existing connection was forcibly closed"), True),
+        (Exception("Pillow and pillow-heif failed. Error: cannot identify image file"), False),
+        (ValueError("Failed to insert detection record"), False),
+    ],
+)
+def test_transient_classification(error, transient):
+    assert is_transient(error) is transient
+
+
+def test_fingerprint_depends_on_type_stage_and_input():
+    base = classify_failure(ValueError("bad header"), "decode", "abc")
+    assert classify_failure(ValueError("other message"), "decode", "abc").fingerprint == base.fingerprint
+    assert classify_failure(KeyError("x"), "decode", "abc").fingerprint != base.fingerprint
+    assert classify_failure(ValueError("bad header"), "yolo", "abc").fingerprint != base.fingerprint
+    assert classify_failure(ValueError("bad header"), "decode", "def").fingerprint != base.fingerprint
+    assert base.error_class == "builtins.ValueError"
+
+
+def test_failing_span_is_left_as_active_stage():
+    with stage_timing.job_trace("job-1") as trace:
+        with stage_timing.span("download"):
+            pass
+        assert trace.active_stage is None
+        with pytest.raises(RuntimeError):
+            with stage_timing.span("identify"):
+                with stage_timing.span("embed"):
+                    raise RuntimeError("boom")
+        assert trace.active_stage == "embed"
+
+
+def test_input_hash_prefers_image_bytes_hash():
+    job = {"payload": {"storage_path": "u/1.jpg"}}
+    assert input_hash_for(job).startswith("path:")
+    job["content_sha256"] = "deadbeef"
+    assert input_hash_for(job) == "deadbeef"
+
+
+def test_record_job_failure_passes_fingerprint_and_falls_back_when_rpc_missing():
+    calls = []
+
+    class Client:
+        def rpc(self, name, params):
+            calls.append((name, params))
+            return SimpleNamespace(execute=lambda: SimpleNamespace(data="dead_letter"))
+
+    failure = classify_failure(ValueError("bad"), "decode", "abc")
+    assert record_job_failure(Client(), "job-1", "tok", failure, traceback_text="tb", max_retries=3) == "dead_letter"
+    name, params = calls[0]
+    assert name == "record_job_failure"
+    assert params["p_fingerprint"] == failure.fingerprint
+    assert params["p_transient"] is False and params["p_lease_token"] == "tok"
+
+    class Missing:
+        def rpc(self, name, params):
+            def execute():
+                raise Exception("PGRST202 Could not find the function public.record_job_failure")
+            return SimpleNamespace(execute=execute)
+
+    assert record_job_failure(Missing(), "job-1", "tok", failure) is None
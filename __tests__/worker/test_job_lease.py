@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Unit tests for background job lease renewal."""
+
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+from job_lease import JobLease, LeaseLost  # noqa: E402
+
+
+class _LeaseClient:
+    """Answers renew_job_lease from a scripted list (last entry repeats)."""
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.calls = []
+
+    def rpc(self, name, params):
+        assert name == "renew_job_lease"
+        self.calls.append(params)
+        answer = self.answers[0] if len(self.answers) == 1 else self.answers.pop(0)
+
+        def execute():
+            if isinstance(answer, Exception):
+                raise answer
+            return SimpleNamespace(data=answer)
+
+        return SimpleNamespace(execute=execute)
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_heartbeat_keeps_renewing_while_pipeline_runs():
+    client = _LeaseClient(["2025-01-01T00:01:00Z"])
+    with JobLease(client, "job-1", "tok", lease_seconds=1, renew_interval=0.05) as lease:
+        assert _wait_for(lambda: lease.renewals >= 3)
+        lease.ensure_held()
+
+    calls = len(client.calls)
+    time.sleep(0.15)
+    assert len(client.calls) == calls, "renewals must stop with the pipeline"
+    assert client.calls[0] == {"p_job_id": "job-1", "p_lease_token": "tok", "p_lease_seconds": 1}
+
+
+def test_rejected_renewal_marks_lease_lost():
+    client = _LeaseClient(["2025-01-01T00:01:00Z", None])
+    with JobLease(client, "job-1", "tok", lease_seconds=1, renew_interval=0.05) as lease:
+        assert _wait_for(lambda: lease.lost)
+        with pytest.raises(LeaseLost):
+            lease.ensure_held()
+
+
+def test_transient_errors_only_lose_lease_after_expiry():
+    now = [0.0]
+    client = _LeaseClient([ConnectionError("reset")])
+    lease = JobLease(client, "job-1", "tok", lease_seconds=30, renew_interval=10, clock=lambda: now[0])
+
+    now[0] = 10
+    assert lease.renew_once() is False
+    assert not lease.lost
+
+    now[0] = 31
+    lease.renew_once()
+    assert lease.lost
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Unit tests for the worker memory governor."""
+
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+import metrics  # noqa: E402
+from memory_governor import MB, MemoryGovernor  # noqa: E402
+
+
+class FakeProcess:
+    """RSS samples in MB; collecting drops RSS to ``after_collect``."""
+
+    def __init__(self, rss_mb, after_collect):
+        self.rss_mb = rss_mb
+        self.after_collect = after_collect
+        self.collects = self.trims = 0
+
+    def rss(self):
+        return self.rss_mb * MB
+
+    def collect(self):
+        self.collects += 1
+        self.rss_mb = self.after_collect
+        return 42
+
+    def trim(self):
+        self.trims += 1
+        return True
+
+
+def _governor(proc, budget_mb=1000):
+    return MemoryGovernor(
+        budget_bytes=budget_mb * MB, headroom_bytes=64 * MB,
+        sample_rss=proc.rss, sample_tensors=lambda: None,
+        collect=proc.collect, trim=proc.trim, empty_cache=lambda: None,
+    )
+
+
+def test_under_budget_checkpoint_does_nothing():
+    proc = FakeProcess(rss_mb=800, after_collect=700)
+    assert _governor(proc).checkpoint("crop_window") is None
+    assert proc.collects == 0 and proc.trims == 0
+
+
+def test_over_budget_collects_trims_and_reports_what_was_freed():
+    proc = FakeProcess(rss_mb=1200, after_collect=900)
+    before = metrics.MEMORY_RECLAIMS.value(stage="crop_window")
+
+    reclaim = _governor(proc).checkpoint("crop_window")
+
+    assert proc.collects == 1 and proc.trims == 1
+    assert reclaim.rss_reclaimed == 300 * MB and reclaim.gc_objects == 42 and reclaim.trimmed
+    assert metrics.MEMORY_RECLAIMS.value(stage="crop_window") == before + 1
+
+
+def test_reclaim_that_stays_over_budget_waits_for_growth():
+    proc = FakeProcess(rss_mb=1200, after_collect=1150)
+    governor = _governor(proc)
+    assert governor.checkpoint("crop_window") is not None
+
+    proc.after_collect = proc.rss_mb = 1180
+    assert governor.checkpoint("crop_window") is None, "within headroom of the last reclaim"
+    proc.rss_mb = 1250
+    assert governor.checkpoint("crop_window") is not None
+    assert proc.collects == 2
+
+
+def test_zero_budget_disables_sampling():
+    calls = []
+    governor = MemoryGovernor(budget_bytes=0, sample_rss=lambda: calls.append(1) or 0, sample_tensors=lambda: None)
+    assert governor.checkpoint("job") is None and calls == []
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Local scrape test for the worker metrics endpoint."""
+
+import socket
+import sys
+import urllib.request
+from pathlib import Path
+from types import SimpleNamespace
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+import metrics  # noqa: E402
+import stage_timing  # noqa: E402
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class _QueueStatsClient:
+    def __init__(self):
+        self.calls = 0
+
+    def rpc(self, name, params):
+        assert name == "queue_stats"
+        self.calls += 1
+        rows = [
+            {"status": "pending", "jobs": 7, "oldest_age_seconds": 42.5},
+            {"status": "processing", "jobs": 2, "oldest_age_seconds": 12.0},
+        ]
+        return SimpleNamespace(execute=lambda: SimpleNamespace(data=rows))
+
+
+def test_scrape_exposes_jobs_stages_and_queue(monkeypatch):
+    registry = stage_timing.StageRegistry()
+    monkeypatch.setattr(stage_timing, "registry", registry)
+    registry.record("yolo", 180.0)
+    registry.record("yolo", 900.0)
+    metrics.JOBS_PROCESSED.inc()
+    metrics.CROPS_PER_SCAN.observe(9)
+    metrics.record_cache("card_keys", hit=True)
+
+    client = _QueueStatsClient()
+    sampler = metrics.QueueSampler(client, interval_seconds=3600)
+    server = metrics.start_metrics_server(port=_free_port(), queue_sampler=sampler, host="127.0.0.1")
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        body = urllib.request.urlopen(url, timeout=5).read().decode()
+        urllib.request.urlopen(url, timeout=5).read()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert "# TYPE scan_worker_jobs_processed_total counter" in body
+    assert 'scan_worker_cache_requests_total{cache="card_keys",result="hit"}' in body
+    assert 'scan_worker_stage_duration_seconds_bucket{stage="yolo",le="0.25"} 1' in body
+    assert 'scan_worker_stage_duration_seconds_bucket{stage="yolo",le="+Inf"} 2' in body
+    assert 'scan_worker_stage_duration_seconds_count{stage="yolo"} 2' in body
+    assert 'scan_worker_queue_jobs{status="pending"} 7' in body
+    assert 'scan_worker_queue_oldest_age_seconds{status="pending"} 42.5' in body
+    assert "process_resident_memory_bytes" in body
+    assert client.calls == 1, "queue stats must be sampled, not queried per scrape"
+
+
+def test_disabled_without_port():
+    assert metrics.start_metrics_server(port=0) is None
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Unit tests for the embedder's visual-tower loading paths (open_clip stubbed, real torch)."""
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+from PIL import Image  # noqa: E402
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+sys.modules.setdefault("open_clip", SimpleNamespace())
+
+import openclip_embedder  # noqa: E402
+import precision_guard  # noqa: E402
+from shared_weights import export_state_dict  # noqa: E402
+
+EMBED_DIM = 8
+
+
+class _Tower(torch.nn.Module):
+    """Stand-in image tower: mean colour -> linear projection."""
+
+    def __init__(self, fail_in_bf16=False):
+        super().__init__()
+        self.proj = torch.nn.Linear(3, EMBED_DIM)
+        self.register_buffer("scale", torch.ones(1))
+        self.fail_in_bf16 = fail_in_bf16
+
+    def forward(self, x):
+        if self.fail_in_bf16 and x.dtype == torch.bfloat16:
+            raise RuntimeError("no bf16 kernel for this op")
+        return self.proj(x.mean(dim=(2, 3))) * self.scale
+
+
+class _Clip(torch.nn.Module):
+    def __init__(self, fail_in_bf16=False):
+        super().__init__()
+        torch.manual_seed(0)
+        self.visual = _Tower(fail_in_bf16)
+        self.text_projection = torch.nn.Linear(4, EMBED_DIM)
+
+
+def _fake_open_clip(create_model=None, fail_in_bf16=False):
+    calls = []
+
+    def default_create_model(name, pretrained=None, device=None, force_quick_gelu=False):
+        calls.append({"pretrained": pretrained, "device": device, "quick_gelu": force_quick_gelu})
+        return _Clip(fail_in_bf16)
+
+    return SimpleNamespace(
+        calls=calls,
+        get_model_config=lambda name: {"embed_dim": EMBED_DIM, "vision_cfg": {}} if name == "Fake" else None,
+        create_model=create_model or default_create_model,
+        create_model_and_transforms=lambda name, pretrained=None, cache_dir=None: (_Clip(fail_in_bf16), None, None),
+    )
+
+
+@pytest.fixture
+def fake_clip(monkeypatch, tmp_path):
+    monkeypatch.setenv("OPENCLIP_CACHE_DIR", str(tmp_path))
+    fake = _fake_open_clip()
+    monkeypatch.setattr(openclip_embedder, "open_clip", fake)
+    return fake
+
+
+def test_visual_tower_is_built_on_meta_through_the_public_api(fake_clip):
+    tower = openclip_embedder.build_visual_tower("Fake", "openai")
+
+    assert isinstance(tower, _Tower) and tower.proj.weight.is_meta
+    assert fake_clip.calls == [{"pretrained": None, "device": "meta", "quick_gelu": True}]
+    with pytest.raises(ValueError):
+        openclip_embedder.visual_tower_config("Unknown")
+
+
+def test_private_load_keeps_only_the_tower_and_reads_embed_dim_from_config(fake_clip):
+    embedder = openclip_embedder.OpenClipEmbedder(model_name="Fake", pretrained="fake", use_cuda_if_available=False)
+
+    assert embedder.embed_dim == EMBED_DIM and isinstance(embedder.model, _Tower)
+    assert embedder.shared_weights_path is None
+    assert embedder.embed(Image.new("RGB", (300, 420), "orange")).shape == (EMBED_DIM,)
+
+
+def test_shared_load_matches_the_private_load(fake_clip):
+    private = openclip_embedder.OpenClipEmbedder(model_name="Fake", pretrained="fake", use_cuda_if_available=False)
+    shared = openclip_embedder.OpenClipEmbedder(model_name="Fake", pretrained="fake", use_cuda_if_available=False,
+                                                shared_weights=True)
+
+    assert shared.shared_weights_path is not None and shared.shared_weights_path.exists()
+    crop = Image.new("RGB", (300, 420), "teal")
+    assert torch.allclose(torch.from_numpy(shared.embed(crop)), torch.from_numpy(private.embed(crop)), atol=1e-6)
+
+
+def test_mmap_refuses_a_checkpoint_with_missing_weights(fake_clip, tmp_path):
+    state_dict = _Clip().visual.state_dict()
+    del state_dict["proj.bias"]
+    path = tmp_path / "partial.safetensors"
+    export_state_dict(state_dict, path)
+    embedder = openclip_embedder.OpenClipEmbedder(model_name="Fake", pretrained="fake", use_cuda_if_available=False)
+
+    with pytest.raises(RuntimeError):
+        embedder._mmap_visual(path)
+
+
+def test_shared_load_failure_falls_back_to_the_private_load(monkeypatch, tmp_path):
+    def broken_create_model(*args, **kwargs):
+        raise TypeError("create_model() got an unexpected keyword argument 'force_quick_gelu'")
+
+    monkeypatch.setenv("OPENCLIP_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(openclip_embedder, "open_clip", _fake_open_clip(create_model=broken_create_model))
+    embedder = openclip_embedder.OpenClipEmbedder(model_name="Fake", pretrained="fake", use_cuda_if_available=False,
+                                                  shared_weights=True)
+
+    assert embedder.shared_weights_path is None and isinstance(embedder.model, _Tower)
+
+
+def test_failed_bf16_pass_keeps_fp32(monkeypatch, tmp_path):
+    monkeypatch.setenv("OPENCLIP_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(openclip_embedder, "open_clip", _fake_open_clip(fail_in_bf16=True))
+    monkeypatch.setattr(precision_guard, "load_reference", lambda *args, **kwargs: None)
+    monkeypatch.setattr(precision_guard, "save_reference", lambda *args, **kwargs: None)
+    embedder = openclip_embedder.OpenClipEmbedder(model_name="Fake", pretrained="fake", use_cuda_if_available=False,
+                                                  precision="bf16")
+
+    assert embedder.precision == "fp32" and embedder.dtype == torch.float32
+    assert embedder.precision_report.error and not embedder.precision_report.passed
+    assert embedder.embed(Image.new("RGB", (300, 420), "orange")).shape == (EMBED_DIM,)
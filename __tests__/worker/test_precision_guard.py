@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Unit tests for the reduced-precision accuracy guard."""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+import precision_guard  # noqa: E402
+
+
+def _unit(v):
+    v = np.asarray(v, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+
+def test_small_drift_passes_and_large_drift_is_refused():
+    rng = np.random.default_rng(0)
+    reference = {f"crop{i}": _unit(rng.normal(size=768)) for i in range(3)}
+    close = {k: _unit(v + rng.normal(scale=1e-3, size=768)) for k, v in reference.items()}
+    report = precision_guard.compare(reference, close, "bf16", max_drift=0.005)
+    assert report.passed and report.worst < 0.005
+
+    far = dict(close, crop1=_unit(rng.normal(size=768)))
+    report = precision_guard.compare(reference, far, "bf16", max_drift=0.005)
+    assert not report.passed and report.drift["crop1"] > 0.5
+
+
+def test_missing_candidate_fails_the_guard():
+    reference = {"a": _unit([1, 0, 0])}
+    assert not precision_guard.compare(reference, {}, "bf16").passed
+
+
+def test_failed_candidate_pass_never_passes():
+    report = precision_guard.GuardReport("bf16", 0.005, error="RuntimeError: no bf16 kernel")
+    assert not report.passed
+
+
+def test_reference_round_trip_is_keyed_by_model(tmp_path):
+    embeddings = {"greavard_crop": _unit([1, 2, 3])}
+    precision_guard.save_reference("ViT-L-14-336/openai/strict336-pad-v1", embeddings, cache_dir=tmp_path)
+
+    loaded = precision_guard.load_reference("ViT-L-14-336/openai/strict336-pad-v1", cache_dir=tmp_path)
+    assert np.allclose(loaded["greavard_crop"], embeddings["greavard_crop"])
+    assert precision_guard.load_reference("ViT-B-32/openai/strict336-pad-v1", cache_dir=tmp_path) is None
+    assert precision_guard.reference_path("ViT-L-14-336/openai/strict336-pad-v1", tmp_path).parent == tmp_path / "precision"
+
+
+def test_shipped_fixture_crops_load():
+    fixtures = precision_guard.load_fixtures()
+    assert len(fixtures) >= 3 and all(img.mode == "RGB" for img in fixtures.values())
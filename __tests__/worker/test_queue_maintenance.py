@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Unit tests for the cadence-gated stale job sweeper."""
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+from queue_maintenance import StaleJobSweeper, sweep_stale_jobs  # noqa: E402
+
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class _SweepClient:
+    def __init__(self, rows=None, error=None):
+        self.calls = []
+        self.rows = rows if rows is not None else [
+            {"swept": True, "requeued_count": 2, "failed_count": 1, "scans_updated": 3,
+             "requeued_job_ids": ["a", "b"], "failed_job_ids": ["c"]}
+        ]
+        self.error = error
+
+    def rpc(self, name, params):
+        self.calls.append((name, params))
+        client = self
+
+        class _Query:
+            def execute(self):
+                if client.error:
+                    raise client.error
+                return SimpleNamespace(data=client.rows)
+
+        return _Query()
+
+
+def test_sweep_stale_jobs_passes_intervals_and_parses_counts():
+    client = _SweepClient()
+
+    result = sweep_stale_jobs(client, max_retries=3, stale_after_minutes=15, min_interval_seconds=45)
+
+    name, params = client.calls[0]
+    assert name == "sweep_stale_jobs"
+    assert params == {"p_max_retries": 3, "p_stale_after": "900 seconds", "p_min_interval": "45 seconds"}
+    assert result.swept and result.requeued == 2 and result.failed == 1
+    assert result.failed_job_ids == ["c"]
+
+
+def test_sweeper_runs_on_cadence_not_every_loop():
+    client = _SweepClient()
+    clock = _FakeClock()
+    sweeper = StaleJobSweeper(client, interval_seconds=60, jitter_seconds=10, clock=clock, rng=lambda: 0.5)
+
+    # First sweep lands within the first jitter window
+    assert sweeper.maybe_sweep() is None
+    clock.now += 5
+    assert sweeper.maybe_sweep().requeued == 2
+
+    # Simulate a tight worker loop for the next minute: no extra RPCs until due again
+    for _ in range(50):
+        clock.now += 1
+        sweeper.maybe_sweep()
+    assert len(client.calls) == 1
+
+    clock.now += 10
+    sweeper.maybe_sweep()
+    assert len(client.calls) == 2
+    assert client.calls[1][1]["p_min_interval"] == "50 seconds"
+
+
+def test_sweeper_falls_back_when_rpc_missing():
+    client = _SweepClient(error=Exception("PGRST202 Could not find the function public.sweep_stale_jobs"))
+    clock = _FakeClock()
+    fallback_calls = []
+    sweeper = StaleJobSweeper(
+        client, interval_seconds=60, jitter_seconds=0, clock=clock, rng=lambda: 0.0,
+        fallback=fallback_calls.append,
+    )
+
+    sweeper.maybe_sweep()
+    clock.now += 60
+    sweeper.maybe_sweep()
+
+    assert len(client.calls) == 1, "missing RPC should not be retried"
+    assert fallback_calls == [client, client]
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Unit tests for content-hash scan dedupe."""
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+from scan_dedupe import clone_scan_results, compute_bbox_hash, content_hash, find_completed_scan  # noqa: E402
+
+
+class _Table:
+    """In-memory table supporting the query chains scan_dedupe uses."""
+
+    def __init__(self, client, name):
+        self.client, self.name = client, name
+        self.filters = {}
+        self.op, self.payload = "select", None
+
+    def select(self, _columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters[column] = value
+        return self
+
+    def order(self, *_args, **_kwargs):
+        return self
+
+    def limit(self, _n):
+        return self
+
+    def upsert(self, payload, on_conflict=None):
+        self.op, self.payload = "upsert", payload
+        return self
+
+    def update(self, payload):
+        self.op, self.payload = "update", payload
+        return self
+
+    def execute(self):
+        rows = self.client.tables.setdefault(self.name, [])
+        if self.op == "select":
+            return SimpleNamespace(data=[r for r in rows if all(r.get(k) == v for k, v in self.filters.items())])
+        if self.op == "update":
+            for r in rows:
+                if all(r.get(k) == v for k, v in self.filters.items()):
+                    r.update(self.payload)
+            self.client.updates.append((self.name, self.filters, self.payload))
+            return SimpleNamespace(data=[])
+        inserted = []
+        for item in self.payload:
+            row = dict(item, id=item.get("id") or f"{self.name}-{len(rows) + 1}")
+            rows.append(row)
+            inserted.append(row)
+        self.client.upserts.append((self.name, self.payload))
+        return SimpleNamespace(data=inserted)
+
+
+class _Client:
+    def __init__(self, tables):
+        self.tables = tables
+        self.updates, self.upserts = [], []
+
+    def from_(self, name):
+        return _Table(self, name)
+
+
+def _detection(det_id, scan_id, bbox, card=None):
+    return {
+        "id": det_id, "scan_id": scan_id, "crop_url": f"{scan_id}/crop.jpeg", "bbox": bbox,
+        "bbox_hash": compute_bbox_hash(scan_id, bbox), "confidence": 0.9, "guess_card_id": card,
+        "created_at": "2025-01-01T00:00:00Z",
+    }
+
+
+def test_lookup_ignores_unfinished_scans_but_accepts_own_finished_attempt():
+    digest = content_hash(b"binder page")
+    client = _Client({"scans": [
+        {"id": "other-processing", "status": "processing", "content_sha256": digest, "user_id": "user-1"},
+        {"id": "scan-2", "status": "processing", "content_sha256": digest, "user_id": "user-1"},
+    ]})
+
+    assert find_completed_scan(client, digest, "scan-9", "user-1") is None
+    assert find_completed_scan(client, digest, "scan-2", "user-1")["id"] == "scan-2"
+
+
+def test_lookup_never_reuses_another_users_scan():
+    digest = content_hash(b"binder page")
+    client = _Client({"scans": [{"id": "scan-a", "status": "ready", "content_sha256": digest, "user_id": "user-a"}]})
+
+    assert find_completed_scan(client, digest, "scan-b", "user-b") is None
+    assert find_completed_scan(client, digest, "scan-a2", "user-a")["id"] == "scan-a"
+
+
+def test_clone_copies_detections_and_links_user_cards():
+    client = _Client({
+        "scans": [{"id": "new", "status": "processing"}],
+        "card_detections": [
+            _detection("d1", "old", [0, 0, 10, 10], card="card-a"),
+            _detection("d2", "old", [20, 0, 10, 10], card="card-a"),
+            _detection("d3", "old", [40, 0, 10, 10]),
+        ],
+    })
+    source = {"id": "old", "status": "ready", "summary_image_path": "old/summary.jpeg"}
+
+    result = clone_scan_results(client, source, "new", "user-2")
+
+    cloned = [r for r in client.tables["card_detections"] if r["scan_id"] == "new"]
+    assert len(cloned) == 3
+    assert {r["bbox_hash"] for r in cloned} == {compute_bbox_hash("new", r["bbox"]) for r in cloned}
+    assert all(r["id"] not in ("d1", "d2", "d3") and "created_at" not in r for r in cloned)
+
+    user_cards = dict(client.upserts)["user_cards"]
+    assert len(user_cards) == 1, "one upsert row per (user_id, card_id)"
+    assert user_cards[0]["user_id"] == "user-2" and user_cards[0]["card_id"] == "card-a"
+
+    assert client.tables["scans"][0]["status"] == "ready"
+    assert result["summary_image_path"] == "old/summary.jpeg"
+    assert result["total_detections"] == 3 and result["user_cards_created"] == 2
+    assert result["cloned_from_scan_id"] == "old"
+
+
+def test_retry_of_finished_scan_reuses_rows_without_writing_detections():
+    client = _Client({
+        "scans": [{"id": "s1", "status": "processing"}],
+        "card_detections": [_detection("d1", "s1", [0, 0, 10, 10], card="card-a")],
+    })
+
+    result = clone_scan_results(client, {"id": "s1", "summary_image_path": "s1/summary.jpeg"}, "s1", "user-1")
+
+    assert client.upserts == []
+    assert result["detection_records"] == ["d1"]
+    assert client.tables["scans"][0]["status"] == "ready"
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Unit tests for set-centroid retrieval routing."""
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+from set_routing import SetCentroids, compute_set_centroids, match_templates_in_sets, route  # noqa: E402
+
+
+def unit(*values):
+    vec = np.asarray(values, dtype=np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+def test_centroids_are_normalized_set_means():
+    rows = [
+        {"card_id": "sv1-1", "set_id": "sv1", "emb": unit(1, 0, 0).tolist()},
+        {"card_id": "sv1-2", "set_id": "sv1", "emb": unit(0, 1, 0).tolist()},
+        {"card_id": "sv2-7", "set_id": None, "emb": "[0,0,1]"},  # set taken from the card id
+        {"card_id": "broken", "set_id": None, "emb": [0, 1, 0]},
+    ]
+    records = {r["set_id"]: r for r in compute_set_centroids(rows)}
+
+    assert set(records) == {"sv1", "sv2"}
+    assert np.allclose(records["sv1"]["emb"], unit(1, 1, 0), atol=1e-6)
+    assert records["sv1"]["card_count"] == 2 and records["sv2"]["card_count"] == 1
+
+
+def test_top_sets_ranks_centroids_by_similarity():
+    centroids = SetCentroids()
+    centroids.load_rows([
+        {"set_id": "a", "emb": unit(1, 0, 0).tolist()},
+        {"set_id": "b", "emb": unit(1, 1, 0).tolist()},
+        {"set_id": "c", "emb": unit(0, 0, 1).tolist()},
+    ])
+    top = centroids.top_sets(unit(1, 0.2, 0), 2)
+    assert [set_id for set_id, _ in top] == ["a", "b"]
+    assert top[0][1] > top[1][1]
+    assert len(centroids.top_sets(unit(1, 0, 0), 10)) == 3
+    assert SetCentroids().top_sets(unit(1, 0, 0), 4) == []
+
+
+class CentroidClient:
+    def __init__(self, rows):
+        self.rows = rows
+        self.fail = False
+        self.fetches = 0
+        self.rpc_calls = []
+
+    def from_(self, table):
+        assert table == "card_set_centroids"
+        client = self
+
+        class Query:
+            def select(self, columns):
+                return self
+
+            def range(self, start, end):
+                self.bounds = (start, end)
+                return self
+
+            def execute(self):
+                client.fetches += 1
+                if client.fail:
+                    raise RuntimeError("timeout")
+                return SimpleNamespace(data=client.rows[self.bounds[0]:self.bounds[1] + 1])
+
+        return Query()
+
+    def rpc(self, name, params):
+        self.rpc_calls.append((name, params))
+        return SimpleNamespace(execute=lambda: SimpleNamespace(data=[{"id": "t1", "card_id": "a-1", "set_id": "a", "score": 0.9}]))
+
+
+def test_route_refreshes_lazily_and_keeps_centroids_on_failure():
+    now = [0.0]
+    client = CentroidClient([{"set_id": "a", "emb": [1.0, 0.0]}, {"set_id": "b", "emb": [0.0, 1.0]}])
+    centroids = SetCentroids(refresh_seconds=60, clock=lambda: now[0])
+
+    assert route(unit(0.2, 1), client, top_sets=1, centroids=centroids) == ["b"]
+    assert route(unit(1, 0.2), client, top_sets=1, centroids=centroids) == ["a"]
+    assert client.fetches == 1
+
+    now[0] = 61.0
+    client.fail = True
+    assert route(unit(1, 0.2), client, top_sets=2, centroids=centroids) == ["a", "b"]
+    assert client.fetches == 2
+
+
+def test_routed_search_sends_the_chosen_sets():
+    client = CentroidClient([])
+    rows = match_templates_in_sets(unit(1, 0), client, ["a", "b"], 50)
+
+    assert rows[0]["card_id"] == "a-1"
+    name, params = client.rpc_calls[0]
+    assert name == "match_card_templates_in_sets"
+    assert params["set_ids"] == ["a", "b"] and params["match_count"] == 50
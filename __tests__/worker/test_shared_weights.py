@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""Unit tests for the shared safetensors weight files."""
+
+import json
+import struct
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+from shared_weights import mmap_arrays, read_header, write_safetensors  # noqa: E402
+
+
+def test_round_trip_is_contiguous_aligned_and_zero_copy(tmp_path):
+    path = tmp_path / "w.safetensors"
+    arrays = {
+        "ln.bias": np.arange(3, dtype=np.float16),
+        "proj": np.arange(12, dtype=np.float32).reshape(3, 4),
+        "steps": np.array([7], dtype=np.int64),
+    }
+    write_safetensors(path, arrays, metadata={"model_name": "ViT-test"})
+
+    data_start, header = read_header(path)
+    assert data_start % 8 == 0
+    assert header.pop("__metadata__") == {"model_name": "ViT-test"}
+    spans = sorted(entry["data_offsets"] for entry in header.values())
+    assert spans[0][0] == 0 and all(a[1] == b[0] for a, b in zip(spans, spans[1:])), "no holes between tensors"
+
+    loaded, tags, metadata = mmap_arrays(path)
+    assert tags == {"ln.bias": "F16", "proj": "F32", "steps": "I64"}
+    for name, array in arrays.items():
+        assert np.array_equal(loaded[name], array) and loaded[name].dtype == array.dtype
+    assert loaded["proj"].base is not None, "arrays are views into the mapping"
+
+
+def test_writes_to_mapped_weights_stay_private(tmp_path):
+    path = tmp_path / "w.safetensors"
+    write_safetensors(path, {"w": np.zeros(4, dtype=np.float32)})
+
+    loaded, _, _ = mmap_arrays(path)
+    loaded["w"][0] = 1.0
+
+    assert mmap_arrays(path)[0]["w"][0] == 0.0
+
+
+def test_header_matches_the_safetensors_layout(tmp_path):
+    path = tmp_path / "w.safetensors"
+    write_safetensors(path, {"w": np.ones((2, 2), dtype=np.float32)})
+    raw = path.read_bytes()
+    (length,) = struct.unpack("<Q", raw[:8])
+    header = json.loads(raw[8:8 + length])
+    assert header["w"] == {"dtype": "F32", "shape": [2, 2], "data_offsets": [0, 16]}
+    assert len(raw) == 8 + length + 16
+
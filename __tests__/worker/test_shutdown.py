@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Unit tests for graceful drain on SIGTERM."""
+
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+from job_lease import JobLease, LeaseLost  # noqa: E402
+from shutdown import GracefulShutdown  # noqa: E402
+
+
+class _ReleaseClient:
+    def __init__(self, held=True):
+        self.held = held
+        self.calls = []
+
+    def rpc(self, name, params):
+        self.calls.append((name, params))
+        data = self.held if name == "release_job_lease" else "2025-01-01T00:01:00Z"
+        return SimpleNamespace(execute=lambda: SimpleNamespace(data=data))
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_release_puts_job_back_and_aborts_pipeline():
+    client = _ReleaseClient()
+    lease = JobLease(client, "job-1", "tok", lease_seconds=60, renew_interval=30)
+
+    assert lease.release() is True
+    assert lease.released
+    assert ("release_job_lease", {"p_job_id": "job-1", "p_lease_token": "tok"}) in client.calls
+    with pytest.raises(LeaseLost):
+        lease.ensure_held()
+
+
+def test_in_flight_job_is_released_when_grace_period_runs_out():
+    client = _ReleaseClient()
+    shutdown = GracefulShutdown(grace_seconds=0.05)
+    lease = JobLease(client, "job-1", "tok", lease_seconds=60, renew_interval=30)
+
+    with shutdown.track(lease):
+        shutdown.request("SIGTERM")
+        assert shutdown.draining
+        assert _wait_for(lambda: lease.released)
+        with pytest.raises(LeaseLost):
+            lease.ensure_held()
+
+
+def test_job_finishing_within_grace_is_not_released():
+    client = _ReleaseClient()
+    shutdown = GracefulShutdown(grace_seconds=0.1)
+    lease = JobLease(client, "job-1", "tok", lease_seconds=60, renew_interval=30)
+
+    with shutdown.track(lease):
+        shutdown.request("SIGTERM")
+    time.sleep(0.2)
+
+    assert not lease.released
+    assert not any(name == "release_job_lease" for name, _ in client.calls)
+    lease.ensure_held()
+
+
+def test_job_claimed_while_draining_gets_the_remaining_grace():
+    client = _ReleaseClient()
+    now = [100.0]
+    shutdown = GracefulShutdown(grace_seconds=5, clock=lambda: now[0])
+    shutdown.request("SIGTERM")
+    now[0] = 110.0  # deadline already passed
+    lease = JobLease(client, "job-1", "tok", lease_seconds=60, renew_interval=30)
+
+    with shutdown.track(lease):
+        assert _wait_for(lambda: lease.released)
+
+
+def test_wait_returns_early_once_draining():
+    shutdown = GracefulShutdown(grace_seconds=0)
+    assert shutdown.wait(0.01) is False
+
+    shutdown.request("SIGTERM")
+    started = time.monotonic()
+    assert shutdown.wait(5) is True
+    assert time.monotonic() - started < 1
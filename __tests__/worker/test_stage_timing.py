@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Unit tests for per-stage latency histograms and job traces."""
+
+import json
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+import stage_timing  # noqa: E402
+from stage_timing import LatencyHistogram, StageRegistry  # noqa: E402
+
+
+def test_histogram_percentiles_within_relative_error():
+    rng = random.Random(7)
+    values = [rng.lognormvariate(3.0, 1.0) for _ in range(20000)]
+    hist = LatencyHistogram()
+    for v in values:
+        hist.record(v)
+
+    ordered = sorted(values)
+    for q in (50, 95, 99):
+        exact = ordered[int(q / 100 * len(ordered)) - 1]
+        assert hist.percentile(q) == pytest.approx(exact, rel=0.05)
+    assert hist.count == len(values)
+    assert len(hist.counts) < 200, "bucket count must stay bounded"
+    buckets = hist.cumulative_buckets()
+    assert buckets[-1][1] == hist.count
+    assert all(a[0] < b[0] for a, b in zip(buckets, buckets[1:]))
+
+
+def test_spans_feed_job_trace_and_registry(monkeypatch):
+    registry = StageRegistry()
+    monkeypatch.setattr(stage_timing, "registry", registry)
+
+    with stage_timing.job_trace("job-1") as trace:
+        for _ in range(3):
+            with stage_timing.span("embed_view"):
+                pass
+        stage_timing.record("template_rpc", 12.5)
+        with pytest.raises(RuntimeError):
+            with stage_timing.span("yolo"):
+                raise RuntimeError("boom")
+
+    with stage_timing.span("outside"):
+        pass
+
+    breakdown = trace.breakdown()
+    assert breakdown["stages"]["embed_view"]["count"] == 3
+    assert breakdown["stages"]["template_rpc"]["total_ms"] == 12.5
+    assert "yolo" in breakdown["stages"], "failed stages are still timed"
+    assert "outside" not in breakdown["stages"]
+    summaries = registry.summaries()
+    assert summaries["embed_view"]["count"] == 3
+    assert summaries["job_total"]["count"] == 1
+    assert summaries["outside"]["count"] == 1
+
+
+def test_flush_writes_summary_on_interval(tmp_path):
+    registry = StageRegistry()
+    registry.record("download", 40.0)
+    path = tmp_path / "stages.json"
+
+    assert registry.maybe_flush(interval_seconds=3600, path=path) is False
+    assert registry.maybe_flush(interval_seconds=3600, path=path, force=True) is True
+
+    data = json.loads(path.read_text())
+    assert data["stages"]["download"]["count"] == 1
+    assert data["stages"]["download"]["p50_ms"] == pytest.approx(40.0, rel=0.05)
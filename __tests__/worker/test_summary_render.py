@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Unit tests for background summary preview rendering."""
+
+import io
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+from PIL import Image
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+import summary_render  # noqa: E402
+
+
+class FakeClient:
+    def __init__(self, fail_upload=False):
+        self.fail_upload = fail_upload
+        self.uploads = {}
+        self.updates = []
+        self.scans = {}
+        self.storage = SimpleNamespace(from_=lambda bucket: SimpleNamespace(upload=self._upload))
+
+    def _upload(self, path, file, file_options):
+        if self.fail_upload:
+            raise RuntimeError("storage unavailable")
+        self.uploads[path] = file
+
+    def from_(self, table):
+        client = self
+
+        class Query:
+            payload = None
+
+            def select(self, columns):
+                return self
+
+            def update(self, payload):
+                self.payload = payload
+                return self
+
+            def eq(self, column, value):
+                self.key = value
+                if self.payload is not None:
+                    client.updates.append((table, self.payload, value))
+                    client.scans.setdefault(value, {}).update(self.payload)
+                return self
+
+            def execute(self):
+                row = client.scans.get(self.key)
+                return SimpleNamespace(data=[dict(row)] if self.payload is None and row else [])
+
+        return Query()
+
+
+def test_preview_is_bounded_and_boxes_follow_the_downscale():
+    image = Image.new("RGB", (2000, 1000), "white")
+    data = summary_render.render_summary(image, [[1000, 500, 1400, 900]], max_side=500)
+
+    preview = Image.open(io.BytesIO(data))
+    assert preview.size == (500, 250)
+    assert image.getpixel((1000, 500)) == (255, 255, 255), "source image must not be drawn on"
+    r, g, b = preview.convert("RGB").getpixel((250, 200))  # left edge of the scaled box
+    assert r > 180 and g < 90 and b < 90
+
+
+def test_publish_uploads_then_links_the_summary():
+    client = FakeClient()
+    future = summary_render.submit(client, "scan-1", Image.new("RGB", (800, 600)), [[10, 10, 100, 100]])
+    assert summary_render.wait_pending(timeout=5)
+
+    assert future.result() == "scan-1/summary.jpeg"
+    assert "scan-1/summary.jpeg" in client.uploads
+    assert client.updates == [("scans", {"summary_image_path": "scan-1/summary.jpeg"}, "scan-1")]
+
+
+def test_failed_upload_leaves_the_scan_without_a_preview():
+    client = FakeClient(fail_upload=True)
+    assert summary_render.publish_summary(client, "scan-1", Image.new("RGB", (64, 64)), []) is None
+    assert client.updates == []
+
+
+def test_clone_shares_the_source_preview_once_its_render_lands():
+    client = FakeClient()
+    summary_render.submit(client, "scan-1", Image.new("RGB", (800, 600)), [[10, 10, 100, 100]])
+    link = summary_render.submit_link(client, "scan-2", "scan-1")
+    assert summary_render.wait_pending(timeout=5)
+
+    assert link.result() == "scan-1/summary.jpeg"
+    assert client.scans["scan-2"]["summary_image_path"] == "scan-1/summary.jpeg"
+    assert summary_render.link_summary(client, "scan-3", "missing") is None
+    assert "scan-3" not in client.scans
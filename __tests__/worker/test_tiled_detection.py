@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Unit tests for tiled two-level card detection."""
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+import tiled_detection  # noqa: E402
+from tiled_detection import merge_boxes, plan_tiles  # noqa: E402
+
+
+def test_grid_follows_image_size():
+    assert plan_tiles((2000, 1500), tile_side=2048) == []
+    assert len(plan_tiles((4032, 3024), tile_side=2048)) == 4
+    assert len(plan_tiles((8064, 6048), tile_side=2048, max_grid=3)) == 9
+
+
+def test_tiles_cover_the_page_and_hold_every_pocket_whole():
+    w, h = 8064, 6048
+    tiles = plan_tiles((w, h), tile_side=2048, overlap=0.35, max_grid=3)
+    assert min(t[0] for t in tiles) == 0 and max(t[2] for t in tiles) == w
+    assert min(t[1] for t in tiles) == 0 and max(t[3] for t in tiles) == h
+    for row in range(3):
+        for col in range(3):
+            card = (col * w / 3, row * h / 3, (col + 1) * w / 3, (row + 1) * h / 3)
+            assert any(t[0] <= card[0] and t[1] <= card[1] and t[2] >= card[2] and t[3] >= card[3] for t in tiles)
+
+
+def test_merge_prefers_whole_boxes_and_keeps_neighbours():
+    boxes = [
+        (100, 100, 400, 500, 0.80),  # whole card from the overview
+        (100, 100, 300, 500, 0.95),  # same card cut by a tile edge
+        (102, 98, 401, 503, 0.70),   # duplicate from another tile
+        (410, 100, 700, 500, 0.60),  # the neighbouring pocket
+    ]
+    clipped = [False, True, False, False]
+    assert merge_boxes(boxes, clipped) == [0, 3]
+    assert merge_boxes([], []) == []
+
+
+def test_detect_runs_one_batch_and_maps_tiles_to_page_space():
+    page = Image.new("RGB", (6000, 4000), "white")
+    overview, scale = page.resize((2048, 1365)), 2048 / 6000
+    tiles = plan_tiles(page.size, tile_side=2048, overlap=0.35, max_grid=3)
+    tile = tiles[4]
+    seen = []
+
+    def predict(images, conf, verbose):
+        seen.append([im.size for im in images])
+        out = [SimpleNamespace(boxes=[]) for _ in images]
+        tile_scale = images[5].size[0] / (tile[2] - tile[0])
+        x1, y1 = (3000 - tile[0]) * tile_scale, (2000 - tile[1]) * tile_scale
+        out[5] = SimpleNamespace(boxes=[SimpleNamespace(
+            xyxy=np.array([[x1, y1, x1 + 300 * tile_scale, y1 + 400 * tile_scale]]), conf=np.array([0.9]))])
+        return out
+
+    boxes = tiled_detection.detect(SimpleNamespace(predict=predict), page, overview, scale, tiles, conf=0.25, tile_input=1024)
+
+    assert len(seen) == 1 and len(seen[0]) == 1 + len(tiles)
+    assert all(max(size) <= 2048 for size in seen[0])
+    assert len(boxes) == 1
+    x1, y1, x2, y2, confidence = boxes[0]
+    assert np.allclose([x1, y1, x2, y2], [3000, 2000, 3300, 2400], atol=2)
+    assert confidence == 0.9
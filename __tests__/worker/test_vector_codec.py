@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Unit tests for the shared pgvector codec."""
+
+import io
+import json
+import struct
+import sys
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT_DIR / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+from vector_codec import (  # noqa: E402
+    COPY_BINARY_SIGNATURE,
+    decode_vector_binary,
+    encode_vector_binary,
+    format_vector,
+    parse_vector,
+    parse_vectors,
+    write_copy_binary,
+)
+
+
+def _unit_vectors(rows=4, dim=768):
+    rng = np.random.default_rng(7)
+    vecs = rng.standard_normal((rows, dim)).astype(np.float32)
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        "[0.5,-0.25,1]",
+        "0.5,-0.25,1",
+        "{0.5,-0.25,1}",
+        " [0.5, -0.25, 1] ",
+        [0.5, -0.25, 1.0],
+        np.array([0.5, -0.25, 1.0], dtype=np.float64),
+    ],
+)
+def test_parse_vector_accepts_all_payload_shapes(raw):
+    vec = parse_vector(raw)
+    assert vec.dtype == np.float32
+    assert vec.tolist() == [0.5, -0.25, 1.0]
+
+
+def test_parse_vector_rejects_garbage_and_checks_dim():
+    assert parse_vector(None) is None
+    assert parse_vector("[]") is None
+    assert parse_vector("[0.1,abc,0.3]") is None
+    with pytest.raises(ValueError):
+        parse_vector("[0.1,0.2]", dim=768)
+
+
+def test_format_vector_round_trips_float32_and_is_compact():
+    vecs = _unit_vectors()
+    texts = [format_vector(v) for v in vecs]
+
+    assert np.array_equal(parse_vectors(texts), vecs)
+    assert len(texts[0]) < len(json.dumps(vecs[0].tolist()))
+    # Compact text is valid JSON, so PostgREST and pgvector both accept it
+    assert np.array_equal(np.asarray(json.loads(texts[0]), dtype=np.float32), vecs[0])
+
+
+def test_parse_vectors_bulk_matches_row_by_row():
+    vecs = _unit_vectors(rows=3, dim=8)
+    mixed = [format_vector(vecs[0]), vecs[1].tolist(), format_vector(vecs[2])]
+
+    assert np.array_equal(parse_vectors(mixed), vecs)
+    assert np.array_equal(parse_vectors([v.tolist() for v in vecs]), vecs)
+    assert parse_vectors([], dim=8).shape == (0, 8)
+    with pytest.raises(ValueError):
+        parse_vectors(["[1,2]", "[1,2,3]"])
+    # Ragged rows whose total happens to fill the matrix are not reshaped
+    with pytest.raises(ValueError):
+        parse_vectors(["[1,2,3]", "[4,5,6,7,8]"], dim=4)
+    with pytest.raises(ValueError):
+        parse_vectors(["[1,2,3]", "[4,5,6,7,8]"])
+
+
+def test_binary_vector_round_trip():
+    vec = _unit_vectors(rows=1, dim=16)[0]
+    buf = encode_vector_binary(vec)
+
+    assert struct.unpack_from("!hh", buf) == (16, 0)
+    assert np.array_equal(decode_vector_binary(buf), vec)
+    assert np.array_equal(parse_vector(buf), vec)
+
+
+def test_write_copy_binary_framing():
+    template_id = uuid.uuid4()
+    vec = np.array([1.0, 2.0], dtype=np.float32)
+    out = io.BytesIO()
+
+    write_copy_binary(out, [(template_id, "sv1-1", None, vec)])
+    data = out.getvalue()
+
+    assert data.startswith(COPY_BINARY_SIGNATURE)
+    body = data[len(COPY_BINARY_SIGNATURE) + 8:]
+    assert struct.unpack_from("!h", body, 0) == (4,)
+    offset = 2
+    assert struct.unpack_from("!i", body, offset) == (16,)
+    assert body[offset + 4:offset + 20] == template_id.bytes
+    offset += 20
+    assert struct.unpack_from("!i", body, offset) == (5,)
+    assert body[offset + 4:offset + 9] == b"sv1-1"
+    offset += 9
+    assert struct.unpack_from("!i", body, offset) == (-1,)
+    offset += 4
+    (vec_len,) = struct.unpack_from("!i", body, offset)
+    assert np.array_equal(decode_vector_binary(body[offset + 4:offset + 4 + vec_len]), vec)
+    assert data.endswith(struct.pack("!h", -1))
@@ -294,3 +294,167 @@ def test_resolve_card_uuid_auto_creation_sets_image_fields():
     assert client.upserts == [
         {"source": "clip", "external_id": "sv1-1", "card_id": "uuid-123"}
     ]
+
+
+class FencedCompletionClient:
+    """Lease RPC rejects the completion; no table writes should follow."""
+
+    def __init__(self, accepted):
+        self.accepted = accepted
+        self.rpc_calls = []
+        self.tables = []
+
+    def rpc(self, name, params):
+        self.rpc_calls.append((name, params))
+        return SimpleNamespace(execute=lambda: SimpleNamespace(data=self.accepted))
+
+    def from_(self, table_name):
+        self.tables.append(table_name)
+        return FakeQuery(self, table_name)
+
+    def _execute(self, query):
+        return SimpleNamespace(data=[])
+
+
+def test_update_job_status_is_fenced_on_lease_ownership():
+    superseded = FencedCompletionClient(accepted=False)
+    assert worker_module.update_job_status(superseded, "job-1", "scan-1", "review_pending", lease_token="tok-old") is False
+    assert superseded.rpc_calls[0][0] == "complete_job_lease"
+    assert superseded.rpc_calls[0][1]["p_status"] == "completed"
+    assert superseded.tables == [], "superseded worker must not touch the scan"
+
+    owner = FencedCompletionClient(accepted=True)
+    assert worker_module.update_job_status(owner, "job-1", "scan-1", "review_pending", lease_token="tok-new") is True
+    assert owner.tables == ["scans"]
+
+
+class PipelineClient:
+    """Accepts every write the scan pipeline makes; serves one JPEG from storage."""
+
+    def __init__(self, image_bytes):
+        self.image_bytes = image_bytes
+        self.uploads = []
+        self.detections = []
+        self.storage = SimpleNamespace(from_=lambda bucket: SimpleNamespace(
+            download=lambda path: self.image_bytes,
+            upload=lambda path, file, file_options: self.uploads.append(path),
+        ))
+
+    def from_(self, table_name):
+        return FakeQuery(self, table_name)
+
+    def _execute(self, query):
+        if query.table == "scan_uploads":
+            return SimpleNamespace(data=[{"user_id": "user-1", "scan_title": "Binder"}])
+        if query.table == "card_detections":
+            self.detections.append(query.payload)
+            return SimpleNamespace(data=[{"id": f"det-{len(self.detections)}"}])
+        if query.operation == "upsert":
+            return SimpleNamespace(data=[query.payload])
+        return SimpleNamespace(data=[])
+
+
+def test_pipeline_streams_crops_through_a_bounded_window(monkeypatch):
+    import io
+    import weakref
+
+    from PIL import Image
+
+    import stage_timing
+
+    page = io.BytesIO()
+    Image.new("RGB", (900, 600), "white").save(page, format="JPEG")
+    client = PipelineClient(page.getvalue())
+
+    boxes = [SimpleNamespace(xyxy=np.array([[x, 100.0, x + 80.0, 210.0]]), conf=np.array([0.9 - x / 10000]))
+             for x in range(0, 700, 100)]
+    model = SimpleNamespace(predict=lambda image, **kwargs: [SimpleNamespace(boxes=boxes)])
+
+    seen = []
+    windows = []
+
+    memos = []
+
+    def fake_identify(crops, supabase_client, topk=200, set_hint=None, preprocessed=False, memo=None):
+        assert preprocessed and all(crop.size == (336, 336) for crop in crops)
+        memos.append(memo)
+        alive = sum(1 for ref in seen if ref() is not None)
+        windows.append((len(crops), alive))
+        seen.extend(weakref.ref(crop) for crop in crops)
+        return [{"card_id": None, "best_score": 0.1} for _ in crops]
+
+    monkeypatch.setattr(worker_module, "CROP_WINDOW", 3)
+    monkeypatch.setattr(worker_module, "CROP_DEDUPE", True)
+    monkeypatch.setattr(worker_module, "SCAN_CONTENT_DEDUPE", False)
+    monkeypatch.setattr(worker_module, "USE_RETRIEVAL_V2", True)
+    monkeypatch.setattr(worker_module, "RETRIEVAL_TOPK", 50, raising=False)
+    monkeypatch.setattr(worker_module, "identify_v2_batch", fake_identify, raising=False)
+
+    job = {"job_id": "job-1", "scan_upload_id": "scan-1", "payload": {"storage_path": "user-1/page.jpg"}}
+    with stage_timing.job_trace("job-1") as trace:
+        results = worker_module.run_normalized_pipeline(client, job, model, None)
+
+    assert results["total_detections"] == 7 and len(client.detections) == 7
+    assert [size for size, _ in windows] == [3, 3, 1]
+    assert all(alive == 0 for _, alive in windows), "earlier windows' crops should be released"
+    assert memos[0] is not None and all(memo is memos[0] for memo in memos), "one dedupe memo per scan"
+    stages = trace.breakdown()["stages"]
+    assert stages["crop_encode"]["count"] == 7
+    assert stages["crop_encode"]["rss_max_mb"] > 0 and stages["identify"]["rss_max_mb"] > 0
+
+
+def test_pipeline_bundle_mode_uploads_crops_once(monkeypatch):
+    import io
+
+    from PIL import Image
+
+    import summary_render
+
+    page = io.BytesIO()
+    Image.new("RGB", (900, 600), "white").save(page, format="JPEG")
+    client = PipelineClient(page.getvalue())
+
+    boxes = [SimpleNamespace(xyxy=np.array([[x, 100.0, x + 80.0, 210.0]]), conf=np.array([0.9 - x / 10000]))
+             for x in range(0, 700, 100)]
+    model = SimpleNamespace(predict=lambda image, **kwargs: [SimpleNamespace(boxes=boxes)])
+
+    monkeypatch.setattr(worker_module, "CROP_BUNDLE", True)
+    monkeypatch.setattr(worker_module, "SCAN_CONTENT_DEDUPE", False)
+    monkeypatch.setattr(worker_module, "USE_RETRIEVAL_V2", True)
+    monkeypatch.setattr(worker_module, "RETRIEVAL_TOPK", 50, raising=False)
+    monkeypatch.setattr(worker_module, "identify_v2_batch", lambda crops, *a, **k: [{"card_id": None, "best_score": 0.1} for _ in crops], raising=False)
+
+    job = {"job_id": "job-1", "scan_upload_id": "scan-1", "payload": {"storage_path": "user-1/page.jpg"}}
+    worker_module.run_normalized_pipeline(client, job, model, None)
+    summary_render.wait_pending(timeout=5)
+
+    assert [path for path in client.uploads if path != "scan-1/summary.jpeg"] == ["scan-1/crops.bundle"]
+    assert [d["crop_url"] for d in client.detections] == [f"scan-1/crop_{n}.jpeg" for n in range(1, 8)]
+
+
+def test_pipeline_defers_blank_low_confidence_crops_without_identifying(monkeypatch):
+    import io
+
+    from PIL import Image
+
+    page = io.BytesIO()
+    Image.new("RGB", (900, 600), "white").save(page, format="JPEG")
+    client = PipelineClient(page.getvalue())
+
+    boxes = [SimpleNamespace(xyxy=np.array([[x, 100.0, x + 80.0, 210.0]]), conf=np.array([0.3]))
+             for x in range(0, 300, 100)]
+    model = SimpleNamespace(predict=lambda image, **kwargs: [SimpleNamespace(boxes=boxes)])
+    identified = []
+
+    monkeypatch.setattr(worker_module, "CROP_GATE", True)
+    monkeypatch.setattr(worker_module, "SCAN_CONTENT_DEDUPE", False)
+    monkeypatch.setattr(worker_module, "USE_RETRIEVAL_V2", True)
+    monkeypatch.setattr(worker_module, "RETRIEVAL_TOPK", 50, raising=False)
+    monkeypatch.setattr(worker_module, "identify_v2_batch", lambda crops, *a, **k: identified.extend(crops) or [], raising=False)
+
+    job = {"job_id": "job-1", "scan_upload_id": "scan-1", "payload": {"storage_path": "user-1/page.jpg"}}
+    results = worker_module.run_normalized_pipeline(client, job, model, None)
+
+    assert identified == []
+    assert results["total_detections"] == 3 and len(client.detections) == 3
+    assert all("guess_external_id" not in d for d in client.detections)
@@ -43,6 +43,8 @@ export async function POST(
       job_type: 'process_scan_page',
       payload: {
         storage_path: upload.storage_path,
+        // An explicit retry means the user wants a fresh run, not a copy of the previous result
+        force_reprocess: true,
       },
     });
 
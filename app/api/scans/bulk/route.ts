@@ -60,6 +60,7 @@ export async function POST(request: NextRequest) {
       p_user_id: userId,
       p_scan_id: scanId,
       p_storage_path: filePath,
+      p_priority: -1, // bulk uploads yield to interactive scans
     });
     
     if (rpcError) {
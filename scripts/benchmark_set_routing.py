@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Recall/cost benchmark for hierarchical (set -> card) retrieval.
+
+For each --top-sets value, reports how often the query's true set is among the
+routed sets, card recall@1/@5 when only the routed sets' cards are searched
+versus the global search, and the share of the gallery scanned (the cost the
+routed RPC pays). Search runs locally with numpy over card prototypes. The numbers describe the
+routing step, not pgvector or RPC latency.
+
+Queries are sampled card_templates rows (--source db, the default) or a
+synthetic gallery (--source synthetic, no database needed). --noise perturbs
+each query to mimic a real photo being further from its templates.
+
+Usage:
+    python scripts/benchmark_set_routing.py [--queries 500] [--top-sets 2 4 8 16] [--noise 0.5]
+    python scripts/benchmark_set_routing.py --source synthetic --sets 300 --cards-per-set 150
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from worker.set_routing import SetCentroids, compute_set_centroids, set_of  # noqa: E402
+from worker.vector_codec import parse_vector  # noqa: E402
+
+PAGE_SIZE = 500
+
+
+def _unit(mat: np.ndarray) -> np.ndarray:
+    return (mat / np.linalg.norm(mat, axis=-1, keepdims=True)).astype(np.float32)
+
+
+def synthetic_gallery(n_sets: int, cards_per_set: int, dim: int, seed: int) -> Tuple[List[Dict], np.ndarray, List[str]]:
+    """Prototype rows plus template-like query vectors and their card ids."""
+    rng = np.random.default_rng(seed)
+    set_dirs = _unit(rng.normal(size=(n_sets, dim)))
+    rows, templates, labels = [], [], []
+    for s in range(n_sets):
+        cards = _unit(set_dirs[s] + 0.9 * _unit(rng.normal(size=(cards_per_set, dim))))
+        for c, vec in enumerate(cards):
+            card_id = f"set{s}-{c}"
+            rows.append({"card_id": card_id, "set_id": f"set{s}", "emb": vec.tolist()})
+            templates.append(_unit(vec + 0.35 * _unit(rng.normal(size=dim))))
+            labels.append(card_id)
+    return rows, np.vstack(templates), labels
+
+
+def _paged(supabase_client, table: str, columns: str, limit: int = 0) -> List[Dict]:
+    rows: List[Dict] = []
+    start = 0
+    while True:
+        page = (
+            supabase_client.table(table).select(columns).order("card_id", desc=False)
+            .range(start, start + PAGE_SIZE - 1).execute()
+        ).data or []
+        rows.extend(page)
+        if len(page) < PAGE_SIZE or (limit and len(rows) >= limit):
+            return rows[:limit] if limit else rows
+        start += PAGE_SIZE
+
+
+def db_gallery(queries: int, seed: int) -> Tuple[List[Dict], np.ndarray, List[str]]:
+    from worker.config import get_supabase_client
+
+    supabase = get_supabase_client()
+    prototypes = _paged(supabase, "card_prototypes", "card_id,set_id,emb")
+    templates = _paged(supabase, "card_templates", "card_id,emb")
+    rng = np.random.default_rng(seed)
+    picked = rng.choice(len(templates), size=min(queries, len(templates)), replace=False)
+    vecs, labels = [], []
+    for i in picked:
+        vec = parse_vector(templates[i].get("emb"))
+        if vec is not None:
+            vecs.append(vec)
+            labels.append(templates[i]["card_id"])
+    return prototypes, np.vstack(vecs).astype(np.float32), labels
+
+
+def run(prototype_rows: List[Dict], queries: np.ndarray, labels: List[str], top_sets: List[int], noise: float,
+        seed: int) -> None:
+    card_ids, card_sets, card_vecs = [], [], []
+    for row in prototype_rows:
+        vec = parse_vector(row.get("emb"))
+        set_id = set_of(row.get("card_id"), row.get("set_id"))
+        if vec is not None and set_id:
+            card_ids.append(row["card_id"])
+            card_sets.append(set_id)
+            card_vecs.append(vec)
+    cards = np.vstack(card_vecs).astype(np.float32)
+    card_sets_arr = np.asarray(card_sets)
+    set_by_card = dict(zip(card_ids, card_sets))
+
+    centroids = SetCentroids()
+    centroids.load_rows(compute_set_centroids(prototype_rows))
+    print(f"[INFO] Gallery: {len(card_ids)} cards in {len(centroids.set_ids)} sets; {len(labels)} queries, noise={noise}")
+
+    if noise > 0:
+        rng = np.random.default_rng(seed + 1)
+        queries = _unit(queries + noise * _unit(rng.normal(size=queries.shape)))
+
+    def recall(order: np.ndarray, label: str, k: int) -> bool:
+        return label in {card_ids[i] for i in order[:k]}
+
+    global_scores = queries @ cards.T
+    global_top = np.argsort(-global_scores, axis=1)[:, :5]
+    g1 = np.mean([recall(global_top[q], labels[q], 1) for q in range(len(labels))])
+    g5 = np.mean([recall(global_top[q], labels[q], 5) for q in range(len(labels))])
+    print(f"{'mode':<14}{'set@S':>8}{'card@1':>9}{'card@5':>9}{'scanned':>10}")
+    print(f"{'global':<14}{'-':>8}{g1:>9.3f}{g5:>9.3f}{1.0:>10.3f}")
+
+    for s in top_sets:
+        set_hits = hits1 = hits5 = 0
+        scanned = 0
+        for q, label in enumerate(labels):
+            routed = [set_id for set_id, _ in centroids.top_sets(queries[q], s)]
+            mask = np.isin(card_sets_arr, routed)
+            idx = np.flatnonzero(mask)
+            scanned += len(idx)
+            order = idx[np.argsort(-(cards[idx] @ queries[q]))[:5]]
+            set_hits += set_by_card.get(label) in routed
+            hits1 += recall(order, label, 1)
+            hits5 += recall(order, label, 5)
+        n = len(labels)
+        print(f"{'top-' + str(s) + ' sets':<14}{set_hits / n:>8.3f}{hits1 / n:>9.3f}{hits5 / n:>9.3f}"
+              f"{scanned / (n * len(card_ids)):>10.3f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark set-centroid routing against global search.")
+    parser.add_argument("--source", choices=("db", "synthetic"), default="db")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top-sets", type=int, nargs="+", default=[2, 4, 8, 16])
+    parser.add_argument("--noise", type=float, default=0.0, help="Query perturbation (0 = templates as-is)")
+    parser.add_argument("--sets", type=int, default=200, help="Synthetic: number of sets")
+    parser.add_argument("--cards-per-set", type=int, default=150, help="Synthetic: cards per set")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.source == "synthetic":
+        rows, queries, labels = synthetic_gallery(args.sets, args.cards_per_set, args.dim, args.seed)
+        pick = np.random.default_rng(args.seed).choice(len(labels), size=min(args.queries, len(labels)), replace=False)
+        queries, labels = queries[pick], [labels[i] for i in pick]
+    else:
+        rows, queries, labels = db_gallery(args.queries, args.seed)
+    run(rows, queries, labels, args.top_sets, args.noise, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Benchmark worker/vector_codec.py against the ad-hoc pgvector parsers it replaced.
+
+Generates synthetic L2-normalized 768-dim vectors, renders them the way pgvector
+prints them (shortest float4 text), and times each parser on the same payload.
+No database or model is required.
+
+Usage:
+    python scripts/benchmark_vector_codec.py [--rows 2000] [--dim 768] [--repeat 3]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from worker.vector_codec import format_vector, parse_vector, parse_vectors  # noqa: E402
+
+
+# ---------------- Legacy parsers (verbatim behaviour) ----------------
+
+def legacy_build_prototypes(emb) -> np.ndarray:
+    """build_prototypes.compute_prototypes: json.loads / np.fromstring fallbacks."""
+    if isinstance(emb, list):
+        return np.asarray(emb, dtype=np.float32)
+    s = emb.strip()
+    if s.startswith("[") and s.endswith("]"):
+        return np.asarray(json.loads(s), dtype=np.float32)
+    return np.fromstring(s, sep=",", dtype=np.float32)
+
+
+def legacy_rebuild_prototypes(emb) -> np.ndarray:
+    """rebuild_gallery_vit_l_14.rebuild_prototypes: split + float()."""
+    if isinstance(emb, str):
+        emb = emb.strip("[]")
+        return np.array([float(x) for x in emb.split(",")], dtype=np.float32)
+    return np.array(emb, dtype=np.float32)
+
+
+def legacy_print_scores(emb_raw) -> np.ndarray:
+    """print_scores.parse_vector: json.loads on strings."""
+    if isinstance(emb_raw, str):
+        return np.array(json.loads(emb_raw.strip()), dtype=np.float32)
+    return np.array(emb_raw, dtype=np.float32)
+
+
+def legacy_retrieval_v2(emb) -> np.ndarray:
+    """retrieval_v2.identify_v2: np.asarray on decoded JSON lists."""
+    return np.asarray(emb, dtype=np.float32)
+
+
+# ---------------- Harness ----------------
+
+def _time(fn: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _report(label: str, seconds: float, rows: int, baseline: float) -> None:
+    per_row_us = seconds / rows * 1e6
+    speedup = baseline / seconds if seconds > 0 else float("inf")
+    print(f"  {label:<40}{seconds * 1000:>10.1f} ms{per_row_us:>10.1f} us/row{speedup:>8.2f}x")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark pgvector parsing/serialization.")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1337)
+    vectors = rng.standard_normal((args.rows, args.dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    # pgvector prints float4 with shortest round-trip digits; %.9g is the upper bound
+    text_rows: List[str] = [format_vector(v) for v in vectors]
+    list_rows: List[list] = [v.tolist() for v in vectors]
+
+    print(f"[INFO] rows={args.rows} dim={args.dim} repeat={args.repeat} (best of)")
+
+    print("\n[PARSE] pgvector text payloads")
+    base = _time(lambda: [legacy_build_prototypes(r) for r in text_rows], args.repeat)
+    _report("legacy build_prototypes (json.loads)", base, args.rows, base)
+    _report("legacy rebuild_prototypes (split+float)",
+            _time(lambda: [legacy_rebuild_prototypes(r) for r in text_rows], args.repeat), args.rows, base)
+    _report("legacy print_scores (json.loads)",
+            _time(lambda: [legacy_print_scores(r) for r in text_rows], args.repeat), args.rows, base)
+    _report("vector_codec.parse_vector (per row)",
+            _time(lambda: [parse_vector(r) for r in text_rows], args.repeat), args.rows, base)
+    _report("vector_codec.parse_vectors (bulk)",
+            _time(lambda: parse_vectors(text_rows), args.repeat), args.rows, base)
+
+    print("\n[PARSE] decoded JSON list payloads (float4[] RPC results)")
+    base = _time(lambda: [legacy_retrieval_v2(r) for r in list_rows], args.repeat)
+    _report("legacy retrieval_v2 (np.asarray per row)", base, args.rows, base)
+    _report("vector_codec.parse_vectors (bulk)",
+            _time(lambda: parse_vectors(list_rows), args.repeat), args.rows, base)
+
+    print("\n[SERIALIZE] query vectors")
+    base = _time(lambda: [json.dumps(v.tolist()) for v in vectors], args.repeat)
+    _report("legacy json.dumps(vec.tolist())", base, args.rows, base)
+    _report("vector_codec.format_vector",
+            _time(lambda: [format_vector(v) for v in vectors], args.repeat), args.rows, base)
+    legacy_chars = np.mean([len(json.dumps(v.tolist())) for v in vectors[:100]])
+    compact_chars = np.mean([len(r) for r in text_rows[:100]])
+    print(f"  payload size: {legacy_chars:.0f} -> {compact_chars:.0f} chars/vector "
+          f"({legacy_chars / args.dim:.1f} -> {compact_chars / args.dim:.1f} chars/float)")
+
+    # Sanity: compact text must round-trip float32 exactly
+    roundtrip = parse_vectors(text_rows)
+    if not np.array_equal(roundtrip, vectors):
+        print("[ERROR] format_vector -> parse_vectors did not round-trip exactly")
+        return 1
+    print("\n[OK] format_vector -> parse_vectors round-trips float32 exactly")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,7 +14,6 @@ from pathlib import Path
 from typing import Dict, Iterable, Iterator, List, Optional, Sequence
 
 import numpy as np
-import json
 from postgrest.exceptions import APIError
 
 import sys
@@ -25,6 +24,7 @@ PROJECT_ROOT = CURRENT_DIR.parent
 sys.path.insert(0, str(PROJECT_ROOT))
 
 from worker.config import get_supabase_client  # type: ignore
+from worker.vector_codec import parse_vector  # type: ignore
 
 PAGE_SIZE = 500
 UPSERT_BATCH_SIZE = 200
@@ -87,30 +87,9 @@ def compute_prototypes(rows: Iterable[Dict]) -> Iterator[Dict]:
             accumulator = []
             current_set = None
 
-        emb = row.get("emb")
-        if emb is None:
-            continue
         # Accept vector coming back as JSON array, Python list, or string (pgvector)
-        vec: Optional[np.ndarray] = None
-        if isinstance(emb, list):
-            vec = np.asarray(emb, dtype=np.float32)
-        elif isinstance(emb, str):
-            s = emb.strip()
-            try:
-                if s.startswith("[") and s.endswith("]"):
-                    vec = np.asarray(json.loads(s), dtype=np.float32)
-                else:
-                    # Fallback: comma-separated without brackets
-                    vec = np.fromstring(s, sep=",", dtype=np.float32)
-            except Exception:
-                # Last resort: strip brackets and parse
-                s2 = s.strip("[]")
-                vec = np.fromstring(s2, sep=",", dtype=np.float32)
-        else:
-            # Unknown type, skip
-            vec = None
-
-        if vec is None or vec.size == 0:
+        vec = parse_vector(row.get("emb"))
+        if vec is None:
             continue
         accumulator.append(vec)
 
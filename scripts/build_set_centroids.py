@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Build per-set centroid embeddings from card_prototypes entries.
+
+Each centroid is the L2-normalized mean of a set's card prototypes and is
+upserted into `card_set_centroids`, which hierarchical retrieval
+(RETRIEVAL_SEARCH=hierarchical) uses to route a query to a few sets. Re-run it
+after build_prototypes.py.
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+from postgrest.exceptions import APIError
+
+import sys
+
+CURRENT_DIR = Path(__file__).parent
+PROJECT_ROOT = CURRENT_DIR.parent
+
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from worker.config import get_supabase_client  # type: ignore
+from worker.set_routing import compute_set_centroids  # type: ignore
+
+PAGE_SIZE = 500
+UPSERT_BATCH_SIZE = 100
+
+
+def fetch_prototypes(supabase_client) -> Iterator[Dict]:
+    """Stream card_prototypes rows with range() pagination."""
+    start = 0
+    while True:
+        end = start + PAGE_SIZE - 1
+        response = (
+            supabase_client.table("card_prototypes")
+            .select("card_id,set_id,emb")
+            .order("card_id", desc=False)
+            .range(start, end)
+            .execute()
+        )
+        rows = response.data or []
+        if not rows:
+            break
+        for row in rows:
+            yield row
+        if len(rows) < PAGE_SIZE:
+            break
+        start += PAGE_SIZE
+
+
+def upsert_centroids(supabase_client, records: List[Dict]) -> None:
+    supabase_client.table("card_set_centroids").upsert(records, on_conflict="set_id").execute()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build set centroids from card_prototypes.")
+    parser.add_argument("--dry-run", action="store_true", help="Compute without writing results.")
+    args = parser.parse_args()
+
+    print("[INFO] Initializing Supabase client...")
+    supabase = get_supabase_client()
+
+    start = time.time()
+    try:
+        records = compute_set_centroids(fetch_prototypes(supabase))
+    except APIError as api_err:
+        if getattr(api_err, "code", None) == "42P01":
+            print("[ERROR] card_prototypes table not found. Build prototypes before set centroids.")
+            return
+        raise
+
+    if not args.dry_run:
+        for i in range(0, len(records), UPSERT_BATCH_SIZE):
+            upsert_centroids(supabase, records[i:i + UPSERT_BATCH_SIZE])
+        print(f"[INFO] Upserted {len(records)} set centroids.")
+
+    cards = sum(r["card_count"] for r in records)
+    elapsed = time.time() - start
+    print(f"[DONE] Sets={len(records)}, cards={cards}, dry_run={args.dry_run}, elapsed={elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,7 @@ import json
 # Add worker directory to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'worker'))
 from config import get_supabase_client
+from crop_bundle import download_crop
 
 def collect_recent_scans(days_back=7, limit=200):
     """Fetch recent scan uploads that have been processed"""
@@ -95,7 +96,7 @@ def download_and_categorize_crops(detections, target_count=100):
         
         try:
             # Download the crop image
-            response = supabase.storage.from_('scans').download(crop_url)
+            response = download_crop(supabase, crop_url, 'scans')
             if not response:
                 continue
                 
@@ -4,7 +4,10 @@ Embed official Pokemon TCG images into the Phase 2 gallery tables.
 
 Creates deterministic card template embeddings (OpenCLIP ViT-L/14-336, TTA=2),
 including simple augmentations (horizontal flip, optional brightness tweak),
-and upserts into the `card_templates` table.
+and upserts into the `card_templates` table (or the shadow generation with --shadow).
+
+Progress is checkpointed to a per-generation manifest, so re-running the same
+command skips cards that were already embedded.
 """
 from __future__ import annotations
 
@@ -29,8 +32,16 @@ PROJECT_ROOT = CURRENT_DIR.parent
 # Ensure we can import from the project root and worker package
 sys.path.insert(0, str(PROJECT_ROOT))
 
-from worker.openclip_embedder import build_default_embedder  # type: ignore
+from worker.openclip_embedder import PREPROCESS_VERSION, build_default_embedder  # type: ignore
 from worker.config import get_supabase_client  # type: ignore
+from worker.gallery_generation import (  # type: ignore
+    LIVE_TEMPLATES_TABLE,
+    SHADOW_TEMPLATES_TABLE,
+    GalleryManifest,
+    fetch_shadow_card_ids,
+    manifest_path_for,
+    prepare_shadow,
+)
 
 DATA_DIR = PROJECT_ROOT / "Pokemon-tcg-data" / "cards" / "en"
 CARD_BATCH_SIZE = 8
@@ -50,6 +61,7 @@ class TemplateRecord:
     source: str
     aug_tag: Optional[str]
     emb: List[float]
+    generation: Optional[str] = None
 
 
 def deterministic_template_id(card_id: str, source: str, variant: Optional[str], aug_tag: Optional[str]) -> str:
@@ -115,6 +127,7 @@ def make_templates(
     embedder,
     session: requests.Session,
     include_brightness: bool,
+    generation: Optional[str] = None,
 ) -> List[TemplateRecord]:
     """Create template embeddings (official art + augmentations) for one card."""
     images = card.get("images", {})
@@ -143,6 +156,7 @@ def make_templates(
             source="official_art",
             aug_tag=None,
             emb=base_vec.tolist(),
+            generation=generation,
         )
     )
 
@@ -158,6 +172,7 @@ def make_templates(
             source="aug",
             aug_tag="hflip",
             emb=flipped_vec.tolist(),
+            generation=generation,
         )
     )
 
@@ -179,13 +194,18 @@ def make_templates(
                 source="aug",
                 aug_tag=BRIGHTNESS_TAG,
                 emb=bright_vec.tolist(),
+                generation=generation,
             )
         )
 
     return templates
 
 
-def upsert_templates(supabase_client, records: Sequence[TemplateRecord]) -> None:
+def upsert_templates(
+    supabase_client,
+    records: Sequence[TemplateRecord],
+    table: str = LIVE_TEMPLATES_TABLE,
+) -> None:
     """Upsert template records into Supabase."""
     payload = [
         {
@@ -196,17 +216,21 @@ def upsert_templates(supabase_client, records: Sequence[TemplateRecord]) -> None
             "source": rec.source,
             "aug_tag": rec.aug_tag,
             "emb": rec.emb,
+            "generation": rec.generation,
         }
         for rec in records
     ]
-    supabase_client.table("card_templates").upsert(payload, on_conflict="id").execute()
+    supabase_client.table(table).upsert(payload, on_conflict="id").execute()
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Populate card_templates with OpenCLIP embeddings.")
     parser.add_argument("--limit", type=int, default=None, help="Process only the first N cards.")
-    parser.add_argument("--start-after", type=str, default=None, help="Resume after the given card_id.")
+    parser.add_argument("--start-after", type=str, default=None, help="Resume after the given card_id (prefer the manifest).")
     parser.add_argument("--disable-brightness", action="store_true", help="Skip brightness augmentation template.")
+    parser.add_argument("--generation", type=str, default=None, help="Generation tag (default: embedder model/preprocess tag).")
+    parser.add_argument("--manifest", type=Path, default=None, help="Checkpoint manifest path.")
+    parser.add_argument("--shadow", action="store_true", help="Write into the shadow generation instead of live card_templates.")
     parser.add_argument("--dry-run", action="store_true", help="Compute embeddings without writing to the database.")
     args = parser.parse_args()
 
@@ -219,9 +243,30 @@ def main() -> None:
     embedder = build_default_embedder()
     print(f"[OK] Embedder ready on device={embedder.device_str}, dim={embedder.embed_dim}")
 
+    generation = args.generation or embedder.generation_tag
+    table = SHADOW_TEMPLATES_TABLE if args.shadow else LIVE_TEMPLATES_TABLE
+    templates_per_card = 2 if args.disable_brightness else 3
+    manifest = GalleryManifest.load_or_create(
+        args.manifest or manifest_path_for(generation),
+        generation,
+        meta={
+            "model_name": embedder.model_name,
+            "pretrained": embedder.pretrained,
+            "preprocess_version": PREPROCESS_VERSION,
+            "target_table": table,
+        },
+    )
+    done_cards = set(manifest.completed)
+    if args.shadow and not args.dry_run:
+        prepare_shadow(supabase, generation, embedder.model_name, embedder.pretrained, PREPROCESS_VERSION)
+        done_cards |= fetch_shadow_card_ids(supabase, generation, min_templates=templates_per_card)
+    print(f"[INFO] Generation {generation} -> {table} ({len(done_cards)} cards already done)")
+
     total_cards = 0
     total_templates = 0
+    resumed_cards = 0
     buffered: List[TemplateRecord] = []
+    buffered_cards: List[str] = []
 
     cards_iter = all_cards(limit=args.limit, start_after=args.start_after)
 
@@ -229,6 +274,9 @@ def main() -> None:
     with requests.Session() as session:
         for batch_cards in chunked_cards(cards_iter, CARD_BATCH_SIZE):
             for card in batch_cards:
+                if card.get("id") in done_cards:
+                    resumed_cards += 1
+                    continue
                 total_cards += 1
                 try:
                     templates = make_templates(
@@ -236,9 +284,11 @@ def main() -> None:
                         embedder,
                         session=session,
                         include_brightness=not args.disable_brightness,
+                        generation=generation,
                     )
                 except Exception as exc:
                     print(f"[WARN] Failed to embed card {card.get('id')}: {exc}")
+                    manifest.mark_failed(card.get("id"), str(exc))
                     continue
 
                 if not templates:
@@ -246,25 +296,34 @@ def main() -> None:
 
                 total_templates += len(templates)
                 buffered.extend(templates)
+                buffered_cards.append(card["id"])
 
+            # Flush whole cards so the manifest never records a half-written card
             if not args.dry_run and len(buffered) >= UPSERT_BATCH_SIZE:
-                chunk = buffered[:UPSERT_BATCH_SIZE]
                 start = time.time()
-                upsert_templates(supabase, chunk)
+                upsert_templates(supabase, buffered, table=table)
+                manifest.mark_completed(buffered_cards)
+                manifest.save()
                 print(
-                    f"[INFO] Upserted {len(chunk)} templates "
+                    f"[INFO] Upserted {len(buffered)} templates "
                     f"(cards processed={total_cards}, total templates={total_templates}) "
                     f"in {time.time() - start:.2f}s"
                 )
-                buffered = buffered[UPSERT_BATCH_SIZE:]
+                buffered = []
+                buffered_cards = []
 
     if not args.dry_run and buffered:
-        upsert_templates(supabase, buffered)
+        upsert_templates(supabase, buffered, table=table)
+        manifest.mark_completed(buffered_cards)
         print(f"[INFO] Upserted remaining {len(buffered)} templates.")
 
+    if not args.dry_run:
+        manifest.status = "templates_complete"
+        manifest.save()
+
     elapsed = time.time() - start_time
     print(
-        f"[DONE] Processed cards={total_cards}, templates={total_templates}, "
+        f"[DONE] Processed cards={total_cards}, resumed={resumed_cards}, templates={total_templates}, "
         f"dry_run={args.dry_run}, elapsed={elapsed:.1f}s"
     )
 
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Extract the visual tower of an open_clip checkpoint into a visual-only safetensors file.
+
+Retrieval only calls ``encode_image``, so the text transformer (token embedding,
+12-layer text transformer, text projection) is dead weight in every worker. This
+writes just the image tower, in the layout ``OpenClipEmbedder`` memory-maps
+(``OPENCLIP_SHARED_WEIGHTS=1``), optionally cast to bf16, and verifies it by
+rebuilding the tower from the file and comparing outputs with the original.
+
+Usage:
+    python scripts/extract_visual_checkpoint.py [--model ViT-L-14-336] [--pretrained openai]
+        [--cache-dir /cache/open_clip] [--output path.safetensors] [--precision fp32|bf16]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import open_clip  # noqa: E402
+import torch  # noqa: E402
+
+from worker.openclip_embedder import (  # noqa: E402
+    PRECISION_DTYPES,
+    build_visual_tower,
+    export_visual_checkpoint,
+    visual_tower_config,
+)
+from worker.shared_weights import mmap_state_dict, visual_weights_path  # noqa: E402
+
+
+def _param_bytes(module: torch.nn.Module) -> int:
+    return sum(t.numel() * t.element_size() for t in module.state_dict().values())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="ViT-L-14-336")
+    parser.add_argument("--pretrained", default="openai")
+    parser.add_argument("--cache-dir", default=os.getenv("OPENCLIP_CACHE_DIR", "/tmp/open_clip"))
+    parser.add_argument("--output", type=Path, default=None, help="Default: where the embedder looks for it")
+    parser.add_argument("--precision", choices=sorted(PRECISION_DTYPES), default="fp32")
+    args = parser.parse_args()
+
+    output = args.output or visual_weights_path(args.cache_dir, args.model, args.pretrained)
+    if args.precision != "fp32" and args.output is None:
+        output = output.with_suffix(f".{args.precision}.safetensors")
+    dtype = None if args.precision == "fp32" else PRECISION_DTYPES[args.precision]
+
+    started = time.perf_counter()
+    export_visual_checkpoint(args.model, args.pretrained, output, args.cache_dir, dtype=dtype)
+    print(f"[OK] Wrote {output} ({output.stat().st_size / 2**20:.0f} MB) in {time.perf_counter() - started:.1f}s")
+
+    # Verify: rebuild the tower from the file and compare with the original checkpoint
+    model, _, _ = open_clip.create_model_and_transforms(args.model, pretrained=args.pretrained, cache_dir=args.cache_dir)
+    model.eval()
+    full_mb, visual_mb = _param_bytes(model) / 2**20, _param_bytes(model.visual) / 2**20
+    print(f"[INFO] Full checkpoint {full_mb:.0f} MB fp32; visual tower {visual_mb:.0f} MB ({visual_mb / full_mb:.0%})")
+
+    state_dict, metadata = mmap_state_dict(output)
+    tower = build_visual_tower(args.model, args.pretrained)
+    tower.load_state_dict(state_dict, assign=True)
+    tower.eval()
+    size = model.visual.image_size
+    size = size if isinstance(size, (tuple, list)) else (size, size)
+    x = torch.randn(2, 3, *size)
+    with torch.no_grad():
+        expected = model.encode_image(x).float()
+        actual = tower(x.to(dtype or torch.float32)).float()
+    cosine = torch.nn.functional.cosine_similarity(expected, actual, dim=-1).min().item()
+    embed_dim = visual_tower_config(args.model)["embed_dim"]
+    assert actual.shape[-1] == embed_dim == int(metadata.get("embed_dim", embed_dim))
+    print(f"[OK] Rebuilt tower matches the checkpoint: min cosine {cosine:.6f}, embed_dim {embed_dim}")
+    if args.precision == "fp32" and cosine < 0.99999:
+        sys.exit("[ERROR] fp32 visual checkpoint does not reproduce the original tower")
+
+
+if __name__ == "__main__":
+    main()
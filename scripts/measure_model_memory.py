@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Measure embedder load time and memory with and without shared (mmap) weights.
+
+Starts ``--workers`` processes at once for each mode, each building the default
+OpenClipEmbedder and embedding one image (so every weight page is touched), then
+holding until all are loaded. Reports per process:
+
+* load time (constructor wall time)
+* RSS, and PSS/shared-clean from /proc/self/smaps_rollup (Linux); PSS splits
+  shared pages between the processes mapping them, so it is the honest
+  per-worker cost
+* for the whole group, the drop in the host's MemAvailable
+
+Modes: ``private`` (OPENCLIP_SHARED_WEIGHTS=0, the checkpoint loaded into each
+process) and ``mmap`` (OPENCLIP_SHARED_WEIGHTS=1). Run ``mmap`` once beforehand,
+or the first run includes the one-time export.
+
+Usage:
+    python scripts/measure_model_memory.py [--workers 2] [--modes private,mmap] [--json out.json]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+MODE_ENV = {"private": "0", "mmap": "1"}
+
+
+def _smaps_rollup() -> Dict[str, int]:
+    """Rss/Pss/Shared_Clean/Private_* in bytes for this process (empty off Linux)."""
+    out: Dict[str, int] = {}
+    try:
+        with open("/proc/self/smaps_rollup", "r") as handle:
+            for line in handle:
+                parts = line.split()
+                if len(parts) >= 3 and parts[-1] == "kB":
+                    out[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        pass
+    return out
+
+
+def _mem_available() -> int:
+    try:
+        with open("/proc/meminfo", "r") as handle:
+            for line in handle:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _child(mode: str, loaded, release, results) -> None:
+    os.environ["OPENCLIP_SHARED_WEIGHTS"] = MODE_ENV[mode]
+    from PIL import Image
+
+    from worker.openclip_embedder import build_default_embedder
+    from worker.stage_timing import resident_memory_bytes
+
+    started = time.perf_counter()
+    embedder = build_default_embedder()
+    load_s = time.perf_counter() - started
+    embedder.embed(Image.new("RGB", (400, 560), "gray"), tta_views=1)
+
+    rollup = _smaps_rollup()
+    results.put({
+        "pid": os.getpid(),
+        "load_s": round(load_s, 2),
+        "rss_mb": round((rollup.get("Rss") or resident_memory_bytes() or 0) / 2**20, 1),
+        "pss_mb": round(rollup.get("Pss", 0) / 2**20, 1),
+        "shared_clean_mb": round(rollup.get("Shared_Clean", 0) / 2**20, 1),
+        "private_mb": round((rollup.get("Private_Clean", 0) + rollup.get("Private_Dirty", 0)) / 2**20, 1),
+    })
+    loaded.release()
+    release.wait()
+
+
+def measure(mode: str, workers: int) -> Dict:
+    ctx = mp.get_context("spawn")
+    loaded, release, results = ctx.Semaphore(0), ctx.Event(), ctx.Queue()
+    available_before = _mem_available()
+    procs = [ctx.Process(target=_child, args=(mode, loaded, release, results)) for _ in range(workers)]
+    for p in procs:
+        p.start()
+    for _ in procs:
+        loaded.acquire()
+    available_after = _mem_available()
+    per_process: List[Dict] = [results.get() for _ in procs]
+    release.set()
+    for p in procs:
+        p.join()
+    return {
+        "mode": mode,
+        "workers": workers,
+        "host_mem_used_mb": round((available_before - available_after) / 2**20, 1),
+        "processes": sorted(per_process, key=lambda r: r["pid"]),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--modes", default="private,mmap")
+    parser.add_argument("--json", type=Path, default=None, help="Also write the report here")
+    args = parser.parse_args()
+
+    report = [measure(mode.strip(), args.workers) for mode in args.modes.split(",") if mode.strip()]
+    for entry in report:
+        print(f"\n== {entry['mode']} x{entry['workers']}: host memory used {entry['host_mem_used_mb']} MB")
+        print(f"{'pid':>8} {'load_s':>7} {'rss_mb':>8} {'pss_mb':>8} {'shared':>8} {'private':>8}")
+        for r in entry["processes"]:
+            print(f"{r['pid']:>8} {r['load_s']:>7} {r['rss_mb']:>8} {r['pss_mb']:>8} {r['shared_clean_mb']:>8} {r['private_mb']:>8}")
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
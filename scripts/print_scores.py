@@ -16,18 +16,13 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from worker.openclip_embedder import build_default_embedder
 from worker.config import get_supabase_client, FUSION_WEIGHTS
-
-def parse_vector(emb_raw):
-    """Parse vector from DB (may be string or list)"""
-    if isinstance(emb_raw, str):
-        return np.array(json.loads(emb_raw.strip()), dtype=np.float32)
-    return np.array(emb_raw, dtype=np.float32)
+from worker.vector_codec import format_vector, parse_vector
 
 def compute_fused_scores(sb, query_vec, topk=200, set_hint=None):
     """Compute fused scores for all cards using retrieval v2 logic"""
     # Get template matches
     payload = {
-        "qvec": query_vec.tolist(),
+        "qvec": format_vector(query_vec),
         "match_count": topk,
         "set_hint": set_hint
     }
@@ -50,8 +45,9 @@ def compute_fused_scores(sb, query_vec, topk=200, set_hint=None):
     for row in proto_response.data or []:
         cid = row.get("card_id")
         emb_raw = row.get("emb")
-        if cid and emb_raw:
-            proto_map[cid] = parse_vector(emb_raw)
+        proto_vec = parse_vector(emb_raw)
+        if cid and proto_vec is not None:
+            proto_map[cid] = proto_vec
     
     # Compute fused scores
     alpha, beta = FUSION_WEIGHTS  # 0.7, 0.3
@@ -33,6 +33,7 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 from supabase import create_client, Client
 from worker.openclip_embedder import OpenCLIPEmbedder
 from worker.config import get_supabase_config
+from worker.crop_bundle import download_crop
 
 # Configuration
 GALLERY_BASE_PATH = Path("gallery")
@@ -217,7 +218,7 @@ class TrainingFeedbackProcessor:
         
         # Check if crop exists in storage
         try:
-            self.supabase.storage.from_('card-crops').download(crop_path)
+            download_crop(self.supabase, crop_path, 'card-crops')
         except Exception:
             logger.info(f"  ✗ Crop not found: {crop_path}")
             return False
@@ -233,7 +234,7 @@ class TrainingFeedbackProcessor:
         """Step 3: Generate CLIP embedding from crop image."""
         try:
             # Download crop from storage
-            crop_bytes = self.supabase.storage.from_('card-crops').download(crop_path)
+            crop_bytes = download_crop(self.supabase, crop_path, 'card-crops')
             
             # Generate embedding using CLIP
             embedding = self.embedder.embed_image_bytes(crop_bytes)
@@ -3,11 +3,17 @@
 Rebuild the entire card_templates gallery using ViT-L-14-336.
 
 This script:
-1. Deletes all existing templates (clean slate)
+1. Prepares a shadow generation tagged with model + preprocess version
+   (live card_templates / card_prototypes keep serving retrieval meanwhile)
 2. Fetches all cards from the cards table
 3. Downloads images and generates embeddings with current OpenClipEmbedder
-4. Creates official_art + hflip augmentation templates
-5. Rebuilds card_prototypes (mean → L2 normalize)
+4. Creates official_art + hflip augmentation templates in the shadow tables,
+   checkpointing finished cards to a manifest after every upsert
+5. Rebuilds prototypes for the shadow generation (mean → L2 normalize)
+6. Promotes the shadow generation to live in one atomic switch
+
+Re-running with the same generation resumes: cards recorded in the manifest or
+already fully present in the shadow tables are skipped.
 
 Expected runtime: ~30-60min for 15,504 cards
 Expected accuracy gain: +10-20pp from feature space alignment
@@ -32,13 +38,29 @@ CURRENT_DIR = Path(__file__).parent
 PROJECT_ROOT = CURRENT_DIR.parent
 sys.path.insert(0, str(PROJECT_ROOT))
 
-from worker.openclip_embedder import build_default_embedder
+from worker.openclip_embedder import PREPROCESS_VERSION, build_default_embedder
 from worker.config import get_supabase_client
+from worker.gallery_generation import (
+    LIVE_PROTOTYPES_TABLE,
+    LIVE_TEMPLATES_TABLE,
+    SHADOW_PROTOTYPES_TABLE,
+    SHADOW_TEMPLATES_TABLE,
+    GalleryManifest,
+    carry_over_templates,
+    discard_shadow,
+    fetch_shadow_card_ids,
+    manifest_path_for,
+    prepare_shadow,
+    promote_shadow,
+)
+from worker.vector_codec import parse_vectors
 
 CARD_BATCH_SIZE = 16
 UPSERT_BATCH_SIZE = 20  # Reduced to avoid statement timeout
 DOWNLOAD_TIMEOUT_SEC = 20
 MAX_DOWNLOAD_RETRIES = 3
+TEMPLATES_PER_CARD = 2  # official_art + hflip
+TEMPLATE_PAGE_SIZE = 1000
 
 
 @dataclass
@@ -50,6 +72,7 @@ class TemplateRecord:
     source: str
     aug_tag: Optional[str]
     emb: List[float]
+    generation: Optional[str] = None
 
 
 def deterministic_template_id(card_id: str, source: str, variant: Optional[str], aug_tag: Optional[str]) -> str:
@@ -90,6 +113,7 @@ def make_templates(
     image_url: str,
     embedder,
     session: requests.Session,
+    generation: Optional[str] = None,
 ) -> List[TemplateRecord]:
     """Create template embeddings (official art + hflip) for one card."""
     pil_img = fetch_image(session, image_url)
@@ -111,6 +135,7 @@ def make_templates(
             source="official_art",
             aug_tag=None,
             emb=base_vec.tolist(),
+            generation=generation,
         )
     )
 
@@ -126,13 +151,18 @@ def make_templates(
             source="aug",
             aug_tag="hflip",
             emb=flipped_vec.tolist(),
+            generation=generation,
         )
     )
 
     return templates
 
 
-def upsert_templates(supabase_client, records: Sequence[TemplateRecord]) -> None:
+def upsert_templates(
+    supabase_client,
+    records: Sequence[TemplateRecord],
+    table: str = LIVE_TEMPLATES_TABLE,
+) -> None:
     """Upsert template records into Supabase in small chunks to avoid timeout."""
     payload = [
         {
@@ -143,6 +173,7 @@ def upsert_templates(supabase_client, records: Sequence[TemplateRecord]) -> None
             "source": rec.source,
             "aug_tag": rec.aug_tag,
             "emb": rec.emb,
+            "generation": rec.generation,
         }
         for rec in records
     ]
@@ -151,33 +182,53 @@ def upsert_templates(supabase_client, records: Sequence[TemplateRecord]) -> None
     MICRO_BATCH = 10
     for i in range(0, len(payload), MICRO_BATCH):
         micro_batch = payload[i:i+MICRO_BATCH]
-        supabase_client.table("card_templates").upsert(micro_batch, on_conflict="id").execute()
+        supabase_client.table(table).upsert(micro_batch, on_conflict="id").execute()
         time.sleep(0.1)  # Small delay between batches
 
 
-def rebuild_prototypes(supabase_client) -> None:
-    """Rebuild card_prototypes by averaging templates per card_id."""
-    print("\n[INFO] Rebuilding card_prototypes...")
+def fetch_all_templates(supabase_client, table: str) -> List[dict]:
+    """Page through every template row (PostgREST caps a single response)."""
+    rows: List[dict] = []
+    start = 0
+    while True:
+        response = (
+            supabase_client.table(table)
+            .select("card_id, set_id, emb")
+            .order("id")
+            .range(start, start + TEMPLATE_PAGE_SIZE - 1)
+            .execute()
+        )
+        page = response.data or []
+        rows.extend(page)
+        if len(page) < TEMPLATE_PAGE_SIZE:
+            break
+        start += TEMPLATE_PAGE_SIZE
+    return rows
+
+
+def rebuild_prototypes(
+    supabase_client,
+    templates_table: str = LIVE_TEMPLATES_TABLE,
+    prototypes_table: str = LIVE_PROTOTYPES_TABLE,
+    generation: Optional[str] = None,
+) -> None:
+    """Rebuild prototypes by averaging templates per card_id."""
+    print(f"\n[INFO] Rebuilding {prototypes_table} from {templates_table}...")
     
     # Fetch all templates
     print("[INFO] Fetching templates...")
-    templates = supabase_client.table("card_templates").select("card_id, set_id, emb").execute()
+    templates = fetch_all_templates(supabase_client, templates_table)
     
     # Group by card_id
     from collections import defaultdict
     card_groups = defaultdict(list)
     set_ids = {}
     
-    for t in templates.data:
+    rows = [t for t in templates if t.get("emb") is not None]
+    # Parse all embeddings in one bulk pass (pgvector text or JSON arrays)
+    matrix = parse_vectors([t["emb"] for t in rows])
+    for t, emb in zip(rows, matrix):
         card_id = t["card_id"]
-        emb = t["emb"]
-        # Handle string representation of vector
-        if isinstance(emb, str):
-            # Remove brackets and parse as floats
-            emb = emb.strip("[]")
-            emb = np.array([float(x) for x in emb.split(",")], dtype=np.float32)
-        else:
-            emb = np.array(emb, dtype=np.float32)
         card_groups[card_id].append(emb)
         set_ids[card_id] = t.get("set_id")
     
@@ -193,13 +244,14 @@ def rebuild_prototypes(supabase_client) -> None:
             "set_id": set_ids.get(card_id),
             "emb": norm_emb.tolist(),
             "template_count": len(embs),
+            "generation": generation,
         })
     
     # Upsert in batches
     print(f"[INFO] Upserting {len(prototypes)} prototypes...")
     for i in range(0, len(prototypes), 50):
         batch = prototypes[i:i+50]
-        supabase_client.table("card_prototypes").upsert(batch, on_conflict="card_id").execute()
+        supabase_client.table(prototypes_table).upsert(batch, on_conflict="card_id").execute()
         if (i + 50) % 500 == 0:
             print(f"[INFO] Progress: {min(i+50, len(prototypes))} / {len(prototypes)}")
         time.sleep(0.1)
@@ -210,53 +262,60 @@ def rebuild_prototypes(supabase_client) -> None:
 def main() -> None:
     parser = argparse.ArgumentParser(description="Rebuild card_templates with ViT-L-14-336")
     parser.add_argument("--limit", type=int, default=None, help="Process only the first N cards")
-    parser.add_argument("--skip-clear", action="store_true", help="Don't delete existing templates (incremental mode)")
+    parser.add_argument("--generation", type=str, default=None, help="Generation tag (default: embedder model/preprocess tag)")
+    parser.add_argument("--manifest", type=Path, default=None, help="Checkpoint manifest path (default: logs/gallery_manifests/<generation>.manifest.json)")
+    parser.add_argument("--in-place", action="store_true", help="Upsert straight into the live tables instead of a shadow generation (incremental mode)")
+    parser.add_argument("--carry-over-source", dest="carry_over_sources", action="append", default=[], help="Copy live templates of this source (e.g. user_scan) into the new generation (repeatable)")
+    parser.add_argument("--no-promote", action="store_true", help="Build the shadow generation but don't switch retrieval to it")
+    parser.add_argument("--discard-shadow", action="store_true", help="Drop an abandoned shadow generation and exit")
     parser.add_argument("--skip-prototypes", action="store_true", help="Don't rebuild prototypes after templates")
     parser.add_argument("--dry-run", action="store_true", help="Compute embeddings without writing to database")
     args = parser.parse_args()
 
     print("[INFO] Initializing Supabase client...")
     supabase = get_supabase_client()
+
+    if args.discard_shadow:
+        discard_shadow(supabase)
+        print("[OK] Shadow gallery discarded")
+        return
     
     print("[INFO] Loading OpenCLIP ViT-L/14-336 embedder...")
     embedder = build_default_embedder()
     print(f"[OK] Embedder ready on device={embedder.device_str}, dim={embedder.embed_dim}")
 
-    if not args.skip_clear and not args.dry_run:
-        print("\n[INFO] Clearing existing templates...")
-        try:
-            # Delete templates in small batches to avoid timeout
-            print("[INFO] Counting existing templates...")
-            count_result = supabase.table("card_templates").select("id", count="exact").in_(
-                "source", ["official_art", "aug"]
-            ).limit(1).execute()
-            
-            total_to_delete = count_result.count if hasattr(count_result, 'count') else 0
-            print(f"[INFO] Found ~{total_to_delete} templates to clear")
-            
-            if total_to_delete > 0:
-                # Delete in batches of 1000
-                deleted = 0
-                while True:
-                    batch = supabase.table("card_templates").select("id").in_(
-                        "source", ["official_art", "aug"]
-                    ).limit(1000).execute()
-                    
-                    if not batch.data:
-                        break
-                    
-                    ids = [row["id"] for row in batch.data]
-                    supabase.table("card_templates").delete().in_("id", ids).execute()
-                    deleted += len(ids)
-                    print(f"[INFO] Deleted {deleted} templates...")
-                    time.sleep(0.5)
-                
-                print(f"[OK] Cleared {deleted} existing templates")
-            else:
-                print("[OK] No existing templates to clear")
-        except Exception as e:
-            print(f"[WARN] Clear operation issue: {e}")
-            print("[INFO] Continuing with rebuild (templates will be overwritten)...")
+    generation = args.generation or embedder.generation_tag
+    use_shadow = not args.in_place
+    templates_table = SHADOW_TEMPLATES_TABLE if use_shadow else LIVE_TEMPLATES_TABLE
+    prototypes_table = SHADOW_PROTOTYPES_TABLE if use_shadow else LIVE_PROTOTYPES_TABLE
+    print(f"[INFO] Generation: {generation} (target={templates_table})")
+
+    manifest_path = args.manifest or manifest_path_for(generation)
+    manifest = GalleryManifest.load_or_create(
+        manifest_path,
+        generation,
+        meta={
+            "model_name": embedder.model_name,
+            "pretrained": embedder.pretrained,
+            "preprocess_version": PREPROCESS_VERSION,
+            "target_table": templates_table,
+        },
+    )
+    done_cards = set(manifest.completed)
+    if done_cards:
+        print(f"[INFO] Manifest {manifest_path}: resuming with {len(done_cards)} cards already complete")
+
+    if use_shadow and not args.dry_run:
+        shadow_info = prepare_shadow(
+            supabase, generation, embedder.model_name, embedder.pretrained, PREPROCESS_VERSION
+        )
+        print(
+            f"[OK] Shadow generation ready "
+            f"({shadow_info.get('existing_templates', 0)} templates, "
+            f"{shadow_info.get('existing_cards', 0)} cards already present)"
+        )
+        # Trust the database over the manifest: a lost manifest still resumes correctly
+        done_cards |= fetch_shadow_card_ids(supabase, generation, min_templates=TEMPLATES_PER_CARD)
 
     # Fetch all cards with images
     print(f"\n[INFO] Fetching cards from database{f' (limit={args.limit})' if args.limit else ''}...")
@@ -273,7 +332,18 @@ def main() -> None:
     total_cards = 0
     total_templates = 0
     skipped_cards = 0
+    resumed_cards = 0
     buffered: List[TemplateRecord] = []
+    buffered_cards: List[str] = []
+
+    def flush() -> None:
+        nonlocal buffered, buffered_cards
+        if not args.dry_run and buffered:
+            upsert_templates(supabase, buffered, table=templates_table)
+            manifest.mark_completed(buffered_cards)
+            manifest.save()
+        buffered = []
+        buffered_cards = []
 
     start_time = time.time()
     with requests.Session() as session:
@@ -286,54 +356,88 @@ def main() -> None:
                 skipped_cards += 1
                 continue
 
+            if card_id in done_cards:
+                resumed_cards += 1
+                continue
+
             try:
-                templates = make_templates(card_id, image_url, embedder, session)
+                templates = make_templates(card_id, image_url, embedder, session, generation=generation)
             except Exception as exc:
                 print(f"[WARN] Failed to embed card {card_id}: {exc}")
+                manifest.mark_failed(card_id, str(exc))
                 skipped_cards += 1
                 continue
 
             if not templates:
+                manifest.mark_failed(card_id, "image unavailable")
                 skipped_cards += 1
                 continue
 
             total_cards += 1
             total_templates += len(templates)
             buffered.extend(templates)
+            buffered_cards.append(card_id)
 
-            # Upsert in batches
-            if not args.dry_run and len(buffered) >= UPSERT_BATCH_SIZE:
-                chunk = buffered[:UPSERT_BATCH_SIZE]
-                upsert_templates(supabase, chunk)
+            # Upsert whole cards only, then checkpoint them
+            if len(buffered) >= UPSERT_BATCH_SIZE:
+                flush()
                 elapsed = time.time() - start_time
                 rate = total_cards / elapsed if elapsed > 0 else 0
                 eta = (len(cards) - i) / rate if rate > 0 else 0
                 print(
-                    f"[INFO] Progress: {total_cards}/{len(cards)} cards "
-                    f"({total_templates} templates) | "
+                    f"[INFO] Progress: {total_cards + resumed_cards}/{len(cards)} cards "
+                    f"({total_templates} templates this run) | "
                     f"{rate:.1f} cards/s | "
                     f"ETA: {eta/60:.1f}min"
                 )
-                buffered = buffered[UPSERT_BATCH_SIZE:]
 
     # Final upsert
-    if not args.dry_run and buffered:
-        upsert_templates(supabase, buffered)
-        print(f"[INFO] Upserted remaining {len(buffered)} templates")
+    remaining = len(buffered)
+    flush()
+    if not args.dry_run and remaining:
+        print(f"[INFO] Upserted remaining {remaining} templates")
 
     elapsed = time.time() - start_time
     print(
         f"\n[DONE] Gallery rebuild complete!"
+        f"\n  - Generation: {generation}"
         f"\n  - Processed: {total_cards} cards"
+        f"\n  - Resumed (already done): {resumed_cards} cards"
         f"\n  - Skipped: {skipped_cards} cards"
         f"\n  - Templates: {total_templates}"
         f"\n  - Time: {elapsed/60:.1f} minutes"
-        f"\n  - Rate: {total_cards/elapsed:.1f} cards/s"
+        f"\n  - Rate: {total_cards/elapsed if elapsed > 0 else 0:.1f} cards/s"
     )
 
+    if args.dry_run:
+        return
+
+    manifest.status = "templates_complete"
+    manifest.save()
+
+    if use_shadow and args.carry_over_sources:
+        copied = carry_over_templates(supabase, generation, args.carry_over_sources)
+        print(f"[OK] Carried over {copied} live templates from sources {args.carry_over_sources}")
+
     # Rebuild prototypes
-    if not args.skip_prototypes and not args.dry_run:
-        rebuild_prototypes(supabase)
+    if not args.skip_prototypes:
+        rebuild_prototypes(supabase, templates_table, prototypes_table, generation=generation)
+        manifest.status = "prototypes_complete"
+        manifest.save()
+
+    if use_shadow and not args.no_promote:
+        if args.skip_prototypes:
+            print("[WARN] Not promoting: prototypes were skipped for this generation")
+        else:
+            promoted = promote_shadow(supabase, generation)
+            manifest.status = "promoted"
+            manifest.save()
+            print(
+                f"[OK] Promoted generation {generation} to live "
+                f"({promoted.get('template_count')} templates, {promoted.get('card_count')} cards)"
+            )
+    elif use_shadow:
+        print(f"[INFO] Shadow generation {generation} left unpromoted (--no-promote)")
     
     print("\n[OK] All done! Run CLIP test suite to verify accuracy improvement.")
 
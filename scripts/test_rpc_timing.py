@@ -14,6 +14,7 @@ sys.path.insert(0, str(WORKER_DIR))
 
 from config import get_supabase_client
 from openclip_embedder import build_default_embedder
+from vector_codec import format_vector
 from PIL import Image
 
 FIXTURES = PROJECT_ROOT / "__tests__" / "ocr" / "fixtures"
@@ -34,7 +35,7 @@ def main():
     for topk in [10, 25, 50, 100, 200]:
         print(f"\n[INFO] Testing TopK={topk}...")
         payload = {
-            "qvec": query_vec.tolist(),
+            "qvec": format_vector(query_vec),
             "match_count": topk,
             "set_hint": None,
         }
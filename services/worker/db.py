@@ -0,0 +1,240 @@
+"""
+Pooled, persistent Postgres access for the direct-connection job processor.
+
+* ``Database`` hands out connections from a ``psycopg2.pool.ThreadedConnectionPool``
+  and runs each unit of work in one transaction. A broken connection is discarded
+  and the work retried on a fresh one with backoff, so a Supabase restart or idle
+  disconnect doesn't kill the worker.
+* The hot queue statements (dequeue, single completion) are ``PREPARE``d once per
+  session. This needs a session-level connection (direct 5432 or the session
+  pooler); set ``DB_PREPARED_STATEMENTS=0`` behind a transaction-mode pooler.
+* ``StatusBatcher`` collects finished-job statuses and writes them in a single
+  statement, sent in the same transaction as the next claim, so finishing a job
+  costs no extra round trip.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Tuple, TypeVar
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
+
+T = TypeVar("T")
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "4"))
+DB_PREPARED_STATEMENTS = os.getenv("DB_PREPARED_STATEMENTS", "1").lower() in ("1", "true", "yes")
+DB_RECONNECT_ATTEMPTS = int(os.getenv("DB_RECONNECT_ATTEMPTS", "5"))
+STATUS_BATCH_SIZE = int(os.getenv("STATUS_BATCH_SIZE", "50"))
+
+# Errors that mean the connection (not the statement) is broken
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+# Batched fenced completion: job rows still leased to us flip to their final status,
+# and their scans follow in the same statement. Fenced rows are simply not matched.
+BATCH_COMPLETE_SQL = """
+    WITH v(id, lease_token, status, error_message) AS (VALUES %s),
+    done AS (
+        UPDATE public.job_queue j
+           SET status = v.status,
+               completed_at = now(),
+               error_message = COALESCE(v.error_message, j.error_message),
+               started_at = NULL,
+               visibility_timeout_at = NULL,
+               lease_token = NULL,
+               updated_at = now()
+          FROM v
+         WHERE j.id = v.id::uuid
+           AND j.status = 'processing'
+           AND j.lease_token = v.lease_token::uuid
+        RETURNING j.id, j.scan_upload_id, v.status, v.error_message
+    ),
+    scans_done AS (
+        UPDATE public.scans s
+           SET status = CASE WHEN d.status = 'completed' THEN 'ready' ELSE 'error' END,
+               progress = CASE WHEN d.status = 'completed' THEN 100.0 ELSE s.progress END,
+               error_message = d.error_message,
+               updated_at = now()
+          FROM done d
+         WHERE s.id = d.scan_upload_id
+    )
+    SELECT id::text AS id FROM done
+"""
+
+
+DEQUEUE_SQL = "SELECT * FROM public.dequeue_job_with_lease($1, $2, $3, $4)"
+COMPLETE_SQL = BATCH_COMPLETE_SQL % "($1, $2, $3, $4)"
+
+PREPARED_STATEMENTS = {
+    "dequeue_job": ("(text, int, text, int)", DEQUEUE_SQL),
+    "complete_job": ("(text, text, text, text)", COMPLETE_SQL),
+}
+
+
+def _pyformat(sql: str) -> str:
+    """``$n`` placeholders to psycopg2's ``%s`` for the unprepared path."""
+    return re.sub(r"\$\d+", "%s", sql)
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Connection that remembers whether its session has the statements prepared."""
+
+    prepared = False
+
+
+class Database:
+    def __init__(
+        self,
+        dsn: str,
+        minconn: int = DB_POOL_MIN,
+        maxconn: int = DB_POOL_MAX,
+        use_prepared: bool = DB_PREPARED_STATEMENTS,
+        reconnect_attempts: int = DB_RECONNECT_ATTEMPTS,
+        pool_factory: Callable[..., psycopg2.pool.AbstractConnectionPool] = psycopg2.pool.ThreadedConnectionPool,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.use_prepared = use_prepared
+        self.reconnect_attempts = max(1, reconnect_attempts)
+        self._sleep = sleep
+        self._pool = pool_factory(
+            minconn,
+            maxconn,
+            dsn,
+            connection_factory=PooledConnection,
+            cursor_factory=psycopg2.extras.RealDictCursor,
+            application_name="scan-worker-direct",
+            # Detect dead peers (idle disconnects, failovers) instead of hanging
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3,
+        )
+
+    @contextmanager
+    def _connection(self) -> Iterator[PooledConnection]:
+        conn = self._pool.getconn()
+        broken = False
+        try:
+            yield conn
+        except CONNECTION_ERRORS:
+            broken = True
+            raise
+        finally:
+            self._pool.putconn(conn, close=broken or bool(getattr(conn, "closed", False)))
+
+    def _prepare(self, conn: PooledConnection) -> None:
+        if not self.use_prepared or conn.prepared:
+            return
+        with conn.cursor() as cur:
+            for name, (arg_types, sql) in PREPARED_STATEMENTS.items():
+                cur.execute(f"PREPARE {name} {arg_types} AS {sql}")
+        conn.commit()
+        conn.prepared = True
+
+    def run(self, work: Callable[[psycopg2.extensions.cursor], T]) -> T:
+        """
+        Run ``work(cursor)`` in one transaction and commit. Connection failures are
+        retried on a fresh connection with exponential backoff; other errors roll
+        back and propagate.
+        """
+        for attempt in range(self.reconnect_attempts):
+            try:
+                with self._connection() as conn:
+                    self._prepare(conn)
+                    try:
+                        with conn.cursor() as cur:
+                            result = work(cur)
+                        conn.commit()
+                        return result
+                    except CONNECTION_ERRORS:
+                        raise
+                    except Exception:
+                        conn.rollback()
+                        raise
+            except CONNECTION_ERRORS as e:
+                if attempt == self.reconnect_attempts - 1:
+                    raise
+                delay = min(2 ** attempt, 30)
+                print(f"[WARN] Database connection lost ({e.__class__.__name__}: {e}); reconnecting in {delay}s")
+                self._sleep(delay)
+        raise RuntimeError("unreachable")
+
+    def dequeue(self, cur, worker_id: str, lease_seconds: int, mode: str, max_per_user: Optional[int]) -> Optional[dict]:
+        params = (worker_id, int(lease_seconds), mode, max_per_user)
+        if self.use_prepared:
+            cur.execute("EXECUTE dequeue_job (%s, %s, %s, %s)", params)
+        else:
+            cur.execute(_pyformat(DEQUEUE_SQL), params)
+        return cur.fetchone()
+
+    def complete(self, cur, job_id: str, lease_token: str, status: str, error_message: Optional[str]) -> bool:
+        params = (job_id, lease_token, status, error_message)
+        if self.use_prepared:
+            cur.execute("EXECUTE complete_job (%s, %s, %s, %s)", params)
+        else:
+            cur.execute(_pyformat(COMPLETE_SQL), params)
+        return cur.fetchone() is not None
+
+    def close(self) -> None:
+        self._pool.closeall()
+
+
+StatusUpdate = Tuple[str, str, str, Optional[str]]  # job_id, lease_token, status, error_message
+
+
+class StatusBatcher:
+    """Buffers final job statuses until the next transaction ``apply`` runs in."""
+
+    def __init__(self, db: Database, max_batch: int = STATUS_BATCH_SIZE):
+        self.db = db
+        self.max_batch = max(1, max_batch)
+        self._pending: List[StatusUpdate] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, job_id: str, lease_token: str, status: str, error_message: Optional[str] = None) -> None:
+        with self._lock:
+            self._pending.append((job_id, lease_token, status, error_message))
+
+    def drain(self) -> List[StatusUpdate]:
+        with self._lock:
+            batch, self._pending = self._pending[: self.max_batch], self._pending[self.max_batch:]
+        return batch
+
+    def requeue(self, batch: List[StatusUpdate]) -> None:
+        """Put back a batch whose transaction did not commit."""
+        with self._lock:
+            self._pending[:0] = batch
+
+    def apply(self, cur, batch: List[StatusUpdate]) -> List[str]:
+        """Write ``batch`` on ``cur`` (caller commits). Returns the job ids that were still ours."""
+        if not batch:
+            return []
+        if len(batch) == 1:
+            job_id, lease_token, status, error_message = batch[0]
+            return [job_id] if self.db.complete(cur, job_id, lease_token, status, error_message) else []
+        rows = psycopg2.extras.execute_values(cur, BATCH_COMPLETE_SQL, batch, fetch=True)
+        return [row["id"] for row in rows]
+
+    def flush(self) -> List[str]:
+        """Write everything pending in its own transaction."""
+        applied: List[str] = []
+        while True:
+            batch = self.drain()
+            if not batch:
+                return applied
+            try:
+                applied += self.db.run(lambda cur: self.apply(cur, batch))
+            except Exception:
+                self.requeue(batch)
+                raise
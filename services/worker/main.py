@@ -1,19 +1,37 @@
 #!/usr/bin/env python3
 """
-Tiny polling worker for Project Arceus – Stage 3
-*   grabs the next pending job from job_queue (SKIP LOCKED ⇒ 1 job / worker)
-*   flips job + binder_page_upload statuses
-*   simulates work (time.sleep)
-*   marks success/failure
+Direct-Postgres job processor for Project Arceus.
+
+*   claims jobs with ``dequeue_job_with_lease`` over a pooled, persistent psycopg2
+    connection (prepared statement, reconnect with backoff; see db.py)
+*   runs the scan pipeline from worker/worker.py on each job (``--pipeline scan``),
+    or completes jobs without work to exercise the queue (``--pipeline noop``)
+*   batches final statuses into the next claim's transaction, fenced on the lease
+*   routes failures through ``record_job_failure`` (retry with backoff or dead-letter)
+
+Storage and the pipeline's own detection writes still go through the Supabase
+client; only the queue traffic, the busiest queries, skips PostgREST.
 """
 
+import argparse
 import os
+import sys
 import time
-import random
-import psycopg2
-import psycopg2.extras
+import traceback
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
 from dotenv import load_dotenv
-import argparse
+
+from db import Database, StatusBatcher
+
+WORKER_DIR = Path(__file__).resolve().parents[2] / "worker"
+if str(WORKER_DIR) not in sys.path:
+    sys.path.insert(0, str(WORKER_DIR))
+
+from config import JOB_LEASE_SECONDS, JOB_RETRY_BACKOFF_SECONDS, MAX_JOB_RETRIES, MAX_JOBS_PER_USER, QUEUE_SCHEDULING_MODE  # noqa: E402
+from job_failures import classify_failure, input_hash_for  # noqa: E402
+from job_lease import WORKER_ID  # noqa: E402
 
 # Load environment variables from .env when running locally
 load_dotenv()
@@ -22,121 +40,153 @@ DSN = os.environ.get("SUPABASE_DB_URL") or os.environ.get("DATABASE_URL")
 if DSN is None:
     raise RuntimeError("Environment variable SUPABASE_DB_URL or DATABASE_URL must be set.")
 POLL_INTERVAL = 5  # seconds between empty-queue checks
-SIMULATED_WORK_SECS = 2  # placeholder for real processing time
 
+FAILURE_SQL = """
+    SELECT public.record_job_failure(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) AS action
+"""
+
+JobHandler = Callable[[Dict], Dict]
 
-def pg_conn():
-    """Return a new PostgreSQL connection using a RealDictCursor."""
-    return psycopg2.connect(DSN, cursor_factory=psycopg2.extras.RealDictCursor)
 
+def noop_pipeline(job: Dict) -> Dict:
+    """Complete the job without doing any work (queue smoke/load tests)."""
+    return {"status": "ready", "total_detections": 0}
 
-def dequeue_job(cur):
-    """Atomically claim the next pending job and set it to processing.
 
-    Returns the full job row or ``None`` if the queue is empty.
+def load_scan_pipeline() -> JobHandler:
+    """Load YOLO, the identifier and a Supabase client once; return a per-job handler."""
+    import worker as scan_worker  # worker/worker.py; heavy imports (torch, ultralytics)
+    from job_lease import JobLease
+
+    supabase_client = scan_worker.get_supabase_client()
+    yolo_model = scan_worker.get_yolo_model()
+    clip_identifier = None if scan_worker.USE_RETRIEVAL_V2 else scan_worker.CLIPCardIdentifier(supabase_client=supabase_client)
+
+    def run(job: Dict) -> Dict:
+        with scan_worker.stage_timing.job_trace(job["job_id"]) as trace:
+            try:
+                with JobLease(supabase_client, job["job_id"], job["lease_token"]) as lease:
+                    results = scan_worker.run_normalized_pipeline(supabase_client, job, yolo_model, clip_identifier, lease=lease)
+            except Exception as exc:
+                # Failing stage and saved log for record_failure, as worker.py's handle_job_failure records them
+                failure = classify_failure(exc, trace.active_stage, input_hash_for(job))
+                job["failure_stage"] = failure.stage
+                job["output_log_path"] = str(scan_worker.save_output_log(job["job_id"], {
+                    "error": str(exc), "traceback": traceback.format_exc(), "timings": trace.breakdown(),
+                    "failure": {"fingerprint": failure.fingerprint, "error_class": failure.error_class,
+                                "stage": failure.stage, "transient": failure.transient},
+                }))
+                raise
+            results["timings"] = trace.breakdown()
+        scan_worker.save_output_log(job["job_id"], results)
+        return results
+
+    return run
+
+
+def record_failure(db: Database, batcher: StatusBatcher, job: Dict, exc: Exception) -> str:
     """
-    cur.execute(
-        """
-        UPDATE job_queue
-           SET status      = 'processing',
-               started_at  = NOW()
-         WHERE id = (
-               SELECT id
-                 FROM job_queue
-                WHERE status = 'pending'
-             ORDER BY created_at
-                LIMIT 1
-                FOR UPDATE SKIP LOCKED
-              )
-     RETURNING *;
-        """
-    )
-    return cur.fetchone()
-
-
-def mark_upload(cur, upload_id: str, processing_status: str):
-    """Update ``binder_page_uploads.processing_status`` for a given upload."""
-    cur.execute(
-        """
-        UPDATE binder_page_uploads
-           SET processing_status = %s,
-               updated_at        = NOW()
-         WHERE id = %s;
-        """,
-        (processing_status, upload_id),
+    Retry-or-dead-letter decision in the database; plain 'failed' if the RPC is missing.
+    Handlers that trace stages leave ``failure_stage`` and ``output_log_path`` on the job.
+    """
+    failure = classify_failure(exc, job.get("failure_stage"), input_hash_for(job))
+    params = (
+        job["job_id"], job["lease_token"], failure.fingerprint, failure.error_class, failure.stage,
+        failure.input_hash, failure.transient, failure.message, traceback.format_exc(),
+        job.get("output_log_path"), WORKER_ID, MAX_JOB_RETRIES, int(JOB_RETRY_BACKOFF_SECONDS),
     )
+    try:
+        row = db.run(lambda cur: (cur.execute(FAILURE_SQL, params), cur.fetchone())[1])
+        return row["action"]
+    except Exception as e:
+        print(f"[WARN] record_job_failure unavailable ({e}); marking job failed")
+        batcher.add(job["job_id"], job["lease_token"], "failed", failure.message)
+        return "failed"
 
 
-def mark_job(cur, job_id: str, status: str):
-    """Update ``job_queue.status`` for a given job."""
-    cur.execute(
-        """
-        UPDATE job_queue
-           SET status      = %s,
-               finished_at = NOW()
-         WHERE id = %s;
-        """,
-        (status, job_id),
-    )
+def claim_next(db: Database, batcher: StatusBatcher) -> Optional[Dict]:
+    """Write pending statuses and claim the next job in one transaction."""
+    statuses = batcher.drain()
 
+    def work(cur):
+        applied = batcher.apply(cur, statuses)
+        if len(applied) < len(statuses):
+            print(f"[FENCED] {len(statuses) - len(applied)} finished job(s) were leased to another worker")
+        max_per_user = MAX_JOBS_PER_USER if MAX_JOBS_PER_USER > 0 else None
+        return db.dequeue(cur, WORKER_ID, JOB_LEASE_SECONDS, QUEUE_SCHEDULING_MODE, max_per_user)
 
-def run_once(max_jobs: int | None = None):
+    try:
+        job = db.run(work)
+    except Exception:
+        batcher.requeue(statuses)
+        raise
+    return dict(job) if job else None
+
+
+def _handle_job(db: Database, batcher: StatusBatcher, handler: JobHandler, job: Dict) -> None:
+    print(f"⚙️  Working on job {job['job_id']} → scan {job['scan_upload_id']}")
+    started = time.perf_counter()
+    try:
+        handler(job)
+    except Exception as exc:
+        action = record_failure(db, batcher, job, exc)
+        print(f"🔥 Job {job['job_id']} crashed → {exc} ({action})")
+        return
+    batcher.add(job["job_id"], job["lease_token"], "completed")
+    print(f"✅ Job {job['job_id']} completed in {time.perf_counter() - started:.1f}s")
+
+
+def run_once(db: Database, batcher: StatusBatcher, handler: JobHandler, max_jobs: Optional[int] = None) -> int:
     """Process up to ``max_jobs`` pending jobs and then return.
     If ``max_jobs`` is ``None``, drain the entire queue once.
     """
     processed = 0
-    with pg_conn() as conn, conn.cursor() as cur:
-        while True:
-            job = dequeue_job(cur)
-            conn.commit()
+    try:
+        while max_jobs is None or processed < max_jobs:
+            job = claim_next(db, batcher)
             if not job:
                 break
-            _handle_job(conn, cur, job)
+            _handle_job(db, batcher, handler, job)
             processed += 1
-            if max_jobs is not None and processed >= max_jobs:
-                break
-
-
-def _handle_job(conn, cur, job):
-    print(f"⚙️  Working on job {job['id']} → upload {job['scan_upload_id']}")
-    try:
-        mark_upload(cur, job["scan_upload_id"], "processing")
-        conn.commit()
-        time.sleep(SIMULATED_WORK_SECS)
-        outcome = "completed" if random.random() > 0.05 else "failed"
-        mark_upload(cur, job["scan_upload_id"], outcome)
-        mark_job(cur, job["id"], outcome)
-        conn.commit()
-        print(f"✅ Job {job['id']} {outcome}")
-    except Exception as exc:
-        conn.rollback()
-        print(f"🔥 Job {job['id']} crashed → {exc}")
-        with pg_conn() as c2, c2.cursor() as c2cur:
-            mark_upload(c2cur, job["scan_upload_id"], "failed")
-            mark_job(c2cur, job["id"], "failed")
-            c2.commit()
+    finally:
+        batcher.flush()
+    return processed
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Project Arceus job processor")
     parser.add_argument("--once", action="store_true", help="Process the queue once and exit")
     parser.add_argument("--max", type=int, default=None, help="Max jobs to process in once mode")
+    parser.add_argument("--pipeline", choices=("scan", "noop"), default="scan",
+                        help="scan: full detection/identification pipeline; noop: complete jobs without work")
     args = parser.parse_args()
 
-    if args.once:
-        run_once(args.max)
-        return
+    handler = load_scan_pipeline() if args.pipeline == "scan" else noop_pipeline
+    db = Database(DSN)
+    batcher = StatusBatcher(db)
+    try:
+        if args.once:
+            run_once(db, batcher, handler, args.max)
+            return
 
-    print("🐍  Worker online. Polling for jobs…")
-    while True:
-        with pg_conn() as conn, conn.cursor() as cur:
-            job = dequeue_job(cur)
-            conn.commit()
+        print("🐍  Worker online. Polling for jobs…")
+        while True:
+            try:
+                job = claim_next(db, batcher)
+            except Exception as e:
+                print(f"[ERROR] Claim failed after reconnect attempts: {e}")
+                time.sleep(POLL_INTERVAL)
+                continue
             if not job:
                 time.sleep(POLL_INTERVAL)
                 continue
-            _handle_job(conn, cur, job)
+            _handle_job(db, batcher, handler, job)
+    finally:
+        try:
+            batcher.flush()
+        finally:
+            db.close()
 
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,206 @@
+-- Resumable gallery rebuilds: shadow generations with atomic cutover
+--
+-- Rebuilds write into card_templates_shadow / card_prototypes_shadow tagged with a
+-- generation string (model + preprocess version). Retrieval keeps reading the live
+-- tables the whole time. promote_gallery_shadow() swaps the shadow tables in with
+-- two renames inside one transaction, so readers see either the old or the new
+-- gallery, never a half-built one.
+--
+-- The functions create, rename and drop tables owned by postgres, so they run
+-- SECURITY DEFINER and are executable by service_role only.
+
+ALTER TABLE public.card_templates ADD COLUMN IF NOT EXISTS generation text;
+ALTER TABLE public.card_prototypes ADD COLUMN IF NOT EXISTS generation text;
+
+CREATE TABLE IF NOT EXISTS public.gallery_generations (
+    generation text PRIMARY KEY,
+    model_name text NOT NULL,
+    pretrained text,
+    preprocess_version text NOT NULL,
+    status text NOT NULL DEFAULT 'building'
+        CHECK (status IN ('building', 'active', 'retired')),
+    card_count int,
+    template_count int,
+    created_at timestamptz DEFAULT now(),
+    activated_at timestamptz
+);
+
+COMMENT ON TABLE public.gallery_generations IS 'Gallery rebuild generations (model + preprocess version) and which one is live';
+
+-- Create (or reuse) the shadow tables for a generation.
+-- Reusing is what makes rebuilds resumable; a shadow holding another generation is an error.
+CREATE OR REPLACE FUNCTION public.prepare_gallery_shadow(
+    p_generation text,
+    p_model_name text,
+    p_pretrained text,
+    p_preprocess_version text
+) RETURNS TABLE (
+    generation text,
+    existing_templates bigint,
+    existing_cards bigint
+) LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    v_other text;
+BEGIN
+    CREATE TABLE IF NOT EXISTS public.card_templates_shadow
+        (LIKE public.card_templates INCLUDING ALL);
+    CREATE TABLE IF NOT EXISTS public.card_prototypes_shadow
+        (LIKE public.card_prototypes INCLUDING ALL);
+
+    SELECT s.generation INTO v_other
+      FROM public.card_templates_shadow s
+     WHERE s.generation IS DISTINCT FROM p_generation
+     LIMIT 1;
+    IF FOUND THEN
+        RAISE EXCEPTION 'card_templates_shadow holds generation %, not %. Run discard_gallery_shadow() first.',
+            COALESCE(v_other, '<untagged>'), p_generation;
+    END IF;
+
+    INSERT INTO public.gallery_generations (generation, model_name, pretrained, preprocess_version)
+    VALUES (p_generation, p_model_name, p_pretrained, p_preprocess_version)
+    ON CONFLICT ON CONSTRAINT gallery_generations_pkey DO NOTHING;
+
+    NOTIFY pgrst, 'reload schema';
+
+    RETURN QUERY
+    SELECT p_generation,
+           (SELECT count(*) FROM public.card_templates_shadow),
+           (SELECT count(DISTINCT s.card_id) FROM public.card_templates_shadow s);
+END;
+$$;
+
+-- Drop an abandoned shadow build.
+CREATE OR REPLACE FUNCTION public.discard_gallery_shadow() RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    DELETE FROM public.gallery_generations g
+     WHERE g.status = 'building'
+       AND g.generation IN (SELECT DISTINCT s.generation FROM public.card_templates_shadow s);
+    DROP TABLE IF EXISTS public.card_templates_shadow;
+    DROP TABLE IF EXISTS public.card_prototypes_shadow;
+    NOTIFY pgrst, 'reload schema';
+EXCEPTION
+    WHEN undefined_table THEN
+        NOTIFY pgrst, 'reload schema';
+END;
+$$;
+
+-- Copy live templates from non-rebuilt sources (e.g. user_scan crops) into the shadow.
+-- Only meaningful when they were embedded with a compatible model; the caller decides.
+CREATE OR REPLACE FUNCTION public.carry_over_gallery_templates(
+    p_generation text,
+    p_sources text[]
+) RETURNS bigint
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    v_copied bigint;
+BEGIN
+    INSERT INTO public.card_templates_shadow
+        (id, card_id, set_id, variant, source, aug_tag, emb, created_at, generation)
+    SELECT t.id, t.card_id, t.set_id, t.variant, t.source, t.aug_tag, t.emb, t.created_at, p_generation
+      FROM public.card_templates t
+     WHERE t.source = ANY(p_sources)
+    ON CONFLICT DO NOTHING;
+    GET DIAGNOSTICS v_copied = ROW_COUNT;
+    RETURN v_copied;
+END;
+$$;
+
+-- Atomically make the shadow generation live. The previous live tables are kept as
+-- *_retired until the next promotion so a bad generation can be rolled back by hand.
+CREATE OR REPLACE FUNCTION public.promote_gallery_shadow(p_generation text)
+RETURNS TABLE (
+    generation text,
+    template_count bigint,
+    card_count bigint
+) LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    v_templates bigint;
+    v_cards bigint;
+    v_prototypes bigint;
+BEGIN
+    IF to_regclass('public.card_templates_shadow') IS NULL
+       OR to_regclass('public.card_prototypes_shadow') IS NULL THEN
+        RAISE EXCEPTION 'No shadow gallery to promote';
+    END IF;
+
+    IF EXISTS (
+        SELECT 1 FROM public.card_templates_shadow s
+         WHERE s.generation IS DISTINCT FROM p_generation
+    ) THEN
+        RAISE EXCEPTION 'Shadow gallery contains rows outside generation %', p_generation;
+    END IF;
+
+    SELECT count(*), count(DISTINCT s.card_id) INTO v_templates, v_cards
+      FROM public.card_templates_shadow s;
+    SELECT count(*) INTO v_prototypes FROM public.card_prototypes_shadow;
+    IF v_templates = 0 OR v_prototypes = 0 THEN
+        RAISE EXCEPTION 'Refusing to promote empty shadow gallery (templates=%, prototypes=%)',
+            v_templates, v_prototypes;
+    END IF;
+
+    LOCK TABLE public.card_templates, public.card_prototypes IN ACCESS EXCLUSIVE MODE;
+
+    DROP TABLE IF EXISTS public.card_templates_retired;
+    DROP TABLE IF EXISTS public.card_prototypes_retired;
+    ALTER TABLE public.card_templates RENAME TO card_templates_retired;
+    ALTER TABLE public.card_prototypes RENAME TO card_prototypes_retired;
+    ALTER TABLE public.card_templates_shadow RENAME TO card_templates;
+    ALTER TABLE public.card_prototypes_shadow RENAME TO card_prototypes;
+
+    UPDATE public.gallery_generations g
+       SET status = 'retired'
+     WHERE g.status = 'active';
+    UPDATE public.gallery_generations g
+       SET status = 'active',
+           activated_at = now(),
+           card_count = v_cards,
+           template_count = v_templates
+     WHERE g.generation = p_generation;
+
+    NOTIFY pgrst, 'reload schema';
+
+    RETURN QUERY SELECT p_generation, v_templates, v_cards;
+END;
+$$;
+
+-- Cards already embedded in the shadow generation, with their template counts (resume support)
+CREATE OR REPLACE FUNCTION public.gallery_shadow_card_ids(p_generation text)
+RETURNS TABLE (card_id text, template_count int)
+LANGUAGE plpgsql STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    -- plpgsql so the function can be created before the shadow table exists
+    RETURN QUERY
+    SELECT s.card_id, count(*)::int
+      FROM public.card_templates_shadow s
+     WHERE s.generation = p_generation
+     GROUP BY s.card_id;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.prepare_gallery_shadow(text, text, text, text) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.discard_gallery_shadow() FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.carry_over_gallery_templates(text, text[]) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.promote_gallery_shadow(text) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.gallery_shadow_card_ids(text) FROM PUBLIC, anon, authenticated;
+
+GRANT EXECUTE ON FUNCTION public.prepare_gallery_shadow(text, text, text, text) TO service_role;
+GRANT EXECUTE ON FUNCTION public.discard_gallery_shadow() TO service_role;
+GRANT EXECUTE ON FUNCTION public.carry_over_gallery_templates(text, text[]) TO service_role;
+GRANT EXECUTE ON FUNCTION public.promote_gallery_shadow(text) TO service_role;
+GRANT EXECUTE ON FUNCTION public.gallery_shadow_card_ids(text) TO service_role;
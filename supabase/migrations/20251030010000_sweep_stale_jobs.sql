@@ -0,0 +1,128 @@
+-- Server-side stale job sweeper
+--
+-- Replaces the per-worker requeue_stale_jobs() loop (two SELECTs + one UPDATE per job
+-- per table on every loop iteration, in every worker) and the duplicate logic in
+-- auto_recovery_system.py with one set-based statement.
+--
+-- Workers call sweep_stale_jobs() on a jittered cadence. The queue_maintenance row
+-- acts as the election: only the first caller inside each p_min_interval window
+-- actually sweeps, everyone else gets swept = false back from a single-row UPDATE.
+
+ALTER TABLE public.job_queue ADD COLUMN IF NOT EXISTS started_at timestamptz;
+ALTER TABLE public.job_queue ADD COLUMN IF NOT EXISTS visibility_timeout_at timestamptz;
+
+CREATE INDEX IF NOT EXISTS idx_job_queue_processing_started_at
+    ON public.job_queue (started_at)
+    WHERE status = 'processing';
+
+CREATE TABLE IF NOT EXISTS public.queue_maintenance (
+    task text PRIMARY KEY,
+    last_run_at timestamptz NOT NULL DEFAULT 'epoch',
+    last_result jsonb
+);
+
+INSERT INTO public.queue_maintenance (task)
+VALUES ('sweep_stale_jobs')
+ON CONFLICT (task) DO NOTHING;
+
+COMMENT ON TABLE public.queue_maintenance IS 'Last-run bookkeeping for queue maintenance tasks; doubles as the sweeper election lock';
+
+CREATE OR REPLACE FUNCTION public.sweep_stale_jobs(
+    p_max_retries int DEFAULT 3,
+    p_stale_after interval DEFAULT interval '15 minutes',
+    p_min_interval interval DEFAULT NULL
+) RETURNS TABLE (
+    swept boolean,
+    requeued_count int,
+    failed_count int,
+    scans_updated int,
+    requeued_job_ids uuid[],
+    failed_job_ids uuid[]
+)
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_requeued uuid[];
+    v_failed uuid[];
+    v_scans int;
+BEGIN
+    -- Election: claim this sweep window or bow out
+    UPDATE public.queue_maintenance m
+       SET last_run_at = now()
+     WHERE m.task = 'sweep_stale_jobs'
+       AND (p_min_interval IS NULL OR m.last_run_at <= now() - p_min_interval);
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT false, 0, 0, 0, ARRAY[]::uuid[], ARRAY[]::uuid[];
+        RETURN;
+    END IF;
+
+    WITH stale AS (
+        SELECT q.id, q.scan_upload_id, COALESCE(q.retry_count, 0) AS retry_count
+          FROM public.job_queue q
+         WHERE q.status = 'processing'
+           AND (q.visibility_timeout_at <= now()
+                OR q.started_at <= now() - p_stale_after)
+           FOR UPDATE SKIP LOCKED
+    ),
+    requeued AS (
+        UPDATE public.job_queue j
+           SET status = 'pending',
+               started_at = NULL,
+               picked_at = NULL,
+               visibility_timeout_at = NULL,
+               retry_count = s.retry_count + 1,
+               updated_at = now()
+          FROM stale s
+         WHERE j.id = s.id
+           AND s.retry_count < p_max_retries
+        RETURNING j.id, j.scan_upload_id
+    ),
+    failed AS (
+        UPDATE public.job_queue j
+           SET status = 'failed',
+               completed_at = now(),
+               started_at = NULL,
+               visibility_timeout_at = NULL,
+               error_message = 'Processing failed after multiple retries',
+               updated_at = now()
+          FROM stale s
+         WHERE j.id = s.id
+           AND s.retry_count >= p_max_retries
+        RETURNING j.id, j.scan_upload_id
+    ),
+    scans_requeued AS (
+        UPDATE public.scans sc
+           SET status = 'processing',
+               error_message = NULL
+         WHERE sc.id IN (SELECT r.scan_upload_id FROM requeued r)
+        RETURNING sc.id
+    ),
+    scans_failed AS (
+        UPDATE public.scans sc
+           SET status = 'error',
+               error_message = 'Processing failed after multiple retries'
+         WHERE sc.id IN (SELECT f.scan_upload_id FROM failed f)
+        RETURNING sc.id
+    )
+    SELECT COALESCE((SELECT array_agg(r.id) FROM requeued r), ARRAY[]::uuid[]),
+           COALESCE((SELECT array_agg(f.id) FROM failed f), ARRAY[]::uuid[]),
+           (SELECT count(*) FROM scans_requeued) + (SELECT count(*) FROM scans_failed)
+      INTO v_requeued, v_failed, v_scans;
+
+    UPDATE public.queue_maintenance m
+       SET last_result = jsonb_build_object(
+               'requeued', cardinality(v_requeued),
+               'failed', cardinality(v_failed),
+               'scans_updated', v_scans
+           )
+     WHERE m.task = 'sweep_stale_jobs';
+
+    RETURN QUERY SELECT true, cardinality(v_requeued), cardinality(v_failed), v_scans, v_requeued, v_failed;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.sweep_stale_jobs(int, interval, interval) TO service_role;
+
+COMMENT ON FUNCTION public.sweep_stale_jobs(int, interval, interval) IS
+'Requeue (or fail after p_max_retries) every processing job whose visibility timeout expired or that started more than p_stale_after ago, and update the matching scans, in one statement. With p_min_interval set, at most one caller per window performs the sweep.';
@@ -0,0 +1,206 @@
+-- Renewable job leases with fenced completion
+--
+-- A dequeue now hands out a short lease (visibility_timeout_at) plus a fresh
+-- lease_token. The worker renews the lease from a heartbeat thread while the
+-- pipeline runs, so long scans are never requeued mid-flight, and a crashed
+-- worker's job becomes visible again within one short lease. Completion only
+-- succeeds for the current token holder: once a job has been swept and picked up
+-- again, the superseded worker's renewals and final status write are rejected.
+
+ALTER TABLE public.job_queue ADD COLUMN IF NOT EXISTS lease_token uuid;
+
+COMMENT ON COLUMN public.job_queue.lease_token IS 'Token of the current lease holder; rotated on every dequeue, cleared on completion/requeue';
+
+CREATE OR REPLACE FUNCTION public.dequeue_job_with_lease(
+    p_worker_id text DEFAULT NULL,
+    p_lease_seconds int DEFAULT 60
+) RETURNS TABLE (
+    job_id uuid,
+    scan_upload_id uuid,
+    job_type text,
+    payload jsonb,
+    retry_count int,
+    lease_token uuid,
+    lease_expires_at timestamptz
+)
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+#variable_conflict use_column
+BEGIN
+    RETURN QUERY
+    WITH claimed AS (
+        UPDATE public.job_queue j
+           SET status = 'processing',
+               picked_at = now(),
+               started_at = now(),
+               worker_id = p_worker_id,
+               lease_token = gen_random_uuid(),
+               visibility_timeout_at = now() + make_interval(secs => p_lease_seconds),
+               updated_at = now()
+         WHERE j.id = (
+                SELECT q.id
+                  FROM public.job_queue q
+                 WHERE q.status = 'pending'
+                   AND q.run_at <= now()
+                 ORDER BY q.run_at
+                 LIMIT 1
+                   FOR UPDATE SKIP LOCKED
+               )
+        RETURNING j.id, j.scan_upload_id, j.job_type, j.payload, j.retry_count::int AS retry_count,
+                  j.lease_token, j.visibility_timeout_at
+    )
+    SELECT * FROM claimed;
+END;
+$$;
+
+-- Extend the lease. Returns the new expiry, or NULL when the caller no longer holds it.
+CREATE OR REPLACE FUNCTION public.renew_job_lease(
+    p_job_id uuid,
+    p_lease_token uuid,
+    p_lease_seconds int DEFAULT 60
+) RETURNS timestamptz
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_expires timestamptz;
+BEGIN
+    UPDATE public.job_queue j
+       SET visibility_timeout_at = now() + make_interval(secs => p_lease_seconds),
+           updated_at = now()
+     WHERE j.id = p_job_id
+       AND j.status = 'processing'
+       AND j.lease_token = p_lease_token
+    RETURNING j.visibility_timeout_at INTO v_expires;
+    RETURN v_expires;
+END;
+$$;
+
+-- Fenced completion: only the current lease holder may finish the job.
+CREATE OR REPLACE FUNCTION public.complete_job_lease(
+    p_job_id uuid,
+    p_lease_token uuid,
+    p_status text,
+    p_error_message text DEFAULT NULL
+) RETURNS boolean
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+    UPDATE public.job_queue j
+       SET status = p_status,
+           completed_at = CASE WHEN p_status IN ('completed', 'failed') THEN now() ELSE NULL END,
+           error_message = COALESCE(p_error_message, j.error_message),
+           started_at = NULL,
+           visibility_timeout_at = NULL,
+           lease_token = NULL,
+           updated_at = now()
+     WHERE j.id = p_job_id
+       AND j.status = 'processing'
+       AND j.lease_token = p_lease_token;
+    RETURN FOUND;
+END;
+$$;
+
+-- Leased jobs are governed by lease expiry alone; the started_at age limit only
+-- applies to jobs dequeued without a lease (older workers).
+CREATE OR REPLACE FUNCTION public.sweep_stale_jobs(
+    p_max_retries int DEFAULT 3,
+    p_stale_after interval DEFAULT interval '15 minutes',
+    p_min_interval interval DEFAULT NULL
+) RETURNS TABLE (
+    swept boolean,
+    requeued_count int,
+    failed_count int,
+    scans_updated int,
+    requeued_job_ids uuid[],
+    failed_job_ids uuid[]
+)
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_requeued uuid[];
+    v_failed uuid[];
+    v_scans int;
+BEGIN
+    UPDATE public.queue_maintenance m
+       SET last_run_at = now()
+     WHERE m.task = 'sweep_stale_jobs'
+       AND (p_min_interval IS NULL OR m.last_run_at <= now() - p_min_interval);
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT false, 0, 0, 0, ARRAY[]::uuid[], ARRAY[]::uuid[];
+        RETURN;
+    END IF;
+
+    WITH stale AS (
+        SELECT q.id, q.scan_upload_id, COALESCE(q.retry_count, 0) AS retry_count
+          FROM public.job_queue q
+         WHERE q.status = 'processing'
+           AND (q.visibility_timeout_at <= now()
+                OR (q.lease_token IS NULL AND q.started_at <= now() - p_stale_after))
+           FOR UPDATE SKIP LOCKED
+    ),
+    requeued AS (
+        UPDATE public.job_queue j
+           SET status = 'pending',
+               started_at = NULL,
+               picked_at = NULL,
+               visibility_timeout_at = NULL,
+               lease_token = NULL,
+               retry_count = s.retry_count + 1,
+               updated_at = now()
+          FROM stale s
+         WHERE j.id = s.id
+           AND s.retry_count < p_max_retries
+        RETURNING j.id, j.scan_upload_id
+    ),
+    failed AS (
+        UPDATE public.job_queue j
+           SET status = 'failed',
+               completed_at = now(),
+               started_at = NULL,
+               visibility_timeout_at = NULL,
+               lease_token = NULL,
+               error_message = 'Processing failed after multiple retries',
+               updated_at = now()
+          FROM stale s
+         WHERE j.id = s.id
+           AND s.retry_count >= p_max_retries
+        RETURNING j.id, j.scan_upload_id
+    ),
+    scans_requeued AS (
+        UPDATE public.scans sc
+           SET status = 'processing',
+               error_message = NULL
+         WHERE sc.id IN (SELECT r.scan_upload_id FROM requeued r)
+        RETURNING sc.id
+    ),
+    scans_failed AS (
+        UPDATE public.scans sc
+           SET status = 'error',
+               error_message = 'Processing failed after multiple retries'
+         WHERE sc.id IN (SELECT f.scan_upload_id FROM failed f)
+        RETURNING sc.id
+    )
+    SELECT COALESCE((SELECT array_agg(r.id) FROM requeued r), ARRAY[]::uuid[]),
+           COALESCE((SELECT array_agg(f.id) FROM failed f), ARRAY[]::uuid[]),
+           (SELECT count(*) FROM scans_requeued) + (SELECT count(*) FROM scans_failed)
+      INTO v_requeued, v_failed, v_scans;
+
+    UPDATE public.queue_maintenance m
+       SET last_result = jsonb_build_object(
+               'requeued', cardinality(v_requeued),
+               'failed', cardinality(v_failed),
+               'scans_updated', v_scans
+           )
+     WHERE m.task = 'sweep_stale_jobs';
+
+    RETURN QUERY SELECT true, cardinality(v_requeued), cardinality(v_failed), v_scans, v_requeued, v_failed;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.dequeue_job_with_lease(text, int) TO service_role;
+GRANT EXECUTE ON FUNCTION public.renew_job_lease(uuid, uuid, int) TO service_role;
+GRANT EXECUTE ON FUNCTION public.complete_job_lease(uuid, uuid, text, text) TO service_role;
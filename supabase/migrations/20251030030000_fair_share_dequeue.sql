@@ -0,0 +1,183 @@
+-- Fair-share job scheduling
+--
+-- Dequeue used to be strict FIFO, so one user bulk-uploading a binder starved every
+-- other user's single scan until the whole backlog drained. dequeue_job_with_lease
+-- now supports:
+--   * priority: higher job_queue.priority is always served first (bulk uploads
+--     enqueue at -1, interactive scans at 0)
+--   * p_mode = 'fair': within a priority class, pick the user with the fewest
+--     running jobs, then the one served least recently (per-user round-robin)
+--   * p_max_per_user: cap on concurrently processing jobs per user
+-- p_mode = 'fifo' keeps the old ordering (priority, then run_at).
+
+ALTER TABLE public.job_queue ADD COLUMN IF NOT EXISTS user_id uuid;
+ALTER TABLE public.job_queue ADD COLUMN IF NOT EXISTS priority smallint NOT NULL DEFAULT 0;
+
+UPDATE public.job_queue q
+   SET user_id = s.user_id
+  FROM public.scans s
+ WHERE q.scan_upload_id = s.id
+   AND q.user_id IS NULL;
+
+-- Denormalize the owner so the scheduler never has to join scans
+CREATE OR REPLACE FUNCTION public.job_queue_set_user_id() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF NEW.user_id IS NULL THEN
+        SELECT s.user_id INTO NEW.user_id FROM public.scans s WHERE s.id = NEW.scan_upload_id;
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_job_queue_set_user_id ON public.job_queue;
+CREATE TRIGGER trg_job_queue_set_user_id
+    BEFORE INSERT ON public.job_queue
+    FOR EACH ROW EXECUTE FUNCTION public.job_queue_set_user_id();
+
+CREATE INDEX IF NOT EXISTS idx_job_queue_pending_user
+    ON public.job_queue (user_id, priority DESC, run_at)
+    WHERE status = 'pending';
+
+CREATE INDEX IF NOT EXISTS idx_job_queue_processing_user
+    ON public.job_queue (user_id)
+    WHERE status = 'processing';
+
+-- enqueue_scan_job gains an optional priority (existing 3-argument callers keep working)
+DROP FUNCTION IF EXISTS public.enqueue_scan_job(uuid, uuid, text);
+
+CREATE FUNCTION public.enqueue_scan_job(
+    p_scan_id uuid,
+    p_user_id uuid,
+    p_storage_path text,
+    p_priority int DEFAULT 0
+)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+    -- Check if scan already exists for this storage path
+    IF EXISTS (SELECT 1 FROM scans WHERE storage_path = p_storage_path) THEN
+        RAISE NOTICE 'Scan already exists for storage_path: %', p_storage_path;
+        RETURN;
+    END IF;
+
+    INSERT INTO public.scans(id, user_id, storage_path, title, status)
+    VALUES (p_scan_id, p_user_id, p_storage_path, 'Untitled Scan', 'processing');
+
+    INSERT INTO public.job_queue(scan_upload_id, user_id, priority, status, job_type, payload)
+    VALUES (p_scan_id, p_user_id, p_priority, 'pending', 'process_scan_page',
+            jsonb_build_object('storage_path', p_storage_path));
+END;
+$$;
+
+COMMENT ON FUNCTION public.enqueue_scan_job IS 'Idempotent: Prevents duplicate scans. Uses processing status to match scan constraint. p_priority < 0 for bulk uploads.';
+
+DROP FUNCTION IF EXISTS public.dequeue_job_with_lease(text, int);
+
+CREATE FUNCTION public.dequeue_job_with_lease(
+    p_worker_id text DEFAULT NULL,
+    p_lease_seconds int DEFAULT 60,
+    p_mode text DEFAULT 'fair',
+    p_max_per_user int DEFAULT NULL
+) RETURNS TABLE (
+    job_id uuid,
+    scan_upload_id uuid,
+    job_type text,
+    payload jsonb,
+    retry_count int,
+    lease_token uuid,
+    lease_expires_at timestamptz
+)
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+#variable_conflict use_column
+DECLARE
+    v_candidate record;
+    v_job_id uuid;
+BEGIN
+    IF p_mode = 'fifo' THEN
+        SELECT q.id INTO v_job_id
+          FROM public.job_queue q
+         WHERE q.status = 'pending'
+           AND q.run_at <= now()
+         ORDER BY q.priority DESC, q.run_at
+         LIMIT 1
+           FOR UPDATE SKIP LOCKED;
+    ELSE
+        -- One head-of-line candidate per user, best user first
+        FOR v_candidate IN
+            WITH heads AS (
+                SELECT DISTINCT ON (q.user_id) q.id, q.user_id, q.priority, q.run_at
+                  FROM public.job_queue q
+                 WHERE q.status = 'pending'
+                   AND q.run_at <= now()
+                 ORDER BY q.user_id, q.priority DESC, q.run_at
+            ),
+            running AS (
+                SELECT q.user_id, count(*) AS n
+                  FROM public.job_queue q
+                 WHERE q.status = 'processing'
+                 GROUP BY q.user_id
+            ),
+            served AS (
+                SELECT q.user_id, max(q.picked_at) AS last_picked_at
+                  FROM public.job_queue q
+                 WHERE q.picked_at > now() - interval '1 hour'
+                 GROUP BY q.user_id
+            )
+            SELECT h.id, h.user_id
+              FROM heads h
+              LEFT JOIN running r ON r.user_id IS NOT DISTINCT FROM h.user_id
+              LEFT JOIN served sv ON sv.user_id IS NOT DISTINCT FROM h.user_id
+             WHERE p_max_per_user IS NULL OR COALESCE(r.n, 0) < p_max_per_user
+             ORDER BY h.priority DESC, COALESCE(r.n, 0), sv.last_picked_at NULLS FIRST, h.run_at
+             LIMIT 16
+        LOOP
+            -- Serialize picks per user so concurrent workers can't overshoot the cap
+            CONTINUE WHEN NOT pg_try_advisory_xact_lock(
+                hashtext('job_queue_user:' || COALESCE(v_candidate.user_id::text, '')));
+
+            -- The candidate list was counted in the loop query's snapshot, which can
+            -- predate another worker's committed claim; re-count under the lock
+            CONTINUE WHEN p_max_per_user IS NOT NULL AND (
+                SELECT count(*)
+                  FROM public.job_queue q
+                 WHERE q.status = 'processing'
+                   AND q.user_id IS NOT DISTINCT FROM v_candidate.user_id
+            ) >= p_max_per_user;
+
+            SELECT q.id INTO v_job_id
+              FROM public.job_queue q
+             WHERE q.id = v_candidate.id
+               AND q.status = 'pending'
+               FOR UPDATE SKIP LOCKED;
+            EXIT WHEN v_job_id IS NOT NULL;
+        END LOOP;
+    END IF;
+
+    IF v_job_id IS NULL THEN
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    WITH claimed AS (
+        UPDATE public.job_queue j
+           SET status = 'processing',
+               picked_at = now(),
+               started_at = now(),
+               worker_id = p_worker_id,
+               lease_token = gen_random_uuid(),
+               visibility_timeout_at = now() + make_interval(secs => p_lease_seconds),
+               updated_at = now()
+         WHERE j.id = v_job_id
+        RETURNING j.id, j.scan_upload_id, j.job_type, j.payload, j.retry_count::int AS retry_count,
+                  j.lease_token, j.visibility_timeout_at
+    )
+    SELECT * FROM claimed;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.dequeue_job_with_lease(text, int, text, int) TO service_role;
@@ -0,0 +1,29 @@
+-- Cheap queue depth/age sample for the worker metrics endpoint
+--
+-- Only active statuses are counted, so the query stays on the partial
+-- pending/processing indexes instead of scanning the completed-job history.
+
+CREATE OR REPLACE FUNCTION public.queue_stats()
+RETURNS TABLE (
+    status text,
+    jobs bigint,
+    oldest_age_seconds double precision
+)
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+AS $$
+    SELECT q.status,
+           count(*),
+           EXTRACT(EPOCH FROM now() - min(
+               CASE WHEN q.status = 'pending' THEN q.run_at
+                    ELSE COALESCE(q.started_at, q.picked_at, q.created_at)
+               END))::double precision
+      FROM public.job_queue q
+     WHERE q.status IN ('pending', 'processing')
+     GROUP BY q.status;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.queue_stats() TO service_role;
+
+COMMENT ON FUNCTION public.queue_stats() IS 'Pending/processing job counts and oldest age (queue wait for pending) for metrics scrapes';
@@ -0,0 +1,31 @@
+-- Give a leased job back to the queue without consuming a retry
+--
+-- Used by a draining worker (SIGTERM during a rolling deploy) that cannot finish
+-- its in-flight job within the grace period. The job is immediately claimable
+-- again instead of waiting out its lease, and clearing lease_token fences any
+-- late writes from the draining worker.
+
+CREATE OR REPLACE FUNCTION public.release_job_lease(
+    p_job_id uuid,
+    p_lease_token uuid
+) RETURNS boolean
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+    UPDATE public.job_queue j
+       SET status = 'pending',
+           started_at = NULL,
+           picked_at = NULL,
+           worker_id = NULL,
+           visibility_timeout_at = NULL,
+           lease_token = NULL,
+           updated_at = now()
+     WHERE j.id = p_job_id
+       AND j.status = 'processing'
+       AND j.lease_token = p_lease_token;
+    RETURN FOUND;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.release_job_lease(uuid, uuid) TO service_role;
@@ -0,0 +1,13 @@
+-- Content hash of each scan's image, stamped when the scan finishes
+--
+-- The worker hashes the downloaded bytes (SHA-256, hex) and, when a ready scan
+-- of the same user with the same hash exists, clones its detections and
+-- user_cards links instead of re-running detection and embedding. The column is only written on success,
+-- so failed or partial scans are never reused.
+
+ALTER TABLE public.scans
+    ADD COLUMN IF NOT EXISTS content_sha256 text;
+
+CREATE INDEX IF NOT EXISTS idx_scans_content_sha256
+    ON public.scans (user_id, content_sha256, created_at DESC)
+    WHERE content_sha256 IS NOT NULL;
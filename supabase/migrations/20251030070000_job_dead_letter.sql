@@ -0,0 +1,168 @@
+-- Poison-job detection: failure fingerprints and a dead-letter table
+--
+-- Every in-process job failure is recorded in job_failures with a fingerprint of
+-- (exception type, pipeline stage, input hash). record_job_failure() then decides:
+--   * a deterministic failure whose fingerprint has already been seen (for this job
+--     or for another job with the same image bytes) goes straight to job_dead_letter;
+--   * a job out of retries goes to job_dead_letter as well;
+--   * anything else is requeued with exponential backoff via run_at, so transient
+--     network errors get retried instead of failing the scan outright.
+
+CREATE TABLE IF NOT EXISTS public.job_failures (
+    id bigserial PRIMARY KEY,
+    job_id uuid NOT NULL REFERENCES public.job_queue(id) ON DELETE CASCADE,
+    fingerprint text NOT NULL,
+    error_class text,
+    stage text,
+    input_hash text,
+    transient boolean NOT NULL DEFAULT false,
+    error_message text,
+    worker_id text,
+    created_at timestamptz DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_job_failures_fingerprint ON public.job_failures (fingerprint) WHERE NOT transient;
+CREATE INDEX IF NOT EXISTS idx_job_failures_job ON public.job_failures (job_id);
+
+CREATE TABLE IF NOT EXISTS public.job_dead_letter (
+    job_id uuid PRIMARY KEY REFERENCES public.job_queue(id) ON DELETE CASCADE,
+    scan_upload_id uuid,
+    reason text NOT NULL CHECK (reason IN ('poison', 'retries_exhausted')),
+    fingerprint text,
+    error_class text,
+    stage text,
+    input_hash text,
+    error_message text,
+    traceback text,
+    output_log_path text,
+    attempts int,
+    payload jsonb,
+    created_at timestamptz DEFAULT now()
+);
+
+ALTER TABLE public.job_failures ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.job_dead_letter ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "job_failures_service_all"
+  ON public.job_failures FOR ALL
+  USING (auth.role() = 'service_role');
+
+CREATE POLICY "job_dead_letter_service_all"
+  ON public.job_dead_letter FOR ALL
+  USING (auth.role() = 'service_role');
+
+COMMENT ON TABLE public.job_dead_letter IS 'Jobs that will not be retried: repeated identical failures (poison inputs) or exhausted retries';
+
+-- Returns 'retry', 'dead_letter', or 'fenced' (the caller no longer holds the job).
+CREATE OR REPLACE FUNCTION public.record_job_failure(
+    p_job_id uuid,
+    p_lease_token uuid,
+    p_fingerprint text,
+    p_error_class text,
+    p_stage text,
+    p_input_hash text,
+    p_transient boolean,
+    p_error_message text,
+    p_traceback text DEFAULT NULL,
+    p_output_log_path text DEFAULT NULL,
+    p_worker_id text DEFAULT NULL,
+    p_max_retries int DEFAULT 3,
+    p_backoff_seconds int DEFAULT 30
+) RETURNS text
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_job public.job_queue%ROWTYPE;
+    v_retries int;
+    v_seen int := 0;
+    v_reason text;
+BEGIN
+    SELECT * INTO v_job
+      FROM public.job_queue j
+     WHERE j.id = p_job_id
+       AND j.status = 'processing'
+       AND (p_lease_token IS NULL OR j.lease_token = p_lease_token)
+       FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN 'fenced';
+    END IF;
+    v_retries := COALESCE(v_job.retry_count, 0);
+
+    INSERT INTO public.job_failures (job_id, fingerprint, error_class, stage, input_hash, transient, error_message, worker_id)
+    VALUES (p_job_id, p_fingerprint, p_error_class, p_stage, p_input_hash, p_transient, p_error_message, p_worker_id);
+
+    IF NOT p_transient THEN
+        SELECT count(*) INTO v_seen
+          FROM public.job_failures f
+         WHERE f.fingerprint = p_fingerprint
+           AND NOT f.transient;
+    END IF;
+
+    IF v_seen >= 2 THEN
+        v_reason := 'poison';
+    ELSIF v_retries >= p_max_retries THEN
+        v_reason := 'retries_exhausted';
+    END IF;
+
+    IF v_reason IS NULL THEN
+        UPDATE public.job_queue j
+           SET status = 'pending',
+               retry_count = v_retries + 1,
+               run_at = now() + make_interval(secs => least(p_backoff_seconds * power(2, v_retries), 3600)),
+               error_message = p_error_message,
+               started_at = NULL,
+               picked_at = NULL,
+               worker_id = NULL,
+               visibility_timeout_at = NULL,
+               lease_token = NULL,
+               updated_at = now()
+         WHERE j.id = p_job_id;
+
+        UPDATE public.scans s
+           SET status = 'processing',
+               error_message = NULL,
+               updated_at = now()
+         WHERE s.id = v_job.scan_upload_id;
+        RETURN 'retry';
+    END IF;
+
+    UPDATE public.job_queue j
+       SET status = 'failed',
+           completed_at = now(),
+           error_message = p_error_message,
+           started_at = NULL,
+           visibility_timeout_at = NULL,
+           lease_token = NULL,
+           updated_at = now()
+     WHERE j.id = p_job_id;
+
+    INSERT INTO public.job_dead_letter (
+        job_id, scan_upload_id, reason, fingerprint, error_class, stage, input_hash,
+        error_message, traceback, output_log_path, attempts, payload
+    ) VALUES (
+        p_job_id, v_job.scan_upload_id, v_reason, p_fingerprint, p_error_class, p_stage, p_input_hash,
+        p_error_message, p_traceback, p_output_log_path, v_retries + 1, v_job.payload
+    )
+    ON CONFLICT (job_id) DO UPDATE
+       SET reason = EXCLUDED.reason,
+           fingerprint = EXCLUDED.fingerprint,
+           error_class = EXCLUDED.error_class,
+           stage = EXCLUDED.stage,
+           input_hash = EXCLUDED.input_hash,
+           error_message = EXCLUDED.error_message,
+           traceback = EXCLUDED.traceback,
+           output_log_path = EXCLUDED.output_log_path,
+           attempts = EXCLUDED.attempts,
+           created_at = now();
+
+    UPDATE public.scans s
+       SET status = 'error',
+           error_message = p_error_message,
+           updated_at = now()
+     WHERE s.id = v_job.scan_upload_id;
+    RETURN 'dead_letter';
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.record_job_failure(uuid, uuid, text, text, text, text, boolean, text, text, text, text, int, int) TO service_role;
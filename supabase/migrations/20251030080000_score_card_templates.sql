@@ -0,0 +1,32 @@
+-- Exact template-level scores for a handful of cards (confusion-aware rerank)
+--
+-- When the top retrieval candidates are a pair users often confuse, the worker
+-- asks for every template of just those cards instead of a deeper global ANN
+-- search. The card_id filter uses idx_card_templates_unique (leading card_id),
+-- so this is a few dozen exact distance computations.
+
+CREATE OR REPLACE FUNCTION public.score_card_templates(
+  qvec vector(768),
+  ids text[],
+  per_card int DEFAULT 3
+) RETURNS TABLE (
+  card_id text,
+  best_score double precision,
+  mean_score double precision,
+  templates int
+) LANGUAGE sql STABLE PARALLEL SAFE AS $$
+  SELECT s.card_id,
+         max(s.score) AS best_score,
+         avg(s.score) FILTER (WHERE s.rnk <= per_card) AS mean_score,
+         count(*)::int AS templates
+  FROM (
+    SELECT t.card_id,
+           1 - (t.emb <=> qvec) AS score,
+           row_number() OVER (PARTITION BY t.card_id ORDER BY t.emb <=> qvec) AS rnk
+    FROM public.card_templates t
+    WHERE t.card_id = ANY(ids)
+  ) s
+  GROUP BY s.card_id
+$$;
+
+COMMENT ON FUNCTION public.score_card_templates(vector, text[], int) IS 'Best and top-per_card mean template similarity for the given cards';
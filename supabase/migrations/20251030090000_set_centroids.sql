@@ -0,0 +1,52 @@
+-- Hierarchical set -> card retrieval
+--
+-- card_set_centroids holds one L2-normalized mean prototype per set, built by
+-- scripts/build_set_centroids.py. The worker caches the few hundred rows and
+-- scores a query against them locally. It then searches only the templates of
+-- the top sets via match_card_templates_in_sets.
+
+CREATE TABLE IF NOT EXISTS public.card_set_centroids (
+    set_id text PRIMARY KEY,
+    emb vector(768) NOT NULL,
+    card_count int NOT NULL,
+    updated_at timestamptz DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_card_templates_set_id ON public.card_templates (set_id);
+
+-- Exact search over the templates of a few sets. The MATERIALIZED CTE keeps the
+-- planner on the set_id index (cost follows the size of the chosen sets) instead
+-- of walking the global HNSW index and filtering afterwards, which loses recall.
+CREATE OR REPLACE FUNCTION public.match_card_templates_in_sets(
+  qvec vector(768),
+  set_ids text[],
+  match_count int
+) RETURNS TABLE (
+  id uuid,
+  card_id text,
+  set_id text,
+  dist double precision,
+  score double precision
+) LANGUAGE sql STABLE PARALLEL SAFE AS $$
+  WITH candidates AS MATERIALIZED (
+    SELECT t.id, t.card_id, t.set_id, t.emb <=> qvec AS dist
+    FROM public.card_templates t
+    WHERE t.set_id = ANY(set_ids)
+  )
+  SELECT c.id, c.card_id, c.set_id, c.dist, 1 - c.dist AS score
+  FROM candidates c
+  ORDER BY c.dist
+  LIMIT match_count
+$$;
+
+ALTER TABLE public.card_set_centroids ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "card_set_centroids_read_all"
+  ON public.card_set_centroids FOR SELECT
+  USING (true);
+
+CREATE POLICY "card_set_centroids_service_write"
+  ON public.card_set_centroids FOR ALL
+  USING (auth.role() = 'service_role');
+
+COMMENT ON TABLE public.card_set_centroids IS 'Per-set mean of card_prototypes, used to route retrieval to a few sets';
@@ -0,0 +1,38 @@
+-- Template search with a per-call HNSW ef_search (progressive deepening)
+--
+-- The worker starts with a small match_count / ef_search and only repeats the
+-- search deeper when the first result is ambiguous. set_config(..., true) is
+-- SET LOCAL: the setting ends with the RPC's transaction and never leaks into
+-- other sessions on the pooler. ef_search is raised to at least match_count,
+-- because HNSW cannot return more rows than its candidate list holds.
+-- VOLATILE because it changes a setting; PostgREST runs it in its own transaction.
+
+CREATE OR REPLACE FUNCTION public.match_card_templates_ef(
+  qvec vector(768),
+  match_count int,
+  set_hint text DEFAULT NULL,
+  ef_search int DEFAULT 40
+) RETURNS TABLE (
+  id uuid,
+  card_id text,
+  set_id text,
+  dist double precision,
+  score double precision
+) LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+BEGIN
+  PERFORM set_config('hnsw.ef_search', GREATEST(ef_search, match_count)::text, true);
+  RETURN QUERY
+  SELECT t.id,
+         t.card_id,
+         t.set_id,
+         t.emb <=> qvec AS dist,
+         1 - (t.emb <=> qvec) AS score
+  FROM public.card_templates t
+  WHERE (set_hint IS NULL OR t.set_id = set_hint)
+  ORDER BY t.emb <=> qvec
+  LIMIT match_count;
+END;
+$$;
+
+COMMENT ON FUNCTION public.match_card_templates_ef(vector, int, text, int) IS 'match_card_templates with SET LOCAL hnsw.ef_search for adaptive-depth retrieval';
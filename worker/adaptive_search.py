@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Progressive-deepening template search for retrieval v2.
+
+Instead of always asking for ``RETRIEVAL_TOPK`` templates, ``search`` walks a
+schedule of ``(k, ef_search)`` steps (``ADAPTIVE_SEARCH_STEPS``, capped at the
+caller's TopK). It stops at the first step whose rows are decisive: at least
+``ADAPTIVE_MIN_CARDS`` distinct cards, and the best card's template score clears
+the runner-up by ``ADAPTIVE_MIN_MARGIN``. Each step calls
+``match_card_templates_ef``, which sets ``hnsw.ef_search`` with SET LOCAL, so
+shallow steps are cheap for the index as well as the payload.
+
+The margin uses template scores because prototypes are fetched after the
+search; they carry most of the fused score (``FUSION_WEIGHTS`` 0.7/0.3). If a
+deeper step times out, the previous step's rows are used instead of a blind
+retry. Without the migration, ``available()`` turns False and retrieval_v2
+falls back to the fixed-TopK RPC.
+"""
+from __future__ import annotations
+
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    from config import ADAPTIVE_MIN_CARDS, ADAPTIVE_MIN_MARGIN, ADAPTIVE_SEARCH_STEPS
+    import metrics
+    from stage_timing import span
+except ImportError:  # imported as worker.adaptive_search from scripts
+    from worker.config import ADAPTIVE_MIN_CARDS, ADAPTIVE_MIN_MARGIN, ADAPTIVE_SEARCH_STEPS
+    from worker import metrics
+    from worker.stage_timing import span
+
+logger = logging.getLogger(__name__)
+
+RPC_NAME = "match_card_templates_ef"
+_available = True
+
+
+def available() -> bool:
+    return _available
+
+
+def parse_steps(spec: str) -> List[Tuple[int, int]]:
+    """``"16:40,50:100"`` -> ``[(16, 40), (50, 100)]`` (ef defaults to 2*k when omitted)."""
+    steps = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        k, _, ef = part.partition(":")
+        steps.append((int(k), int(ef) if ef else 2 * int(k)))
+    return sorted(steps)
+
+
+STEPS = parse_steps(ADAPTIVE_SEARCH_STEPS)
+
+
+def plan_steps(topk: int, steps: Sequence[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """The schedule capped at ``topk``; the last step always asks for exactly ``topk``."""
+    plan = [(k, ef) for k, ef in steps if k < topk]
+    deeper = [ef for k, ef in steps if k >= topk]
+    plan.append((topk, max(topk, deeper[0] if deeper else (plan[-1][1] if plan else topk))))
+    return plan
+
+
+def is_decisive(rows: Sequence[Dict], min_cards: int = ADAPTIVE_MIN_CARDS, min_margin: float = ADAPTIVE_MIN_MARGIN) -> bool:
+    """Enough distinct cards, and a clear gap between the best two (best template per card)."""
+    best: Dict[str, float] = {}
+    for row in rows:
+        card_id = row.get("card_id")
+        if card_id:
+            score = float(row.get("score", 0.0))
+            if score > best.get(card_id, -1.0):
+                best[card_id] = score
+    if len(best) < min_cards:
+        return False
+    top_two = sorted(best.values(), reverse=True)[:2]
+    return top_two[0] - top_two[1] >= min_margin
+
+
+def _is_timeout(exc: Exception) -> bool:
+    message = str(exc)
+    return "57014" in message or "statement timeout" in message.lower()
+
+
+def _is_missing_function(exc: Exception) -> bool:
+    message = str(exc)
+    return RPC_NAME in message and ("PGRST202" in message or "Could not find" in message or "does not exist" in message)
+
+
+def search(supabase_client, qvec: str, topk: int, set_hint: Optional[str] = None,
+           steps: Sequence[Tuple[int, int]] = ()) -> Optional[List[Dict]]:
+    """
+    Template rows (``match_card_templates`` shape) for the formatted query vector
+    ``qvec``, or None when no step returned.
+    """
+    global _available
+    rows: Optional[List[Dict]] = None
+    plan = plan_steps(topk, steps or STEPS)
+    for depth, (k, ef) in enumerate(plan):
+        payload = {"qvec": qvec, "match_count": int(k), "set_hint": set_hint, "ef_search": int(ef)}
+        try:
+            with span("template_rpc"):
+                response = supabase_client.rpc(RPC_NAME, payload).execute()
+        except Exception as exc:
+            if _is_missing_function(exc):
+                _available = False
+                logger.warning(f"[WARN] {RPC_NAME} not deployed; using the fixed-TopK template search")
+                return None
+            if rows is not None and _is_timeout(exc):
+                # Keep the shallower answer rather than retrying blind
+                logger.warning(f"[WARN] Template search timed out at k={k}, keeping k={plan[depth - 1][0]}")
+                break
+            logger.warning(f"[WARN] RPC {RPC_NAME} failed at k={k}: {exc}")
+            return rows
+        rows = response.data or []
+        metrics.TEMPLATE_SEARCH_STEPS.inc(k=str(k))
+        if depth == len(plan) - 1 or is_decisive(rows):
+            break
+    return rows
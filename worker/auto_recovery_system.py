@@ -12,7 +12,8 @@ from typing import Dict, List, Optional
 from dataclasses import dataclass
 from pathlib import Path
 
-from config import get_supabase_client
+from config import get_supabase_client, MAX_JOB_RETRIES, STALE_JOB_MINUTES, SWEEP_INTERVAL_SECONDS
+from queue_maintenance import SweepUnavailable, sweep_stale_jobs
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -69,10 +70,13 @@ class AutoRecoverySystem:
         self.last_check = datetime.now(timezone.utc)
         
         # Configuration
-        self.STUCK_JOB_TIMEOUT_MINUTES = 10
+        self.STUCK_JOB_TIMEOUT_MINUTES = STALE_JOB_MINUTES
         self.VISIBILITY_TIMEOUT_GRACE_MINUTES = 2
-        self.MAX_AUTO_RETRIES = 3
+        self.MAX_AUTO_RETRIES = MAX_JOB_RETRIES
         self.CHECK_INTERVAL_SECONDS = 30
+        # Takes part in the same sweep election as the workers
+        self.SWEEP_WINDOW_SECONDS = SWEEP_INTERVAL_SECONDS
+        self._server_sweep_available = True
         
     def analyze_stuck_jobs(self) -> List[StuckJobMetrics]:
         """Identify jobs that are stuck and need recovery"""
@@ -237,7 +241,33 @@ class AutoRecoverySystem:
         }
         
         try:
-            # Find stuck jobs
+            if self._server_sweep_available:
+                try:
+                    sweep = sweep_stale_jobs(
+                        self.supabase_client,
+                        max_retries=self.MAX_AUTO_RETRIES,
+                        stale_after_minutes=self.STUCK_JOB_TIMEOUT_MINUTES,
+                        min_interval_seconds=self.SWEEP_WINDOW_SECONDS,
+                    )
+                    results["stuck_jobs_found"] = sweep.requeued + sweep.failed
+                    results["jobs_recovered"] = sweep.requeued
+                    results["jobs_failed"] = sweep.failed
+                    results["swept"] = sweep.swept
+                    if results["stuck_jobs_found"]:
+                        self.recovery_history.append({
+                            "timestamp": results["timestamp"],
+                            "action": "server_sweep",
+                            "requeued_job_ids": sweep.requeued_job_ids,
+                            "failed_job_ids": sweep.failed_job_ids,
+                        })
+                    results["health"] = self.check_worker_health()
+                    results["cycle_duration_ms"] = int((time.time() - cycle_start) * 1000)
+                    return results
+                except SweepUnavailable as e:
+                    logger.warning(f"sweep_stale_jobs RPC not available, using per-job recovery: {e}")
+                    self._server_sweep_available = False
+
+            # Fallback: find stuck jobs and recover them one by one
             stuck_jobs = self.analyze_stuck_jobs()
             results["stuck_jobs_found"] = len(stuck_jobs)
             
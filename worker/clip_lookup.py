@@ -219,8 +219,6 @@ class CLIPCardIdentifier:
             del batch_tensor, image_features  # Explicit cleanup
             if self.device == "cuda":
                 torch.cuda.empty_cache()
-            import gc
-            gc.collect()
             
             return [embeddings[i] for i in range(len(images))]
             
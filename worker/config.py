@@ -121,3 +121,65 @@ USE_CUDA_IF_AVAILABLE = os.getenv("USE_CUDA_IF_AVAILABLE", "1") == "1"
 RETRIEVAL_IMPL = os.getenv("RETRIEVAL_IMPL", "v2").lower()  # Default to v2 (gallery system populated)
 RETRIEVAL_TOPK = int(os.getenv("RETRIEVAL_TOPK", "50"))  # Reduced from 100 to avoid statement timeout on large gallery
 SET_PREFILTER = os.getenv("SET_PREFILTER", "0").lower() in ("1", "true", "yes")
+ADAPTIVE_SEARCH = os.getenv("ADAPTIVE_SEARCH", "1").lower() in ("1", "true", "yes")  # progressive-deepening template search (adaptive_search.py)
+ADAPTIVE_SEARCH_STEPS = os.getenv("ADAPTIVE_SEARCH_STEPS", "16:40,50:100,150:200")  # k:ef_search steps, capped at RETRIEVAL_TOPK
+ADAPTIVE_MIN_CARDS = int(os.getenv("ADAPTIVE_MIN_CARDS", "5"))  # distinct cards a step must return to stop
+ADAPTIVE_MIN_MARGIN = float(os.getenv("ADAPTIVE_MIN_MARGIN", "0.03"))  # best-vs-runner-up template score gap a step must show to stop
+RETRIEVAL_SEARCH = os.getenv("RETRIEVAL_SEARCH", "global").lower()  # "global" or "hierarchical" (set centroids -> cards of the top sets)
+SET_ROUTING_TOP_SETS = int(os.getenv("SET_ROUTING_TOP_SETS", "8"))  # sets whose templates a hierarchical search covers
+SET_ROUTING_MIN_SCORE = float(os.getenv("SET_ROUTING_MIN_SCORE", "0.6"))  # best routed template score below which the search goes global
+SET_CENTROID_REFRESH_SECONDS = float(os.getenv("SET_CENTROID_REFRESH_SECONDS", "3600"))
+CONFUSION_RERANK = os.getenv("CONFUSION_RERANK", "1").lower() in ("1", "true", "yes")  # second look at known card_confusion pairs
+CONFUSION_REFRESH_SECONDS = float(os.getenv("CONFUSION_REFRESH_SECONDS", "300"))  # reload cadence of the in-memory card_confusion map
+CONFUSION_MIN_COUNT = int(os.getenv("CONFUSION_MIN_COUNT", "2"))  # corrections before a pair counts as confusable
+CONFUSION_MARGIN = float(os.getenv("CONFUSION_MARGIN", "0.05"))  # fused-score gap under which a confusable runner-up is contested
+CONFUSION_RERANK_TOPN = int(os.getenv("CONFUSION_RERANK_TOPN", "3"))  # candidates checked against the leader
+CONFUSION_RERANK_PER_CARD = int(os.getenv("CONFUSION_RERANK_PER_CARD", "3"))  # best templates averaged per card in the second look
+
+# ------------------------------
+# Job queue maintenance
+# ------------------------------
+MAX_JOB_RETRIES = int(os.getenv("MAX_JOB_RETRIES", "3"))
+STALE_JOB_MINUTES = int(os.getenv("STALE_JOB_MINUTES", "15"))  # processing longer than this is considered stuck
+SWEEP_INTERVAL_SECONDS = float(os.getenv("SWEEP_INTERVAL_SECONDS", "60"))  # cluster-wide stale-job sweep cadence
+SWEEP_JITTER_SECONDS = float(os.getenv("SWEEP_JITTER_SECONDS", "15"))
+JOB_RETRY_BACKOFF_SECONDS = float(os.getenv("JOB_RETRY_BACKOFF_SECONDS", "30"))  # doubled per retry of a failed job, capped at 1h
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))  # short base lease, renewed while the pipeline runs
+JOB_LEASE_RENEW_SECONDS = float(os.getenv("JOB_LEASE_RENEW_SECONDS", str(JOB_LEASE_SECONDS / 3)))
+QUEUE_SCHEDULING_MODE = os.getenv("QUEUE_SCHEDULING_MODE", "fair").lower()  # "fair" (per-user round-robin) or "fifo"
+MAX_JOBS_PER_USER = int(os.getenv("MAX_JOBS_PER_USER", "0"))  # hard cap on concurrent jobs per user (idles workers), 0 = none
+
+# ------------------------------
+# Scan pipeline
+# ------------------------------
+CROP_WINDOW = int(os.getenv("CROP_WINDOW", "4"))  # crops in flight per identify batch; bounds per-scan peak memory
+SCAN_CONTENT_DEDUPE = os.getenv("SCAN_CONTENT_DEDUPE", "1").lower() in ("1", "true", "yes")  # reuse results for identical image bytes
+DETECT_TILING = os.getenv("DETECT_TILING", "0").lower() in ("1", "true", "yes")  # add an overlapping tile grid to YOLO on high-res photos
+DETECT_TILE_SIDE = int(os.getenv("DETECT_TILE_SIDE", "2048"))  # source px per grid cell; picks the grid from the photo size
+DETECT_TILE_MAX_GRID = int(os.getenv("DETECT_TILE_MAX_GRID", "3"))  # cap per axis; bounds the batch at max_grid^2 + 1 images
+DETECT_TILE_OVERLAP = float(os.getenv("DETECT_TILE_OVERLAP", "0.35"))  # fraction of a cell added to each tile
+DETECT_TILE_INPUT = int(os.getenv("DETECT_TILE_INPUT", "1280"))  # longest side of each tile handed to YOLO, px
+
+CROP_GATE = os.getenv("CROP_GATE", "1").lower() in ("1", "true", "yes")  # geometric/texture checks before the embedder (crop_gate.py)
+GATE_MIN_ASPECT = float(os.getenv("GATE_MIN_ASPECT", "0.45"))  # short/long side; a card is 0.72, a 45-degree card ~1
+GATE_MIN_SIDE_FRAC = float(os.getenv("GATE_MIN_SIDE_FRAC", "0.05"))  # of the page's short side
+GATE_MIN_SIDE_PX = float(os.getenv("GATE_MIN_SIDE_PX", "32"))
+GATE_NESTED_IOS = float(os.getenv("GATE_NESTED_IOS", "0.8"))  # share of a box inside a stronger one that marks it nested
+GATE_DEFER_CONFIDENCE = float(os.getenv("GATE_DEFER_CONFIDENCE", "0.4"))  # detections below this get the texture check
+GATE_MIN_TEXTURE = float(os.getenv("GATE_MIN_TEXTURE", "0.25"))  # crop_gate.texture_score below which they skip identification
+
+CROP_DEDUPE = os.getenv("CROP_DEDUPE", "0").lower() in ("1", "true", "yes")  # share retrieval between near-identical crops of a scan; opt-in until CROP_DEDUPE_COSINE is validated on real binder photos
+CROP_DEDUPE_COSINE = float(os.getenv("CROP_DEDUPE_COSINE", "0.97"))  # embedding similarity at which two crops count as the same card
+
+CROP_BUNDLE = os.getenv("CROP_BUNDLE", "0").lower() in ("1", "true", "yes")  # one <scan_id>/crops.bundle upload instead of one object per crop
+
+SUMMARY_MAX_SIDE = int(os.getenv("SUMMARY_MAX_SIDE", "1024"))  # longest side of the scan summary preview, px
+SUMMARY_JPEG_QUALITY = int(os.getenv("SUMMARY_JPEG_QUALITY", "80"))
+STORAGE_BUCKET = "scans"
+
+# ------------------------------
+# Memory budget (memory_governor.py)
+# ------------------------------
+MEMORY_BUDGET_MB = int(os.getenv("MEMORY_BUDGET_MB", "1536"))  # RSS above which checkpoints run gc + malloc_trim, 0 = never
+MEMORY_RECLAIM_HEADROOM_MB = int(os.getenv("MEMORY_RECLAIM_HEADROOM_MB", "64"))  # growth needed before retrying a reclaim that stayed over budget
+MEMORY_TENSOR_BUDGET_MB = int(os.getenv("MEMORY_TENSOR_BUDGET_MB", "0"))  # CUDA tensor bytes above which the cache is emptied, 0 = never
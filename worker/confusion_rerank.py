@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Confusion-aware reranking for retrieval v2.
+
+``card_confusion`` counts the card pairs users correct (predicted ``card_id_wrong``,
+was ``card_id_correct``). ``ConfusionIndex`` keeps it in memory as a symmetric
+adjacency map, reloaded at most every ``CONFUSION_REFRESH_SECONDS``. After fusion,
+``rerank`` checks whether the leader and a close runner-up form a known pair. Only
+then does it take a second look: an exact score over every template of just those
+cards (``score_card_templates`` RPC, mean of each card's best few templates). That
+score reorders the contested cards. Unambiguous crops pay nothing beyond a dict
+lookup.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from config import (CONFUSION_MARGIN, CONFUSION_MIN_COUNT, CONFUSION_REFRESH_SECONDS, CONFUSION_RERANK_PER_CARD,
+                        CONFUSION_RERANK_TOPN)
+    import metrics
+    from stage_timing import span
+    from table_cache import TableCache
+    from vector_codec import format_vector
+except ImportError:  # imported as worker.confusion_rerank from scripts
+    from worker.config import (CONFUSION_MARGIN, CONFUSION_MIN_COUNT, CONFUSION_REFRESH_SECONDS,
+                               CONFUSION_RERANK_PER_CARD, CONFUSION_RERANK_TOPN)
+    from worker import metrics
+    from worker.stage_timing import span
+    from worker.table_cache import TableCache
+    from worker.vector_codec import format_vector
+
+logger = logging.getLogger(__name__)
+
+class ConfusionIndex(TableCache):
+    """In-memory ``card_confusion`` adjacency: card -> {other card: confusion count}."""
+
+    table = "card_confusion"
+    columns = "card_id_wrong, card_id_correct, confusion_count"
+
+    def __init__(self, refresh_seconds: float = CONFUSION_REFRESH_SECONDS, min_count: int = CONFUSION_MIN_COUNT,
+                 clock=time.monotonic):
+        super().__init__(refresh_seconds, clock)
+        self.min_count = min_count
+        self._pairs: Dict[str, Dict[str, int]] = {}
+
+    def filter(self, query):
+        return query.gte("confusion_count", self.min_count)
+
+    def load_rows(self, rows: Iterable[Dict]) -> None:
+        pairs: Dict[str, Dict[str, int]] = {}
+        for row in rows:
+            a, b = row.get("card_id_wrong"), row.get("card_id_correct")
+            if not a or not b or a == b:
+                continue
+            count = int(row.get("confusion_count") or 0)
+            # Either direction of a correction makes the pair ambiguous
+            pairs.setdefault(a, {})[b] = pairs.get(a, {}).get(b, 0) + count
+            pairs.setdefault(b, {})[a] = pairs.get(b, {}).get(a, 0) + count
+        self._pairs = pairs
+
+    def describe(self) -> str:
+        return f"{sum(len(v) for v in self._pairs.values()) // 2} confusion pairs"
+
+    def count(self, card_a: str, card_b: str) -> int:
+        return self._pairs.get(card_a, {}).get(card_b, 0)
+
+    def __len__(self) -> int:
+        return len(self._pairs)
+
+
+confusion_index = ConfusionIndex()
+
+
+def contested(candidates: Sequence[Dict], index: ConfusionIndex, top_n: int = CONFUSION_RERANK_TOPN,
+              margin: float = CONFUSION_MARGIN) -> List[str]:
+    """Leader plus the runners-up within ``margin`` of it that it is known to be confused with."""
+    if len(candidates) < 2:
+        return []
+    leader = candidates[0]
+    rivals = [
+        c["card_id"] for c in candidates[1:top_n]
+        if leader["fused"] - c["fused"] <= margin and index.count(leader["card_id"], c["card_id"]) > 0
+    ]
+    return [leader["card_id"]] + rivals if rivals else []
+
+
+def rerank(query_vec: np.ndarray, candidates: List[Dict], supabase_client, weights: Tuple[float, float],
+           index: Optional[ConfusionIndex] = None, per_card: int = CONFUSION_RERANK_PER_CARD) -> Tuple[List[Dict], bool]:
+    """
+    ``candidates`` sorted by ``fused`` (best first). Returns ``(candidates, looked)``.
+    When a second look ran, the contested cards are reordered among their own
+    slots by ``second_look``, the same fusion with the template term replaced by
+    their exact top-``per_card`` template mean. Their own ``fused`` values are
+    left untouched.
+    """
+    index = index if index is not None else confusion_index
+    index.refresh(supabase_client)
+    ids = contested(candidates, index)
+    if not ids:
+        return candidates, False
+
+    try:
+        with span("confusion_rerank"):
+            rows = supabase_client.rpc(
+                "score_card_templates", {"qvec": format_vector(query_vec), "ids": ids, "per_card": int(per_card)}
+            ).execute().data or []
+    except Exception as e:
+        logger.warning(f"[WARN] score_card_templates failed, keeping fused order: {e}")
+        return candidates, False
+    exact = {row["card_id"]: float(row["mean_score"]) for row in rows if row.get("mean_score") is not None}
+    if len(exact) < 2:
+        return candidates, False
+
+    w_template, w_proto = weights
+    slots = [i for i, c in enumerate(candidates) if c["card_id"] in exact]
+    contenders = [dict(candidates[i]) for i in slots]
+    for c in contenders:
+        template_score = exact[c["card_id"]]
+        proto_score = c.get("proto_score")
+        c["second_look"] = template_score * w_template + (proto_score if proto_score is not None else template_score) * w_proto
+    contenders.sort(key=lambda c: c["second_look"], reverse=True)
+
+    reranked = list(candidates)
+    for slot, c in zip(slots, contenders):
+        reranked[slot] = c
+    swapped = reranked[0]["card_id"] != candidates[0]["card_id"]
+    metrics.CONFUSION_RERANKS.inc(outcome="swapped" if swapped else "kept")
+    return reranked, True
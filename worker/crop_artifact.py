@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Card crops cut once from the page and turned into everything downstream needs.
+
+``cut_crop`` takes the detected region, encodes the storage JPEG and builds the
+336-px padded embedding input from the same in-memory region, then drops the
+region. Only the two small products are kept while the crop waits for its
+window to be identified, not a full-resolution PIL crop.
+
+JPEG encoding goes through ``simplejpeg`` (a thin libjpeg-turbo binding) when it
+is installed, otherwise through Pillow, whose wheels are also built against
+libjpeg-turbo. ``strict_preprocess`` lives here so crops can be prepared without
+importing torch; ``openclip_embedder`` uses the same function.
+"""
+from __future__ import annotations
+
+import io
+import logging
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+CROP_JPEG_QUALITY = 95
+
+try:
+    import simplejpeg  # optional: libjpeg-turbo without Pillow's encoder overhead
+except ImportError:
+    simplejpeg = None
+
+JPEG_BACKEND = "simplejpeg" if simplejpeg is not None else (
+    "pillow+libjpeg-turbo" if features.check_feature("libjpeg_turbo") else "pillow"
+)
+
+
+def _resize_short_side_keep_ar(img: Image.Image, target_short: int = 336) -> Image.Image:
+    w, h = img.size
+    if w <= 0 or h <= 0:
+        raise ValueError("Invalid image size")
+    if w < h:
+        new_w = target_short
+        new_h = int(round(h * (target_short / w)))
+    else:
+        new_h = target_short
+        new_w = int(round(w * (target_short / h)))
+    return img.resize((new_w, new_h), resample=Image.Resampling.BICUBIC)
+
+
+def _pad_to_square_center(img: Image.Image) -> Image.Image:
+    w, h = img.size
+    side = max(w, h)
+    delta_w = side - w
+    delta_h = side - h
+    padding = (delta_w // 2, delta_h // 2, delta_w - (delta_w // 2), delta_h - (delta_h // 2))
+    return ImageOps.expand(img, padding, fill=0)
+
+
+def strict_preprocess(pil: Image.Image, target_short: int = 336) -> Image.Image:
+    if pil.mode not in ("RGB", "RGBA"):
+        pil = pil.convert("RGB")
+    resized = _resize_short_side_keep_ar(pil, target_short)
+    squared = _pad_to_square_center(resized)
+    if squared.size != (target_short, target_short):
+        squared = squared.resize((target_short, target_short), resample=Image.Resampling.BICUBIC)
+    return squared
+
+
+def encode_jpeg(img: Image.Image, quality: int = CROP_JPEG_QUALITY) -> bytes:
+    """Baseline 4:2:0 JPEG of an RGB image."""
+    if simplejpeg is not None:
+        return simplejpeg.encode_jpeg(np.asarray(img), quality=quality, colorspace="RGB", colorsubsampling="420")
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+@dataclass
+class CropArtifact:
+    """
+    One detected card: ``jpeg`` is uploaded as ``crop_<n>.jpeg``; ``embed_input`` is
+    what the identifier embeds (the strict 336-px square, or the plain RGB crop
+    when it was cut with ``target_short=None`` for the legacy identifier).
+    """
+
+    jpeg: bytes
+    embed_input: Image.Image
+    size: tuple
+    preprocessed: bool
+
+
+def cut_crop(image: Image.Image, box: Sequence[float], target_short: Optional[int] = 336,
+             quality: int = CROP_JPEG_QUALITY) -> CropArtifact:
+    """Crop ``box`` from ``image`` once and derive the storage JPEG and embedding input from it."""
+    region = image.crop(tuple(box))
+    if region.mode != "RGB":
+        region = region.convert("RGB")
+    size = region.size
+    jpeg = encode_jpeg(region, quality)
+    embed_input = strict_preprocess(region, target_short) if target_short else region
+    del region
+    return CropArtifact(jpeg=jpeg, embed_input=embed_input, size=size, preprocessed=bool(target_short))
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Per-scan crop bundles: every crop of a scan in one storage object.
+
+With ``CROP_BUNDLE`` on, the pipeline appends each crop JPEG to a ``CropBundle``
+instead of uploading it, and uploads ``<scan_id>/crops.bundle`` once per scan.
+Detections keep their usual ``crop_url`` (``<scan_id>/crop_<n>.jpeg``) and readers
+go through ``download_crop``, which serves that name from the bundle with HTTP
+range reads and falls back to the per-crop object for scans stored the old way.
+
+Layout::
+
+    b"CRPBNDL1" | index length (uint32, little-endian) | index JSON | crop bytes...
+
+The index maps each crop file name to ``[offset, length]``, offsets counted from
+the start of the object, so a reader needs one small range read for the index and
+one per crop.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import posixpath
+import struct
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+
+try:
+    from config import STORAGE_BUCKET
+except ImportError:  # imported as worker.crop_bundle from scripts
+    from worker.config import STORAGE_BUCKET
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CRPBNDL1"
+_PREFIX = struct.Struct("<8sI")
+BUNDLE_NAME = "crops.bundle"
+INDEX_PROBE_BYTES = 4096  # first read; covers the index of any realistic page of cards
+INDEX_CACHE_SIZE = 256
+
+Index = Dict[str, Tuple[int, int]]
+RangeFetch = Callable[[str, str, int, int], bytes]
+
+
+class BundleFormatError(ValueError):
+    pass
+
+
+def bundle_path_for(scan_id: str) -> str:
+    return f"{scan_id}/{BUNDLE_NAME}"
+
+
+class CropBundle:
+    """Collects one scan's crop JPEGs; ``to_bytes`` lays them out behind the index."""
+
+    def __init__(self, scan_id: str):
+        self.scan_id = scan_id
+        self.path = bundle_path_for(scan_id)
+        self._crops: List[Tuple[str, bytes]] = []
+
+    def __len__(self) -> int:
+        return len(self._crops)
+
+    def add(self, crop_path: str, jpeg: bytes) -> None:
+        folder, name = posixpath.split(crop_path)
+        if folder != str(self.scan_id):
+            raise ValueError(f"Crop {crop_path} does not belong to scan {self.scan_id}")
+        self._crops.append((name, bytes(jpeg)))
+
+    def to_bytes(self) -> bytes:
+        # Offsets depend on the index length, which depends on the offsets' digits:
+        # widen until the layout is stable (at most a couple of passes)
+        header_len = _PREFIX.size
+        while True:
+            offset, entries = header_len, {}
+            for name, data in self._crops:
+                entries[name] = [offset, len(data)]
+                offset += len(data)
+            index = json.dumps({"version": 1, "crops": entries}, separators=(",", ":")).encode("utf-8")
+            if _PREFIX.size + len(index) == header_len:
+                break
+            header_len = _PREFIX.size + len(index)
+        return b"".join([_PREFIX.pack(MAGIC, len(index)), index] + [data for _, data in self._crops])
+
+    def upload(self, client, bucket: str = STORAGE_BUCKET) -> str:
+        client.storage.from_(bucket).upload(
+            path=self.path, file=self.to_bytes(),
+            file_options={"content-type": "application/octet-stream", "upsert": "true"}
+        )
+        return self.path
+
+
+def index_length(head: bytes) -> int:
+    """Length of the JSON index, from the first ``_PREFIX.size`` bytes of a bundle."""
+    if len(head) < _PREFIX.size:
+        raise BundleFormatError("Truncated crop bundle header")
+    magic, length = _PREFIX.unpack_from(head)
+    if magic != MAGIC:
+        raise BundleFormatError("Not a crop bundle")
+    return length
+
+
+def parse_index(head: bytes) -> Index:
+    """Index of a bundle from its first bytes (must cover the whole index)."""
+    length = index_length(head)
+    end = _PREFIX.size + length
+    if len(head) < end:
+        raise BundleFormatError("Truncated crop bundle index")
+    index = json.loads(head[_PREFIX.size:end].decode("utf-8"))
+    return {name: (int(off), int(size)) for name, (off, size) in index["crops"].items()}
+
+
+def read_crop(blob: bytes, name: str) -> bytes:
+    """One crop out of a fully downloaded bundle."""
+    offset, length = parse_index(blob)[name]
+    return blob[offset:offset + length]
+
+
+def http_range_fetch(client) -> RangeFetch:
+    """Range reads against Supabase Storage with the client's own key."""
+    base = str(client.supabase_url).rstrip("/")
+    key = client.supabase_key
+    session = requests.Session()
+    session.headers.update({"apikey": key, "Authorization": f"Bearer {key}"})
+
+    def fetch(bucket: str, path: str, start: int, end: int) -> bytes:
+        response = session.get(
+            f"{base}/storage/v1/object/authenticated/{bucket}/{path}",
+            headers={"Range": f"bytes={start}-{end}"}, timeout=30,
+        )
+        if response.status_code in (400, 404):
+            raise FileNotFoundError(f"{bucket}/{path}")
+        response.raise_for_status()
+        body = response.content
+        # A server that ignores Range answers 200 with the whole object
+        return body[start:end + 1] if response.status_code == 200 else body
+
+    return fetch
+
+
+class BundleReader:
+    """
+    Resolves ``<scan_id>/crop_<n>.jpeg`` paths to bytes. Bundle indexes (and
+    "this scan has no bundle") are cached per scan, so reading every crop of a
+    scan costs one index read plus one range read per crop.
+    """
+
+    def __init__(self, client, bucket: str = STORAGE_BUCKET, range_fetch: Optional[RangeFetch] = None,
+                 cache_size: int = INDEX_CACHE_SIZE):
+        self.client = client
+        self.bucket = bucket
+        self._range_fetch = range_fetch
+        self._cache: "OrderedDict[str, Optional[Index]]" = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def _fetch(self, path: str, start: int, end: int) -> bytes:
+        if self._range_fetch is None:
+            self._range_fetch = http_range_fetch(self.client)
+        return self._range_fetch(self.bucket, path, start, end)
+
+    def index(self, scan_id: str) -> Optional[Index]:
+        """The scan's bundle index, or None when its crops are stored one per object."""
+        with self._lock:
+            if scan_id in self._cache:
+                self._cache.move_to_end(scan_id)
+                return self._cache[scan_id]
+        path = bundle_path_for(scan_id)
+        try:
+            head = self._fetch(path, 0, INDEX_PROBE_BYTES - 1)
+            needed = _PREFIX.size + index_length(head)
+            if len(head) < needed:
+                head += self._fetch(path, len(head), needed - 1)
+            index: Optional[Index] = parse_index(head)
+        except FileNotFoundError:
+            index = None
+        with self._lock:
+            self._cache[scan_id] = index
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return index
+
+    def download(self, crop_path: str) -> bytes:
+        scan_id, name = posixpath.split(crop_path)
+        index = self.index(scan_id) if scan_id else None
+        if index is not None and name in index:
+            offset, length = index[name]
+            return self._fetch(bundle_path_for(scan_id), offset, offset + length - 1)
+        return self.client.storage.from_(self.bucket).download(crop_path)
+
+
+_readers: Dict[Tuple[int, str], BundleReader] = {}
+
+
+def download_crop(client, crop_path: str, bucket: str = STORAGE_BUCKET) -> bytes:
+    """Bytes of the crop stored at ``crop_path``, bundled or not."""
+    reader = _readers.get((id(client), bucket))
+    if reader is None or reader.client is not client:
+        reader = _readers[(id(client), bucket)] = BundleReader(client, bucket)
+    return reader.download(crop_path)
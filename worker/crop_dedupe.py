@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate crop dedupe within a scan.
+
+Binder pages and bulk lots often hold several copies of one common card. Every
+crop is still embedded (in one batched pass per window), but before its template
+and prototype RPCs the embedding is checked against the scan's ``EmbeddingMemo``.
+A crop within ``CROP_DEDUPE_COSINE`` of an earlier crop reuses that crop's
+retrieval and fusion result. Round trips then scale with distinct cards per
+scan, not total cards. The memo lives for one scan, so it spans the crop windows
+without ever matching across scans or users.
+
+The threshold is meant to be tight: two photos of the same print should sit
+above it, and different cards sharing a set's frame and layout below it. A false
+merge silently gives one card another's identification, so dedupe is opt-in
+(``CROP_DEDUPE=1``) until the threshold is validated on real binder photos.
+"""
+from __future__ import annotations
+
+import copy
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    from config import CROP_DEDUPE_COSINE
+    import metrics
+except ImportError:  # imported as worker.crop_dedupe from scripts
+    from worker.config import CROP_DEDUPE_COSINE
+    from worker import metrics
+
+
+class EmbeddingMemo:
+    """Retrieval results of a scan's distinct crops, keyed by their L2-normalized embeddings."""
+
+    def __init__(self, threshold: float = CROP_DEDUPE_COSINE):
+        self.threshold = threshold
+        self._vecs: List[np.ndarray] = []
+        self._results: List[Dict] = []
+        self.hits = 0
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def lookup(self, vec: np.ndarray) -> Optional[Dict]:
+        """A copy of the result of the closest earlier crop at or above the threshold, else None."""
+        if not self._vecs:
+            return None
+        sims = np.vstack(self._vecs) @ np.asarray(vec, dtype=np.float32)
+        best = int(np.argmax(sims))
+        if float(sims[best]) < self.threshold:
+            return None
+        self.hits += 1
+        metrics.CROPS_DEDUPED.inc()
+        result = copy.deepcopy(self._results[best])
+        result["shared_retrieval"] = True
+        return result
+
+    def add(self, vec: np.ndarray, result: Dict) -> None:
+        self._vecs.append(np.asarray(vec, dtype=np.float32))
+        self._results.append(result)
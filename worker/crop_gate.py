@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Cheap gate between YOLO and identification.
+
+Every detection that reaches ``identify_crops`` costs a ViT-L/14 forward pass plus
+the template and prototype RPCs, so obvious non-cards are stopped here first:
+
+* ``screen_boxes`` (page geometry, before any crop is cut) *rejects* slivers,
+  boxes too small to be a card on this page, and boxes nested inside a
+  higher-confidence detection (artwork or text boxes inside a card). Rejected
+  boxes are never cropped, uploaded or stored.
+* ``defer_reason`` (on the small embedding input) *defers* low-confidence crops
+  with almost no texture, such as empty pockets, sleeve glare or the binder
+  ring. A deferred crop is still uploaded and stored as an unidentified
+  detection, so users can correct it, but it skips the embedder and both RPCs.
+"""
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+try:
+    from config import (GATE_DEFER_CONFIDENCE, GATE_MIN_ASPECT, GATE_MIN_SIDE_FRAC, GATE_MIN_SIDE_PX,
+                        GATE_MIN_TEXTURE, GATE_NESTED_IOS)
+except ImportError:  # imported as worker.crop_gate from scripts
+    from worker.config import (GATE_DEFER_CONFIDENCE, GATE_MIN_ASPECT, GATE_MIN_SIDE_FRAC, GATE_MIN_SIDE_PX,
+                               GATE_MIN_TEXTURE, GATE_NESTED_IOS)
+
+TEXTURE_SIDE = 32
+# Reference contrast / edge energy of a card at TEXTURE_SIDE (0-255 luminance);
+# printed cards sit well above both, an empty pocket well below
+STD_REF = 40.0
+EDGE_REF = 12.0
+
+
+def _geometry_reason(box: Sequence[float], page_short: float, min_aspect: float, min_side_frac: float,
+                     min_side_px: float) -> Optional[str]:
+    w, h = box[2] - box[0], box[3] - box[1]
+    short, long = min(w, h), max(w, h)
+    if short < max(min_side_px, min_side_frac * page_short):
+        return "too_small"
+    if short / max(long, 1e-9) < min_aspect:
+        return "aspect"
+    return None
+
+
+def screen_boxes(detections: List[Dict], page_size: Tuple[int, int], min_aspect: float = GATE_MIN_ASPECT,
+                 min_side_frac: float = GATE_MIN_SIDE_FRAC, min_side_px: float = GATE_MIN_SIDE_PX,
+                 nested_ios: float = GATE_NESTED_IOS) -> Tuple[List[Dict], List[Tuple[Dict, str]]]:
+    """
+    Split detections (``{'box': [x1, y1, x2, y2], 'confidence': ...}`` in page
+    pixels) into ``(kept, [(detection, reason), ...])``. Kept detections come
+    back in descending confidence order.
+    """
+    page_short = min(page_size)
+    kept: List[Dict] = []
+    rejected: List[Tuple[Dict, str]] = []
+    for det in sorted(detections, key=lambda d: d['confidence'], reverse=True):
+        reason = _geometry_reason(det['box'], page_short, min_aspect, min_side_frac, min_side_px)
+        if reason is None:
+            x1, y1, x2, y2 = det['box']
+            area = max((x2 - x1) * (y2 - y1), 1e-9)
+            for other in kept:
+                ox1, oy1, ox2, oy2 = other['box']
+                inter = max(0.0, min(x2, ox2) - max(x1, ox1)) * max(0.0, min(y2, oy2) - max(y1, oy1))
+                if inter / area >= nested_ios:
+                    reason = "nested"
+                    break
+        if reason is None:
+            kept.append(det)
+        else:
+            rejected.append((det, reason))
+    return kept, rejected
+
+
+def texture_score(crop: Image.Image) -> float:
+    """0..1: how much contrast and edge structure the crop has (a card scores ~1)."""
+    small = np.asarray(crop.convert("L").resize((TEXTURE_SIDE, TEXTURE_SIDE), Image.Resampling.BILINEAR),
+                       dtype=np.float32)
+    edges = (np.abs(np.diff(small, axis=0)).mean() + np.abs(np.diff(small, axis=1)).mean()) / 2.0
+    return 0.5 * min(float(small.std()) / STD_REF, 1.0) + 0.5 * min(float(edges) / EDGE_REF, 1.0)
+
+
+def _content_region(crop: Image.Image, content_size: Tuple[int, int]) -> Image.Image:
+    """The card pixels of a centre-padded square (``strict_preprocess`` output) cut from ``content_size``."""
+    side = crop.size[0]
+    scale = side / max(content_size)
+    cw, ch = content_size[0] * scale, content_size[1] * scale
+    left, top = int((side - cw) / 2), int((side - ch) / 2)
+    return crop.crop((left, top, max(left + 1, int(left + cw)), max(top + 1, int(top + ch))))
+
+
+def defer_reason(crop: Image.Image, detection_confidence: float, content_size: Optional[Tuple[int, int]] = None,
+                 defer_confidence: float = GATE_DEFER_CONFIDENCE, min_texture: float = GATE_MIN_TEXTURE) -> Optional[str]:
+    """
+    ``"no_texture"`` when a low-confidence crop looks blank, else None (identify it).
+    Pass ``content_size`` (the pre-padding crop size) for padded square inputs so
+    the padding edge does not count as texture.
+    """
+    if detection_confidence >= defer_confidence:
+        return None
+    if content_size is not None:
+        crop = _content_region(crop, content_size)
+    if texture_score(crop) < min_texture:
+        return "no_texture"
+    return None
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Fair-share scheduling policy for the job queue.
+
+The authoritative implementation is ``dequeue_job_with_lease`` in
+supabase/migrations/20251030030000_fair_share_dequeue.sql. This module is the
+same policy in Python so it can be load-tested offline (see
+scripts/simulate_queue_fairness.py and __tests__/worker/test_fair_scheduler.py):
+
+* higher ``priority`` always wins (bulk uploads are enqueued at -1);
+* ``fair``: within a priority class, the user with the fewest running jobs goes
+  first, then the user served least recently, then the oldest job;
+* ``fifo``: priority, then enqueue time (the old behaviour);
+* users already at ``max_per_user`` running jobs are skipped.
+"""
+from __future__ import annotations
+
+import heapq
+import math
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence
+
+
+@dataclass
+class QueuedJob:
+    job_id: str
+    user_id: str
+    enqueued_at: float
+    service_seconds: float
+    priority: int = 0
+
+
+def select_next_job(
+    pending: Sequence[QueuedJob],
+    running_by_user: Dict[str, int],
+    last_served_at: Dict[str, float],
+    mode: str = "fair",
+    max_per_user: Optional[int] = None,
+) -> Optional[QueuedJob]:
+    """Pick the job ``dequeue_job_with_lease`` would hand out next."""
+    if not pending:
+        return None
+    if mode == "fifo":
+        return min(pending, key=lambda j: (-j.priority, j.enqueued_at))
+
+    heads: Dict[str, QueuedJob] = {}
+    for job in pending:
+        head = heads.get(job.user_id)
+        if head is None or (-job.priority, job.enqueued_at) < (-head.priority, head.enqueued_at):
+            heads[job.user_id] = job
+
+    eligible = [
+        job for user, job in heads.items()
+        if not max_per_user or running_by_user.get(user, 0) < max_per_user
+    ]
+    if not eligible:
+        return None
+    return min(
+        eligible,
+        key=lambda j: (
+            -j.priority,
+            running_by_user.get(j.user_id, 0),
+            last_served_at.get(j.user_id, -math.inf),
+            j.enqueued_at,
+        ),
+    )
+
+
+def simulate(
+    jobs: Iterable[QueuedJob],
+    workers: int,
+    mode: str = "fair",
+    max_per_user: Optional[int] = None,
+) -> Dict[str, float]:
+    """
+    Discrete-event simulation of ``workers`` identical workers draining ``jobs``.
+    Returns time-to-result (finish - enqueue) per job id.
+    """
+    arrivals = sorted(jobs, key=lambda j: j.enqueued_at)
+    pending: List[QueuedJob] = []
+    running: List[tuple] = []  # heap of (finish_time, user_id)
+    running_by_user: Dict[str, int] = {}
+    last_served_at: Dict[str, float] = {}
+    latencies: Dict[str, float] = {}
+    now = 0.0
+    next_arrival = 0
+
+    while next_arrival < len(arrivals) or pending or running:
+        # Admit arrivals and retire finished jobs up to `now`
+        while next_arrival < len(arrivals) and arrivals[next_arrival].enqueued_at <= now:
+            pending.append(arrivals[next_arrival])
+            next_arrival += 1
+        while running and running[0][0] <= now:
+            _, user = heapq.heappop(running)
+            running_by_user[user] -= 1
+
+        started = False
+        while len(running) < workers:
+            job = select_next_job(pending, running_by_user, last_served_at, mode, max_per_user)
+            if job is None:
+                break
+            pending.remove(job)
+            finish = now + job.service_seconds
+            heapq.heappush(running, (finish, job.user_id))
+            running_by_user[job.user_id] = running_by_user.get(job.user_id, 0) + 1
+            last_served_at[job.user_id] = now
+            latencies[job.job_id] = finish - job.enqueued_at
+            started = True
+
+        if started:
+            continue
+        upcoming = [running[0][0]] if running else []
+        if next_arrival < len(arrivals):
+            upcoming.append(arrivals[next_arrival].enqueued_at)
+        if not upcoming:
+            break  # nothing runnable and nothing coming (every user capped with no running work)
+        now = max(now, min(upcoming))
+
+    return latencies
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile (q in 0..100)."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def bulk_flood_workload(
+    bulk_pages: int = 200,
+    small_users: int = 20,
+    window_seconds: float = 600.0,
+    service_seconds: float = 20.0,
+    bulk_priority: int = 0,
+) -> List[QueuedJob]:
+    """One user uploads ``bulk_pages`` at t=0; ``small_users`` each scan one page during the flood."""
+    jobs = [
+        QueuedJob(f"bulk-{i}", "bulk-user", 0.0, service_seconds, bulk_priority)
+        for i in range(bulk_pages)
+    ]
+    for i in range(small_users):
+        arrival = window_seconds * (i + 0.5) / small_users
+        jobs.append(QueuedJob(f"small-{i}", f"user-{i}", arrival, service_seconds))
+    return jobs
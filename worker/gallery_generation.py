@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Gallery generation helpers for resumable, model-version-aware rebuilds.
+
+A rebuild writes every template into the shadow tables (see migration
+20251030000000_gallery_generations.sql) tagged with a generation string such as
+``ViT-L-14-336/openai/strict336-pad-v1``. Progress is checkpointed to a JSON
+manifest after every successful upsert, so a crashed rebuild restarts where it
+stopped. When the shadow is complete, ``promote_shadow`` swaps it in atomically.
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Sequence, Set
+
+LIVE_TEMPLATES_TABLE = "card_templates"
+LIVE_PROTOTYPES_TABLE = "card_prototypes"
+SHADOW_TEMPLATES_TABLE = "card_templates_shadow"
+SHADOW_PROTOTYPES_TABLE = "card_prototypes_shadow"
+
+DEFAULT_MANIFEST_DIR = Path(__file__).resolve().parent.parent / "logs" / "gallery_manifests"
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def manifest_path_for(generation: str, manifest_dir: Path = DEFAULT_MANIFEST_DIR) -> Path:
+    """Default manifest location for a generation (filesystem-safe name)."""
+    safe = re.sub(r"[^A-Za-z0-9._-]+", "_", generation).strip("_")
+    return manifest_dir / f"{safe}.manifest.json"
+
+
+class GalleryManifest:
+    """
+    On-disk checkpoint of a gallery rebuild.
+
+    Only cards whose templates have been upserted are marked complete, so after a
+    crash the worst case is re-embedding the cards of one unflushed batch.
+    """
+
+    def __init__(self, path: Path, generation: str, meta: Optional[Dict] = None):
+        self.path = Path(path)
+        self.generation = generation
+        self.meta: Dict = dict(meta or {})
+        self.completed: Set[str] = set()
+        self.failed: Dict[str, str] = {}
+        self.status = "building"
+        self.started_at = _now_iso()
+        self.updated_at = self.started_at
+
+    @classmethod
+    def load_or_create(cls, path: Path, generation: str, meta: Optional[Dict] = None) -> "GalleryManifest":
+        """Load an existing manifest for ``generation`` or start a new one."""
+        manifest = cls(path, generation, meta)
+        if not manifest.path.exists():
+            return manifest
+        with manifest.path.open("r", encoding="utf-8") as handle:
+            data = json.load(handle)
+        if data.get("generation") != generation:
+            raise ValueError(
+                f"Manifest {manifest.path} belongs to generation {data.get('generation')!r}, "
+                f"not {generation!r}. Pass a different --manifest or delete it."
+            )
+        manifest.meta.update(data.get("meta") or {})
+        manifest.completed = set(data.get("completed_cards") or [])
+        manifest.failed = dict(data.get("failed_cards") or {})
+        manifest.status = data.get("status", "building")
+        manifest.started_at = data.get("started_at", manifest.started_at)
+        manifest.updated_at = data.get("updated_at", manifest.updated_at)
+        return manifest
+
+    def is_done(self, card_id: str) -> bool:
+        return card_id in self.completed
+
+    def mark_completed(self, card_ids: Iterable[str]) -> None:
+        for card_id in card_ids:
+            self.completed.add(card_id)
+            self.failed.pop(card_id, None)
+
+    def mark_failed(self, card_id: str, reason: str) -> None:
+        self.failed[card_id] = reason[:500]
+
+    def to_dict(self) -> Dict:
+        return {
+            "generation": self.generation,
+            "status": self.status,
+            "meta": self.meta,
+            "started_at": self.started_at,
+            "updated_at": self.updated_at,
+            "completed_count": len(self.completed),
+            "failed_count": len(self.failed),
+            "completed_cards": sorted(self.completed),
+            "failed_cards": self.failed,
+        }
+
+    def save(self) -> None:
+        """Write the manifest atomically (temp file + rename) so a crash never corrupts it."""
+        self.updated_at = _now_iso()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".manifest-", dir=str(self.path.parent))
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as handle:
+                json.dump(self.to_dict(), handle, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+
+# ---------------- Database helpers ----------------
+
+def prepare_shadow(supabase_client, generation: str, model_name: str, pretrained: Optional[str], preprocess_version: str) -> Dict:
+    """Create or reuse the shadow tables for ``generation``. Returns existing row counts."""
+    response = supabase_client.rpc(
+        "prepare_gallery_shadow",
+        {
+            "p_generation": generation,
+            "p_model_name": model_name,
+            "p_pretrained": pretrained,
+            "p_preprocess_version": preprocess_version,
+        },
+    ).execute()
+    rows = response.data or []
+    return rows[0] if rows else {"generation": generation, "existing_templates": 0, "existing_cards": 0}
+
+
+def fetch_shadow_card_ids(
+    supabase_client,
+    generation: str,
+    min_templates: int = 1,
+    page_size: int = 1000,
+) -> Set[str]:
+    """
+    Card ids that already have at least ``min_templates`` templates in the shadow generation.
+
+    Templates are upserted in micro-batches, so a crash can leave a card with only some
+    of its templates; requiring the full count makes those cards re-embed on resume.
+    """
+    card_ids: Set[str] = set()
+    start = 0
+    while True:
+        response = (
+            supabase_client.rpc("gallery_shadow_card_ids", {"p_generation": generation})
+            .order("card_id")
+            .range(start, start + page_size - 1)
+            .execute()
+        )
+        rows = response.data or []
+        card_ids.update(
+            row["card_id"]
+            for row in rows
+            if row.get("card_id") and int(row.get("template_count") or 0) >= min_templates
+        )
+        if len(rows) < page_size:
+            break
+        start += page_size
+    return card_ids
+
+
+def carry_over_templates(supabase_client, generation: str, sources: Sequence[str]) -> int:
+    """Copy live templates of the given sources into the shadow generation. Returns rows copied."""
+    if not sources:
+        return 0
+    response = supabase_client.rpc(
+        "carry_over_gallery_templates",
+        {"p_generation": generation, "p_sources": list(sources)},
+    ).execute()
+    return int(response.data or 0)
+
+
+def promote_shadow(supabase_client, generation: str) -> Dict:
+    """Atomically swap the shadow generation in as the live gallery."""
+    response = supabase_client.rpc("promote_gallery_shadow", {"p_generation": generation}).execute()
+    rows = response.data or []
+    return rows[0] if rows else {"generation": generation}
+
+
+def discard_shadow(supabase_client) -> None:
+    """Drop the shadow tables of an abandoned rebuild."""
+    supabase_client.rpc("discard_gallery_shadow", {}).execute()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Failure fingerprinting and dead-lettering for scan jobs.
+
+A failed job is fingerprinted by exception type, the pipeline stage it failed in
+(the innermost ``stage_timing`` span) and a hash of its input (the image bytes
+once downloaded, otherwise the storage path). ``record_job_failure`` hands that
+to the ``record_job_failure`` RPC (migration 20251030070000_job_dead_letter.sql):
+
+* a deterministic failure seen twice, for this job or for any job with the same
+  image, goes straight to ``job_dead_letter`` instead of burning more retries;
+* transient errors (connection resets, timeouts, 5xx) are requeued with
+  exponential backoff until ``MAX_JOB_RETRIES`` is used up.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from config import JOB_RETRY_BACKOFF_SECONDS, MAX_JOB_RETRIES
+
+logger = logging.getLogger(__name__)
+
+FAILURE_RPC = "record_job_failure"
+
+# Exception class names (anywhere in the MRO) from httpx/httpcore/requests/urllib3
+# that mean the network or the server hiccuped, not that the input is bad
+_TRANSIENT_TYPE_NAMES = {
+    "TransportError", "TimeoutException", "ConnectError", "ConnectTimeout", "ReadTimeout",
+    "WriteTimeout", "PoolTimeout", "ReadError", "WriteError", "RemoteProtocolError",
+    "ProtocolError", "NewConnectionError", "MaxRetryError", "ChunkedEncodingError",
+}
+_TRANSIENT_MARKERS = (
+    "10054", "connection reset", "connection aborted", "connection refused", "timed out",
+    "temporarily unavailable", "too many connections", "remaining connection slots",
+    "502 bad gateway", "503 service unavailable", "504 gateway timeout",
+)
+
+
+@dataclass
+class JobFailure:
+    fingerprint: str
+    error_class: str
+    stage: str
+    input_hash: str
+    transient: bool
+    message: str
+
+
+def is_transient(error: BaseException) -> bool:
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if any(cls.__name__ in _TRANSIENT_TYPE_NAMES for cls in type(error).__mro__):
+        return True
+    text = str(error).lower()
+    return any(marker in text for marker in _TRANSIENT_MARKERS)
+
+
+def classify_failure(error: BaseException, stage: Optional[str], input_hash: Optional[str]) -> JobFailure:
+    error_class = f"{type(error).__module__}.{type(error).__qualname__}"
+    stage = stage or "pipeline"
+    input_hash = input_hash or "unknown"
+    digest = hashlib.sha256(f"{error_class}|{stage}|{input_hash}".encode("utf-8")).hexdigest()[:32]
+    return JobFailure(
+        fingerprint=digest,
+        error_class=error_class,
+        stage=stage,
+        input_hash=input_hash,
+        transient=is_transient(error),
+        message=str(error)[:2000],
+    )
+
+
+def input_hash_for(job: dict) -> Optional[str]:
+    """Image content hash if the pipeline got that far, else a hash of the storage path."""
+    if job.get("content_sha256"):
+        return job["content_sha256"]
+    storage_path = (job.get("payload") or {}).get("storage_path")
+    if storage_path:
+        return "path:" + hashlib.sha256(storage_path.encode("utf-8")).hexdigest()
+    return None
+
+
+def record_job_failure(
+    supabase_client,
+    job_id: str,
+    lease_token: Optional[str],
+    failure: JobFailure,
+    traceback_text: Optional[str] = None,
+    output_log_path: Optional[str] = None,
+    worker_id: Optional[str] = None,
+    max_retries: int = MAX_JOB_RETRIES,
+    backoff_seconds: float = JOB_RETRY_BACKOFF_SECONDS,
+) -> Optional[str]:
+    """
+    Returns 'retry', 'dead_letter' or 'fenced'. Returns None if the RPC is not
+    deployed or the call failed; the caller then marks the job failed the old way.
+    """
+    params = {
+        "p_job_id": job_id,
+        "p_lease_token": lease_token,
+        "p_fingerprint": failure.fingerprint,
+        "p_error_class": failure.error_class,
+        "p_stage": failure.stage,
+        "p_input_hash": failure.input_hash,
+        "p_transient": failure.transient,
+        "p_error_message": failure.message,
+        "p_traceback": traceback_text,
+        "p_output_log_path": output_log_path,
+        "p_worker_id": worker_id,
+        "p_max_retries": int(max_retries),
+        "p_backoff_seconds": int(backoff_seconds),
+    }
+    try:
+        response = supabase_client.rpc(FAILURE_RPC, params).execute()
+    except Exception as e:
+        logger.warning(f"[WARN] {FAILURE_RPC} unavailable, falling back to plain failure: {e}")
+        return None
+    return response.data if isinstance(response.data, str) else None
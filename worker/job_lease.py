@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Renewable job leases (migration 20251030020000_job_leases.sql).
+
+``dequeue_job_with_lease`` hands out a short lease and a lease token. While the
+pipeline runs, a ``JobLease`` heartbeat thread keeps extending it, so a slow scan
+is never requeued underneath the worker that is still processing it. If a renewal
+is rejected (the job was swept and picked up by someone else) the lease is marked
+lost; the pipeline checks ``ensure_held()`` between stages and stops writing, and
+``complete_job_lease`` refuses the superseded worker's final status write.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Dict, Optional
+
+from config import JOB_LEASE_RENEW_SECONDS, JOB_LEASE_SECONDS, MAX_JOBS_PER_USER, QUEUE_SCHEDULING_MODE
+
+logger = logging.getLogger(__name__)
+
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+class LeaseLost(RuntimeError):
+    """This worker no longer owns the job; another worker may be processing it."""
+
+
+def dequeue_job_with_lease(
+    supabase_client,
+    worker_id: str = WORKER_ID,
+    lease_seconds: int = JOB_LEASE_SECONDS,
+    mode: str = QUEUE_SCHEDULING_MODE,
+    max_per_user: int = MAX_JOBS_PER_USER,
+) -> Optional[Dict]:
+    """
+    Atomically claim the next pending job. Returns None when the queue is empty
+    (or every user with pending work is at ``max_per_user``).
+
+    ``mode="fair"`` round-robins between users within a priority class; see
+    fair_scheduler.py for the same policy in Python.
+    """
+    response = supabase_client.rpc(
+        "dequeue_job_with_lease",
+        {
+            "p_worker_id": worker_id,
+            "p_lease_seconds": int(lease_seconds),
+            "p_mode": mode,
+            "p_max_per_user": int(max_per_user) if max_per_user and max_per_user > 0 else None,
+        },
+    ).execute()
+    rows = response.data or []
+    return rows[0] if rows else None
+
+
+def renew_job_lease(supabase_client, job_id: str, lease_token: str, lease_seconds: int = JOB_LEASE_SECONDS) -> bool:
+    """Extend the lease. False means the lease is gone (not a transient error)."""
+    response = supabase_client.rpc(
+        "renew_job_lease",
+        {"p_job_id": job_id, "p_lease_token": lease_token, "p_lease_seconds": int(lease_seconds)},
+    ).execute()
+    return bool(response.data)
+
+
+def complete_job_lease(supabase_client, job_id: str, lease_token: str, status: str, error_message: Optional[str] = None) -> bool:
+    """Finish the job if this worker still holds the lease. Returns False when fenced off."""
+    response = supabase_client.rpc(
+        "complete_job_lease",
+        {
+            "p_job_id": job_id,
+            "p_lease_token": lease_token,
+            "p_status": status,
+            "p_error_message": error_message,
+        },
+    ).execute()
+    return bool(response.data)
+
+
+def release_job_lease(supabase_client, job_id: str, lease_token: str) -> bool:
+    """Put the job back to pending without consuming a retry. False if the lease was already gone."""
+    response = supabase_client.rpc(
+        "release_job_lease",
+        {"p_job_id": job_id, "p_lease_token": lease_token},
+    ).execute()
+    return bool(response.data)
+
+
+class JobLease:
+    """
+    Background lease renewal for one job.
+
+    Renews every ``renew_interval`` seconds. A rejected renewal marks the lease lost
+    immediately; transient errors are retried until the last confirmed expiry has
+    passed, after which the lease is treated as lost too (someone else may own it).
+    """
+
+    def __init__(
+        self,
+        supabase_client,
+        job_id: str,
+        lease_token: str,
+        lease_seconds: int = JOB_LEASE_SECONDS,
+        renew_interval: float = JOB_LEASE_RENEW_SECONDS,
+        clock=time.monotonic,
+    ):
+        self.supabase_client = supabase_client
+        self.job_id = job_id
+        self.lease_token = lease_token
+        self.lease_seconds = int(lease_seconds)
+        self.renew_interval = max(0.05, min(float(renew_interval), self.lease_seconds / 2))
+        self.renewals = 0
+        self.released = False
+        self._clock = clock
+        self._expires_at = self._clock() + self.lease_seconds
+        self._lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def lost(self) -> bool:
+        return self._lost.is_set()
+
+    def ensure_held(self) -> None:
+        """Raise LeaseLost if the lease has been lost; call before side-effecting writes."""
+        if self._lost.is_set():
+            raise LeaseLost(f"Lease on job {self.job_id} was lost; aborting to avoid duplicate writes")
+
+    def renew_once(self) -> bool:
+        try:
+            started = self._clock()
+            if not renew_job_lease(self.supabase_client, self.job_id, self.lease_token, self.lease_seconds):
+                logger.warning(f"[LEASE] Renewal rejected for job {self.job_id}; lease lost")
+                self._lost.set()
+                return False
+            self._expires_at = started + self.lease_seconds
+            self.renewals += 1
+            return True
+        except Exception as e:
+            if self._clock() >= self._expires_at:
+                logger.warning(f"[LEASE] Could not renew job {self.job_id} before expiry: {e}")
+                self._lost.set()
+            else:
+                logger.debug(f"[LEASE] Transient renewal error for job {self.job_id}: {e}")
+            return False
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.renew_interval):
+            if not self.renew_once():
+                if self._lost.is_set():
+                    return
+
+    def start(self) -> "JobLease":
+        self._thread = threading.Thread(target=self._run, name=f"lease-{self.job_id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.renew_interval + 5)
+            self._thread = None
+
+    def release(self) -> bool:
+        """
+        Hand the job back to the queue (graceful shutdown). Renewal stops and the
+        lease is marked lost, so the pipeline aborts at its next ``ensure_held()``.
+        Safe to call from another thread.
+        """
+        self._stop.set()
+        self._lost.set()
+        try:
+            self.released = release_job_lease(self.supabase_client, self.job_id, self.lease_token)
+        except Exception as e:
+            logger.warning(f"[LEASE] Could not release job {self.job_id}: {e}")
+            self.released = False
+        return self.released
+
+    def __enter__(self) -> "JobLease":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Memory budget for the scan worker, replacing unconditional ``gc.collect()`` calls.
+
+The pipeline calls ``checkpoint(stage)`` at stage boundaries (after each crop
+window, after each job). A checkpoint samples RSS and, on CUDA, allocated tensor
+bytes; only when a sample is over budget does it run a full ``gc.collect()``,
+``malloc_trim(0)`` (glibc hands freed arena pages back to the OS, which CPython
+and PyTorch's CPU allocator never do on their own) and ``torch.cuda.empty_cache()``.
+What each reclaim freed is logged and counted in ``metrics``.
+
+Memory that is actually in use can't be reclaimed, so after a reclaim that leaves
+RSS over budget the next one waits until RSS grows by ``MEMORY_RECLAIM_HEADROOM_MB``
+instead of collecting at every checkpoint.
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import gc
+import logging
+import sys
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+
+from config import MEMORY_BUDGET_MB, MEMORY_RECLAIM_HEADROOM_MB, MEMORY_TENSOR_BUDGET_MB
+import metrics
+import stage_timing
+
+logger = logging.getLogger(__name__)
+
+MB = 2**20
+
+
+def tensor_allocated_bytes() -> Optional[int]:
+    """Bytes held by live CUDA tensors, or None on CPU (or if torch isn't loaded)."""
+    torch = sys.modules.get("torch")
+    try:
+        if torch is not None and torch.cuda.is_available():
+            return int(torch.cuda.memory_allocated())
+    except Exception:
+        pass
+    return None
+
+
+_libc_malloc_trim = None
+
+
+def malloc_trim() -> bool:
+    """Return free heap pages to the OS (glibc only). False where unsupported."""
+    global _libc_malloc_trim
+    if _libc_malloc_trim is None:
+        try:
+            _libc_malloc_trim = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6").malloc_trim
+        except (OSError, AttributeError):
+            _libc_malloc_trim = False
+    if not _libc_malloc_trim:
+        return False
+    return bool(_libc_malloc_trim(0))
+
+
+def _empty_cuda_cache() -> None:
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+@dataclass
+class Reclaim:
+    """What one over-budget checkpoint did and freed."""
+
+    stage: str
+    rss_before: int
+    rss_after: int
+    tensor_before: Optional[int]
+    tensor_after: Optional[int]
+    gc_objects: int
+    trimmed: bool
+    elapsed_ms: float
+
+    @property
+    def rss_reclaimed(self) -> int:
+        return max(self.rss_before - self.rss_after, 0)
+
+    @property
+    def tensor_reclaimed(self) -> int:
+        if self.tensor_before is None or self.tensor_after is None:
+            return 0
+        return max(self.tensor_before - self.tensor_after, 0)
+
+
+class MemoryGovernor:
+    def __init__(
+        self,
+        budget_bytes: int,
+        headroom_bytes: int = 64 * MB,
+        tensor_budget_bytes: int = 0,
+        sample_rss: Callable[[], Optional[int]] = stage_timing.resident_memory_bytes,
+        sample_tensors: Callable[[], Optional[int]] = tensor_allocated_bytes,
+        collect: Callable[[], int] = gc.collect,
+        trim: Callable[[], bool] = malloc_trim,
+        empty_cache: Callable[[], None] = _empty_cuda_cache,
+    ):
+        self.budget_bytes = budget_bytes
+        self.headroom_bytes = headroom_bytes
+        self.tensor_budget_bytes = tensor_budget_bytes
+        self._sample_rss = sample_rss
+        self._sample_tensors = sample_tensors
+        self._collect = collect
+        self._trim = trim
+        self._empty_cache = empty_cache
+        # RSS a reclaim couldn't get below budget; don't try again until we grow past it
+        self._rss_floor = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget_bytes > 0 or self.tensor_budget_bytes > 0
+
+    def sample(self) -> Tuple[Optional[int], Optional[int]]:
+        return self._sample_rss(), self._sample_tensors()
+
+    def _over_budget(self, rss: Optional[int], tensors: Optional[int]) -> Tuple[bool, bool]:
+        rss_over = (
+            self.budget_bytes > 0 and rss is not None
+            and rss > self.budget_bytes and rss >= self._rss_floor + self.headroom_bytes
+        )
+        tensors_over = self.tensor_budget_bytes > 0 and tensors is not None and tensors > self.tensor_budget_bytes
+        return rss_over, tensors_over
+
+    def checkpoint(self, stage: str) -> Optional[Reclaim]:
+        """Sample memory after ``stage``; reclaim only if over budget. Returns what was done, if anything."""
+        if not self.enabled:
+            return None
+        rss, tensors = self.sample()
+        rss_over, tensors_over = self._over_budget(rss, tensors)
+        if not (rss_over or tensors_over):
+            return None
+
+        started = time.perf_counter()
+        gc_objects = self._collect()
+        trimmed = self._trim() if rss_over else False
+        if tensors_over:
+            self._empty_cache()
+        rss_after, tensors_after = self.sample()
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        stage_timing.record("memory_reclaim", elapsed_ms)
+
+        if rss_after is not None:
+            self._rss_floor = rss_after if rss_after > self.budget_bytes else 0
+        reclaim = Reclaim(
+            stage=stage,
+            rss_before=rss or 0,
+            rss_after=rss_after if rss_after is not None else rss or 0,
+            tensor_before=tensors,
+            tensor_after=tensors_after,
+            gc_objects=gc_objects,
+            trimmed=trimmed,
+            elapsed_ms=elapsed_ms,
+        )
+        metrics.MEMORY_RECLAIMS.inc(stage=stage)
+        metrics.MEMORY_RECLAIMED_BYTES.inc(reclaim.rss_reclaimed, kind="rss")
+        metrics.MEMORY_RECLAIMED_BYTES.inc(reclaim.tensor_reclaimed, kind="cuda_tensors")
+        logger.info(
+            f"[MEM] after {stage}: RSS {reclaim.rss_before / MB:.0f}MB -> {reclaim.rss_after / MB:.0f}MB "
+            f"(budget {self.budget_bytes / MB:.0f}MB, freed {reclaim.rss_reclaimed / MB:.1f}MB, "
+            f"{gc_objects} objects collected, trim={'yes' if trimmed else 'no'})"
+            + (f", CUDA tensors freed {reclaim.tensor_reclaimed / MB:.1f}MB" if tensors_over else "")
+            + f" in {elapsed_ms:.1f}ms"
+        )
+        if self._rss_floor:
+            logger.warning(f"[MEM] RSS still over budget after reclaim ({reclaim.rss_after / MB:.0f}MB); consider a smaller CROP_WINDOW")
+        return reclaim
+
+
+governor = MemoryGovernor(
+    budget_bytes=MEMORY_BUDGET_MB * MB,
+    headroom_bytes=MEMORY_RECLAIM_HEADROOM_MB * MB,
+    tensor_budget_bytes=MEMORY_TENSOR_BUDGET_MB * MB,
+)
+
+
+def checkpoint(stage: str) -> Optional[Reclaim]:
+    return governor.checkpoint(stage)
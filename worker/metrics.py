@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+In-process metrics with an optional Prometheus text-format endpoint.
+
+No client library or external service is needed: counters and histograms live
+in this module, and ``start_metrics_server`` serves them from a stdlib HTTP
+server thread at ``/metrics`` when ``METRICS_PORT`` is set. Per-stage latency
+histograms come from ``stage_timing``. Queue depth and age are read through the
+``queue_stats`` RPC at most once per ``METRICS_QUEUE_SAMPLE_SECONDS``, no matter
+how often Prometheus scrapes.
+"""
+from __future__ import annotations
+
+import logging
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import stage_timing
+except ImportError:  # imported as worker.metrics from scripts
+    from worker import stage_timing
+
+resident_memory_bytes = stage_timing.resident_memory_bytes
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0") or 0)  # 0 disables the endpoint
+METRICS_QUEUE_SAMPLE_SECONDS = float(os.getenv("METRICS_QUEUE_SAMPLE_SECONDS", "15"))
+
+PREFIX = "scan_worker"
+STAGE_BUCKETS_SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Optional[Dict[str, str]]) -> LabelKey:
+    return tuple(sorted((labels or {}).items()))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _fmt_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name, self.help = name, help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(_labels(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in items)
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float]):
+        self.name, self.help = name, help_text
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+            self._sum += value
+            self._count += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        running = 0
+        for bound, n in zip(self.buckets, counts):
+            running += n
+            lines.append(f'{self.name}_bucket{{le="{_fmt_value(bound)}"}} {running}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {count}')
+        lines.append(f"{self.name}_sum {_fmt_value(total)}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+
+# ---------------- Worker metrics ----------------
+
+JOBS_PROCESSED = Counter(f"{PREFIX}_jobs_processed_total", "Jobs finished successfully by this worker")
+JOBS_FAILED = Counter(f"{PREFIX}_jobs_failed_total", "Jobs that failed in this worker")
+JOBS_FENCED = Counter(f"{PREFIX}_jobs_fenced_total", "Jobs abandoned because another worker took over the lease")
+JOBS_RETRIED = Counter(f"{PREFIX}_jobs_retried_total", "Failed jobs requeued with backoff")
+JOBS_DEAD_LETTERED = Counter(f"{PREFIX}_jobs_dead_lettered_total", "Failed jobs moved to job_dead_letter")
+SCANS_CLONED = Counter(f"{PREFIX}_scans_cloned_total", "Scans answered from an earlier scan of the same image bytes")
+CACHE_REQUESTS = Counter(f"{PREFIX}_cache_requests_total", "Cache lookups by cache and result (hit/miss)")
+CROPS_PER_SCAN = Histogram(f"{PREFIX}_crops_per_scan", "Card crops detected per scan", (0, 1, 2, 4, 6, 9, 12, 18, 36))
+EMBEDDER_BATCH_SIZE = Histogram(f"{PREFIX}_embedder_batch_size", "Images per embedder forward pass", (1, 2, 4, 8, 16, 32, 64))
+CROPS_GATED = Counter(f"{PREFIX}_crops_gated_total", "Detections kept from the embedder by the crop gate, by verdict (reject/defer) and reason")
+CROPS_DEDUPED = Counter(f"{PREFIX}_crops_deduped_total", "Crops that reused the retrieval of a near-identical crop in the same scan")
+CONFUSION_RERANKS = Counter(f"{PREFIX}_confusion_reranks_total", "Second looks at known confusion pairs, by outcome (kept/swapped)")
+TEMPLATE_SEARCH_STEPS = Counter(f"{PREFIX}_template_search_steps_total", "Adaptive template search RPCs, by requested k")
+MEMORY_RECLAIMS = Counter(f"{PREFIX}_memory_reclaims_total", "Over-budget memory checkpoints that ran gc/malloc_trim, by stage")
+MEMORY_RECLAIMED_BYTES = Counter(f"{PREFIX}_memory_reclaimed_bytes_total", "Bytes freed by memory reclaims, by kind (rss/cuda_tensors)")
+
+_STATIC_METRICS = (JOBS_PROCESSED, JOBS_FAILED, JOBS_FENCED, JOBS_RETRIED, JOBS_DEAD_LETTERED, SCANS_CLONED, CACHE_REQUESTS, CROPS_PER_SCAN, EMBEDDER_BATCH_SIZE,
+                   CROPS_GATED, CROPS_DEDUPED, CONFUSION_RERANKS, TEMPLATE_SEARCH_STEPS, MEMORY_RECLAIMS, MEMORY_RECLAIMED_BYTES)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+class QueueSampler:
+    """Caches ``queue_stats`` RPC results so scrapes never add database load."""
+
+    def __init__(self, supabase_client, interval_seconds: float = METRICS_QUEUE_SAMPLE_SECONDS, clock=time.monotonic):
+        self.supabase_client = supabase_client
+        self.interval_seconds = interval_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._sampled_at: Optional[float] = None
+        self._rows: List[Dict] = []
+
+    def rows(self) -> List[Dict]:
+        with self._lock:
+            now = self._clock()
+            if self._sampled_at is None or now - self._sampled_at >= self.interval_seconds:
+                self._sampled_at = now
+                try:
+                    self._rows = self.supabase_client.rpc("queue_stats", {}).execute().data or []
+                except Exception as e:
+                    logger.debug(f"[METRICS] queue_stats sample failed: {e}")
+            return list(self._rows)
+
+
+def _render_stage_histograms() -> List[str]:
+    name = f"{PREFIX}_stage_duration_seconds"
+    lines = [f"# HELP {name} Pipeline stage latency", f"# TYPE {name} histogram"]
+    for stage, hist in sorted(stage_timing.registry.snapshot().items()):
+        key = _labels({"stage": stage})
+        cumulative = hist.cumulative_buckets()
+        for bound in STAGE_BUCKETS_SECONDS:
+            bound_ms = bound * 1000.0
+            count = 0
+            for upper_ms, running in cumulative:
+                if upper_ms > bound_ms:
+                    break
+                count = running
+            lines.append(f"{name}_bucket{_fmt_labels(key, ('le', _fmt_value(bound)))} {count}")
+        lines.append(f"{name}_bucket{_fmt_labels(key, ('le', '+Inf'))} {hist.count}")
+        lines.append(f"{name}_sum{_fmt_labels(key)} {_fmt_value(hist.total_ms / 1000.0)}")
+        lines.append(f"{name}_count{_fmt_labels(key)} {hist.count}")
+    return lines
+
+
+def _render_queue(sampler: Optional[QueueSampler]) -> List[str]:
+    if sampler is None:
+        return []
+    depth = f"{PREFIX}_queue_jobs"
+    age = f"{PREFIX}_queue_oldest_age_seconds"
+    lines = [
+        f"# HELP {depth} Jobs in job_queue by status (sampled)",
+        f"# TYPE {depth} gauge",
+    ]
+    rows = sampler.rows()
+    for row in rows:
+        lines.append(f"{depth}{_fmt_labels(_labels({'status': row.get('status', '')}))} {_fmt_value(float(row.get('jobs') or 0))}")
+    lines += [
+        f"# HELP {age} Age of the oldest job per status: queue wait for pending (sampled)",
+        f"# TYPE {age} gauge",
+    ]
+    for row in rows:
+        lines.append(f"{age}{_fmt_labels(_labels({'status': row.get('status', '')}))} {_fmt_value(float(row.get('oldest_age_seconds') or 0.0))}")
+    return lines
+
+
+def render(queue_sampler: Optional[QueueSampler] = None, extra: Iterable[Callable[[], List[str]]] = ()) -> str:
+    """Render every metric in the Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in _STATIC_METRICS:
+        lines.extend(metric.render())
+    lines.extend(_render_stage_histograms())
+    rss = resident_memory_bytes()
+    if rss is not None:
+        lines += [
+            "# HELP process_resident_memory_bytes Resident memory size in bytes",
+            "# TYPE process_resident_memory_bytes gauge",
+            f"process_resident_memory_bytes {rss}",
+        ]
+    lines.extend(_render_queue(queue_sampler))
+    for collector in extra:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(port: int = METRICS_PORT, queue_sampler: Optional[QueueSampler] = None, host: str = "0.0.0.0") -> Optional[ThreadingHTTPServer]:
+    """Serve ``/metrics`` from a daemon thread. Returns None when ``port`` is 0."""
+    if not port:
+        return None
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):  # noqa: N802 - http.server API
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = render(queue_sampler).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # noqa: A002 - keep scrapes out of the worker log
+            return
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    logger.info(f"[OK] Metrics endpoint listening on {host}:{server.server_address[1]}/metrics")
+    return server
@@ -1,20 +1,45 @@
+import itertools
 import os
 import warnings
-from typing import Optional
+from pathlib import Path
+from typing import Optional, Sequence
 
 import numpy as np
 import torch
 import torch.nn.functional as F
-from PIL import Image, ImageOps
+from PIL import Image
 
 import open_clip
 
+try:
+    from stage_timing import span
+    from metrics import EMBEDDER_BATCH_SIZE
+    from crop_artifact import strict_preprocess
+    from shared_weights import export_state_dict, mmap_state_dict, visual_weights_path
+    import precision_guard
+except ImportError:  # imported as worker.openclip_embedder from scripts
+    from worker.stage_timing import span
+    from worker.metrics import EMBEDDER_BATCH_SIZE
+    from worker.crop_artifact import strict_preprocess
+    from worker.shared_weights import export_state_dict, mmap_state_dict, visual_weights_path
+    from worker import precision_guard
+
 # Suppress harmless QuickGELU config mismatch warning (ViT-L-14-336 works fine)
 warnings.filterwarnings("ignore", message=".*QuickGELU mismatch.*", category=UserWarning)
 
 _CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
 _CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
 
+# Bump whenever strict_preprocess (crop_artifact.py) / _to_clip_tensor change in a way that moves embeddings.
+# Gallery generations are tagged with it so stale templates are never mixed with new queries.
+PREPROCESS_VERSION = "strict336-pad-v1"
+
+# Reduced-precision modes (CPU): weights and activations in this dtype; oneDNN/MKL
+# matmuls still accumulate in fp32. Outputs are returned as fp32 either way. There is
+# no fp16 mode: CPU fp16 kernels compute in fp16, and upcasting fp16 weights at load
+# gives up both the speed and the memory saving.
+PRECISION_DTYPES = {"fp32": torch.float32, "bf16": torch.bfloat16}
+
 
 def set_torch_deterministic(seed: int = 1337):
     torch.manual_seed(seed)
@@ -24,28 +49,6 @@ def set_torch_deterministic(seed: int = 1337):
     torch.backends.cudnn.benchmark = False
 
 
-def _resize_short_side_keep_ar(img: Image.Image, target_short: int = 336) -> Image.Image:
-    w, h = img.size
-    if w <= 0 or h <= 0:
-        raise ValueError("Invalid image size")
-    if w < h:
-        new_w = target_short
-        new_h = int(round(h * (target_short / w)))
-    else:
-        new_h = target_short
-        new_w = int(round(w * (target_short / h)))
-    return img.resize((new_w, new_h), resample=Image.Resampling.BICUBIC)
-
-
-def _pad_to_square_center(img: Image.Image) -> Image.Image:
-    w, h = img.size
-    side = max(w, h)
-    delta_w = side - w
-    delta_h = side - h
-    padding = (delta_w // 2, delta_h // 2, delta_w - (delta_w // 2), delta_h - (delta_h // 2))
-    return ImageOps.expand(img, padding, fill=0)
-
-
 def _to_clip_tensor(img: Image.Image, device: torch.device) -> torch.Tensor:
     arr = np.asarray(img).astype("float32") / 255.0
     if arr.ndim == 2:
@@ -60,20 +63,63 @@ def _to_clip_tensor(img: Image.Image, device: torch.device) -> torch.Tensor:
     return t
 
 
-def strict_preprocess(pil: Image.Image, target_short: int = 336) -> Image.Image:
-    if pil.mode not in ("RGB", "RGBA"):
-        pil = pil.convert("RGB")
-    resized = _resize_short_side_keep_ar(pil, target_short)
-    squared = _pad_to_square_center(resized)
-    if squared.size != (target_short, target_short):
-        squared = squared.resize((target_short, target_short), resample=Image.Resampling.BICUBIC)
-    return squared
+def visual_tower_config(model_name: str) -> dict:
+    """open_clip's architecture config for ``model_name`` (``embed_dim``, ``vision_cfg``, ...)."""
+    config = open_clip.get_model_config(model_name)
+    if not config or "vision_cfg" not in config:
+        raise ValueError(f"No open_clip config for model {model_name!r}")
+    return config
+
+
+def build_visual_tower(model_name: str, pretrained: str) -> torch.nn.Module:
+    """
+    The image tower alone, on the meta device (no weights allocated or initialized);
+    load real weights into it with ``load_state_dict(..., assign=True)``.
+    """
+    config = visual_tower_config(model_name)
+    # OpenAI checkpoints are loaded with QuickGELU, so the empty tower must match
+    quick_gelu = bool(config.get("quick_gelu", False)) or pretrained == "openai"
+    # Public API only; on meta the text tower costs nothing and is dropped right away
+    with torch.device("meta"):
+        model = open_clip.create_model(model_name, pretrained=None, device="meta", force_quick_gelu=quick_gelu)
+    return model.visual
+
+
+def export_visual_checkpoint(model_name: str, pretrained: str, path: Path, cache_dir: Optional[str] = None,
+                             dtype: Optional[torch.dtype] = None) -> Path:
+    """Load the full checkpoint once and write only its visual tower (optionally cast) to ``path``."""
+    model, _, _ = open_clip.create_model_and_transforms(model_name, pretrained=pretrained, cache_dir=cache_dir)
+    state_dict = model.visual.state_dict()
+    del model
+    if dtype is not None:
+        state_dict = {name: t.to(dtype) for name, t in state_dict.items()}
+    export_state_dict(state_dict, path, metadata={
+        "model_name": model_name,
+        "pretrained": pretrained,
+        "embed_dim": str(visual_tower_config(model_name)["embed_dim"]),
+        "precision": {None: "fp32", torch.bfloat16: "bf16"}.get(dtype, str(dtype)),
+    })
+    return Path(path)
 
 
 class OpenClipEmbedder:
     """
     ViT-L/14@336 image embedder with strict transforms and 2-view TTA.
     Output: L2-normalized float32 numpy vector of dim=768.
+
+    Only the visual tower is kept (the text transformer is never needed for
+    retrieval), and the embed dim comes from the model config. With
+    ``shared_weights`` (CPU only) the tower is built on the meta device and its
+    parameters are views into a memory-mapped visual-only safetensors checkpoint
+    (see ``export_visual_checkpoint`` / scripts/extract_visual_checkpoint.py,
+    written on first use if missing), so every worker process on the host shares
+    one physical copy.
+
+    ``precision="bf16"`` (CPU only) runs the visual tower in reduced precision
+    from a cast copy of those weights, but only if the precision guard passes:
+    the fixture crops must embed within ``max_precision_drift`` cosine distance
+    of their fp32 embeddings, or the embedder stays fp32. A candidate pass that
+    raises (e.g. a missing bf16 kernel) also keeps it fp32.
     """
 
     def __init__(
@@ -83,6 +129,9 @@ class OpenClipEmbedder:
         target_short: int = 336,
         use_cuda_if_available: bool = True,
         deterministic_seed: int = 1337,
+        shared_weights: bool = False,
+        precision: str = "fp32",
+        max_precision_drift: float = precision_guard.DEFAULT_MAX_DRIFT,
     ) -> None:
         set_torch_deterministic(deterministic_seed)
 
@@ -93,24 +142,96 @@ class OpenClipEmbedder:
         )
         self.device = device
         self.target_short = target_short
+        self.model_name = model_name
+        self.pretrained = pretrained
 
         # Set persistent cache directory for model weights
         cache_dir = os.getenv("OPENCLIP_CACHE_DIR", "/tmp/open_clip")
         os.makedirs(cache_dir, exist_ok=True)
 
-        model, _, _ = open_clip.create_model_and_transforms(
-            model_name, pretrained=pretrained, cache_dir=cache_dir
-        )
-        self.model = model.eval().to(device)
-        with torch.no_grad():
-            self._embed_dim = (
-                self.model.text_projection.shape[1]
-                if hasattr(self.model, "text_projection")
-                else 768
+        # Retrieval only ever encodes images: just the visual tower is kept resident
+        self._embed_dim = int(visual_tower_config(model_name)["embed_dim"])
+        self.shared_weights_path: Optional[Path] = None
+        self.model: Optional[torch.nn.Module] = None
+        if shared_weights and device.type == "cpu":
+            path = visual_weights_path(cache_dir, model_name, pretrained)
+            try:
+                if not path.exists():
+                    export_visual_checkpoint(model_name, pretrained, path, cache_dir)
+                    print(f"[openclip_embedder] Exported visual weights to {path}")
+                self.model = self._mmap_visual(path)
+                self.shared_weights_path = path
+            except Exception as e:
+                print(f"[openclip_embedder] Shared weights at {path} failed to load ({e}); using a private copy")
+        if self.model is None:
+            model, _, _ = open_clip.create_model_and_transforms(
+                model_name, pretrained=pretrained, cache_dir=cache_dir
             )
+            self.model = model.visual.eval().to(device)
+            del model  # drops the text tower
         if self._embed_dim != 768:
             print(f"[openclip_embedder] Warning: embed dim is {self._embed_dim}, not 768.")
 
+        self.precision = "fp32"
+        self.dtype = torch.float32
+        self.precision_report: Optional[precision_guard.GuardReport] = None
+        if precision != "fp32":
+            self._enable_reduced_precision(precision, cache_dir, max_precision_drift)
+
+    def _mmap_visual(self, path: Path) -> torch.nn.Module:
+        """Build the visual tower with its parameters mapped from the safetensors file at ``path``."""
+        state_dict, _ = mmap_state_dict(path)
+        visual = build_visual_tower(self.model_name, self.pretrained)
+        visual.load_state_dict(state_dict, assign=True)
+        missing = [name for name, t in itertools.chain(visual.named_parameters(), visual.named_buffers()) if t.is_meta]
+        if missing:
+            raise RuntimeError(f"{path} has no weights for {missing[:5]}")
+        return visual.eval()
+
+    def _enable_reduced_precision(self, precision: str, cache_dir: str, max_drift: float) -> None:
+        """Switch to a reduced-precision copy of the visual weights if the precision guard passes."""
+        dtype = PRECISION_DTYPES.get(precision)
+        if dtype is None:
+            raise ValueError(f"Unknown embedder precision {precision!r}; expected one of {sorted(PRECISION_DTYPES)}")
+        if self.device.type != "cpu":
+            print(f"[openclip_embedder] {precision} mode is for CPU inference; staying fp32 on {self.device}")
+            return
+        fixtures = precision_guard.load_fixtures()
+        if not fixtures:
+            print(f"[openclip_embedder] No precision fixtures in {precision_guard.FIXTURE_DIR}; staying fp32")
+            return
+
+        reference = precision_guard.load_reference(self.generation_tag, cache_dir)
+        if reference is None or set(reference) != set(fixtures):
+            reference = {name: self.embed(img, tta_views=1) for name, img in fixtures.items()}
+            precision_guard.save_reference(self.generation_tag, reference, cache_dir)
+
+        fp32_model = self.model
+        path = visual_weights_path(cache_dir, self.model_name, self.pretrained).with_suffix(f".{precision}.safetensors")
+        try:
+            if not path.exists():
+                export_state_dict(
+                    {name: t.to(dtype) for name, t in fp32_model.state_dict().items()}, path,
+                    metadata={"model_name": self.model_name, "pretrained": self.pretrained,
+                              "embed_dim": str(self._embed_dim), "precision": precision},
+                )
+            self.model, self.dtype = self._mmap_visual(path), dtype
+            candidate = {name: self.embed(img, tta_views=1) for name, img in fixtures.items()}
+        except Exception as e:
+            self.model, self.dtype = fp32_model, torch.float32
+            self.precision_report = precision_guard.GuardReport(precision, max_drift, error=f"{type(e).__name__}: {e}")
+            print(f"[openclip_embedder] Refusing {precision}: candidate pass failed ({e}); staying fp32")
+            return
+
+        report = precision_guard.compare(reference, candidate, precision, max_drift)
+        self.precision_report = report
+        if report.passed:
+            self.precision = precision
+            print(f"[openclip_embedder] {precision} enabled: worst fixture drift {report.worst:.5f} <= {max_drift}")
+        else:
+            self.model, self.dtype = fp32_model, torch.float32
+            print(f"[openclip_embedder] Refusing {precision}: fixture drift {report.drift} exceeds {max_drift}; staying fp32")
+
     @staticmethod
     def _l2(x: torch.Tensor) -> torch.Tensor:
         return F.normalize(x, dim=-1)
@@ -124,11 +245,13 @@ class OpenClipEmbedder:
 
         embs = []
         for v in views:
-            t = _to_clip_tensor(v, self.device)
-            e = self.model.encode_image(t).float()
-            e = self._l2(e)
-            embs.append(e)
-            del t  # Clean up tensor immediately after use
+            with span("embed_view"):
+                t = _to_clip_tensor(v, self.device).to(self.dtype)
+                EMBEDDER_BATCH_SIZE.observe(t.shape[0])
+                e = self.model(t).float()
+                e = self._l2(e)
+                embs.append(e)
+                del t  # Clean up tensor immediately after use
 
         e_mean = torch.mean(torch.cat(embs, dim=0), dim=0, keepdim=True)
         e_out = self._l2(e_mean).squeeze(0)
@@ -137,10 +260,36 @@ class OpenClipEmbedder:
         del embs, e_mean, e_out
         if self.device.type == "cuda":
             torch.cuda.empty_cache()
-        import gc
-        gc.collect()
         return result
     
+    @torch.no_grad()
+    def embed_batch(self, pils: Sequence[Image.Image], tta_views: int = 2, preprocessed: bool = False) -> np.ndarray:
+        """
+        Embed several images in one forward pass (all TTA views stacked).
+        Returns an (N, D) float32 array; row i matches ``embed(pils[i])``.
+        ``preprocessed``: the images already went through ``strict_preprocess``
+        (``CropArtifact.embed_input``).
+        """
+        views = []
+        for pil in pils:
+            base = pil if preprocessed else strict_preprocess(pil, target_short=self.target_short)
+            views.append(base)
+            if tta_views >= 2:
+                views.append(base.transpose(Image.FLIP_LEFT_RIGHT))
+        per_image = len(views) // max(len(pils), 1)
+
+        with span("embed_view"):
+            t = torch.cat([_to_clip_tensor(v, self.device) for v in views], dim=0).to(self.dtype)
+            EMBEDDER_BATCH_SIZE.observe(t.shape[0])
+            e = self._l2(self.model(t).float())
+            del t
+        e = e.reshape(len(pils), per_image, -1).mean(dim=1)
+        result = self._l2(e).cpu().numpy().astype("float32")
+        del e
+        if self.device.type == "cuda":
+            torch.cuda.empty_cache()
+        return result
+
     @torch.no_grad()
     def embed_image_bytes(self, image_bytes: bytes, tta_views: int = 2) -> np.ndarray:
         """Embed image from raw bytes (for processing downloaded crops)."""
@@ -156,15 +305,26 @@ class OpenClipEmbedder:
     def device_str(self) -> str:
         return str(self.device)
 
+    @property
+    def generation_tag(self) -> str:
+        """Identifier for embeddings produced by this model + preprocessing combination."""
+        return f"{self.model_name}/{self.pretrained}/{PREPROCESS_VERSION}"
+
 
 def build_default_embedder() -> OpenClipEmbedder:
     use_cuda = os.getenv("USE_CUDA_IF_AVAILABLE", "1") == "1"
+    shared_weights = os.getenv("OPENCLIP_SHARED_WEIGHTS", "0") == "1"  # mmap visual weights (CPU); opt-in until measured
+    precision = os.getenv("EMBEDDER_PRECISION", "fp32").lower()  # fp32 | bf16, guarded
+    max_drift = float(os.getenv("EMBEDDER_PRECISION_MAX_DRIFT", str(precision_guard.DEFAULT_MAX_DRIFT)))
     return OpenClipEmbedder(
         model_name="ViT-L-14-336",
         pretrained="openai",  # ViT-L-14-336 DOES exist on OpenAI
         target_short=336,
         use_cuda_if_available=use_cuda,
         deterministic_seed=1337,
+        shared_weights=shared_weights,
+        precision=precision,
+        max_precision_drift=max_drift,
     )
 
 
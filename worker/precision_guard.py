@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Accuracy guard for reduced-precision embedding.
+
+The gallery is embedded in fp32, so a bf16 embedder is only safe if its
+vectors stay within a small cosine distance of the fp32 ones. Before a reduced
+precision mode is switched on, the embedder embeds the fixture crops (the OCR
+tests' card crops in ``__tests__/ocr/fixtures``, copied to ``fixtures/precision``
+in the Docker image) and ``compare``s them against fp32 references for the
+same model. The references are computed with the fp32 weights on first use and
+stored per model tag under the model cache dir (``OPENCLIP_CACHE_DIR``), so the
+fixture tree stays read-only. The mode is refused if any fixture drifts by more
+than the tolerance.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Mapping, Optional
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+_FIXTURE_DIRS = (
+    Path(__file__).parent / "fixtures" / "precision",  # Docker image layout
+    Path(__file__).resolve().parents[1] / "__tests__" / "ocr" / "fixtures",  # source checkout
+)
+FIXTURE_DIR = next((d for d in _FIXTURE_DIRS if d.is_dir()), _FIXTURE_DIRS[0])
+CACHE_DIR = os.getenv("OPENCLIP_CACHE_DIR", "/tmp/open_clip")
+DEFAULT_MAX_DRIFT = 0.005  # 1 - cosine similarity
+
+
+@dataclass
+class GuardReport:
+    precision: str
+    max_drift: float
+    drift: Dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None  # the candidate pass raised; nothing was compared
+
+    @property
+    def worst(self) -> float:
+        return max(self.drift.values()) if self.drift else float("inf")
+
+    @property
+    def passed(self) -> bool:
+        return self.error is None and bool(self.drift) and self.worst <= self.max_drift
+
+
+def load_fixtures(fixture_dir: Path = FIXTURE_DIR) -> Dict[str, Image.Image]:
+    """Fixture crops by file stem (RGB, fully decoded)."""
+    fixtures = {}
+    for path in sorted(Path(fixture_dir).glob("*.jpg")):
+        with Image.open(path) as img:
+            fixtures[path.stem] = img.convert("RGB")
+    return fixtures
+
+
+def reference_path(model_tag: str, cache_dir: str = CACHE_DIR) -> Path:
+    """Where the fp32 reference for ``model_tag`` is stored (one file per tag)."""
+    return Path(cache_dir) / "precision" / (re.sub(r"[^A-Za-z0-9._-]+", "_", model_tag) + "_fp32.npz")
+
+
+def load_reference(model_tag: str, cache_dir: str = CACHE_DIR) -> Optional[Dict[str, np.ndarray]]:
+    """Stored fp32 embeddings for ``model_tag``, or None if absent or made by another model."""
+    path = reference_path(model_tag, cache_dir)
+    if not path.exists():
+        return None
+    with np.load(path, allow_pickle=False) as data:
+        if str(data["__model__"]) != model_tag:
+            return None
+        return {name: data[name].astype(np.float32) for name in data.files if name != "__model__"}
+
+
+def save_reference(model_tag: str, embeddings: Mapping[str, np.ndarray], cache_dir: str = CACHE_DIR) -> None:
+    """Store fp32 reference embeddings (best effort: the cache dir may be read-only)."""
+    path = reference_path(model_tag, cache_dir)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, __model__=np.array(model_tag), **{k: np.asarray(v, dtype=np.float32) for k, v in embeddings.items()})
+    except OSError as e:
+        logger.warning(f"[WARN] Could not store precision reference embeddings at {path}: {e}")
+
+
+def compare(reference: Mapping[str, np.ndarray], candidate: Mapping[str, np.ndarray], precision: str,
+            max_drift: float = DEFAULT_MAX_DRIFT) -> GuardReport:
+    """Cosine drift of each candidate embedding from its reference."""
+    report = GuardReport(precision=precision, max_drift=max_drift)
+    for name, ref in reference.items():
+        vec = candidate.get(name)
+        if vec is None:
+            report.drift[name] = float("inf")
+            continue
+        ref = np.asarray(ref, dtype=np.float64)
+        vec = np.asarray(vec, dtype=np.float64)
+        cosine = float(ref @ vec / (np.linalg.norm(ref) * np.linalg.norm(vec) + 1e-12))
+        report.drift[name] = round(1.0 - cosine, 6)
+    return report
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Cluster-wide job queue maintenance.
+
+Stale-job recovery runs server-side in the ``sweep_stale_jobs`` SQL function
+(migration 20251030010000_sweep_stale_jobs.sql): one set-based statement requeues
+or fails every stuck job and updates its scan. Each worker (and the auto-recovery
+monitor) calls it through ``StaleJobSweeper`` on a jittered cadence; the function
+itself elects one caller per sweep window, so queue-maintenance load stays constant
+no matter how many workers are running or how fast they loop.
+"""
+from __future__ import annotations
+
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+from config import (
+    MAX_JOB_RETRIES,
+    STALE_JOB_MINUTES,
+    SWEEP_INTERVAL_SECONDS,
+    SWEEP_JITTER_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+SWEEP_RPC = "sweep_stale_jobs"
+
+
+class SweepUnavailable(RuntimeError):
+    """The database does not have the sweep_stale_jobs function yet."""
+
+
+@dataclass
+class SweepResult:
+    swept: bool
+    requeued: int = 0
+    failed: int = 0
+    scans_updated: int = 0
+    requeued_job_ids: List[str] = field(default_factory=list)
+    failed_job_ids: List[str] = field(default_factory=list)
+
+
+def _is_missing_function_error(error: Exception) -> bool:
+    text = str(error)
+    return "PGRST202" in text or "Could not find the function" in text
+
+
+def sweep_stale_jobs(
+    supabase_client,
+    max_retries: int = MAX_JOB_RETRIES,
+    stale_after_minutes: float = STALE_JOB_MINUTES,
+    min_interval_seconds: Optional[float] = None,
+) -> SweepResult:
+    """
+    Run one server-side sweep. With ``min_interval_seconds`` set, the call is a cheap
+    no-op (``swept=False``) if another caller already swept within that window.
+    """
+    params = {
+        "p_max_retries": int(max_retries),
+        "p_stale_after": f"{float(stale_after_minutes) * 60:g} seconds",
+        "p_min_interval": None if min_interval_seconds is None else f"{float(min_interval_seconds):g} seconds",
+    }
+    try:
+        response = supabase_client.rpc(SWEEP_RPC, params).execute()
+    except Exception as e:
+        if _is_missing_function_error(e):
+            raise SweepUnavailable(str(e)) from e
+        raise
+
+    rows = response.data or []
+    if not rows:
+        return SweepResult(swept=False)
+    row = rows[0]
+    return SweepResult(
+        swept=bool(row.get("swept")),
+        requeued=int(row.get("requeued_count") or 0),
+        failed=int(row.get("failed_count") or 0),
+        scans_updated=int(row.get("scans_updated") or 0),
+        requeued_job_ids=list(row.get("requeued_job_ids") or []),
+        failed_job_ids=list(row.get("failed_job_ids") or []),
+    )
+
+
+class StaleJobSweeper:
+    """
+    Calls ``sweep_stale_jobs`` at most once per ``interval_seconds`` (+/- jitter) per process.
+
+    The server-side election window is ``interval - jitter``, so across the whole fleet
+    the sweep actually runs about once per interval. If the RPC is missing (migration
+    not applied yet) the sweeper switches to ``fallback`` permanently.
+    """
+
+    def __init__(
+        self,
+        supabase_client,
+        interval_seconds: float = SWEEP_INTERVAL_SECONDS,
+        jitter_seconds: float = SWEEP_JITTER_SECONDS,
+        max_retries: int = MAX_JOB_RETRIES,
+        stale_after_minutes: float = STALE_JOB_MINUTES,
+        fallback: Optional[Callable[[object], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+        rng: Callable[[], float] = random.random,
+    ):
+        self.supabase_client = supabase_client
+        self.interval_seconds = max(float(interval_seconds), 1.0)
+        self.jitter_seconds = min(max(float(jitter_seconds), 0.0), self.interval_seconds / 2)
+        self.max_retries = max_retries
+        self.stale_after_minutes = stale_after_minutes
+        self.fallback = fallback
+        self._clock = clock
+        self._rng = rng
+        self._use_fallback = False
+        # First sweep lands somewhere in the first window so restarted fleets don't stampede
+        self._next_due = self._clock() + self._rng() * self.jitter_seconds
+
+    @property
+    def election_window_seconds(self) -> float:
+        return max(self.interval_seconds - self.jitter_seconds, 1.0)
+
+    def _schedule_next(self) -> None:
+        offset = (self._rng() * 2.0 - 1.0) * self.jitter_seconds
+        self._next_due = self._clock() + self.interval_seconds + offset
+
+    def due(self) -> bool:
+        return self._clock() >= self._next_due
+
+    def maybe_sweep(self) -> Optional[SweepResult]:
+        """Sweep if this process's cadence is due. Never raises."""
+        if not self.due():
+            return None
+        self._schedule_next()
+
+        if self._use_fallback:
+            self._run_fallback()
+            return None
+
+        try:
+            result = sweep_stale_jobs(
+                self.supabase_client,
+                max_retries=self.max_retries,
+                stale_after_minutes=self.stale_after_minutes,
+                min_interval_seconds=self.election_window_seconds,
+            )
+        except SweepUnavailable as e:
+            logger.warning(f"[WARN] {SWEEP_RPC} RPC not available, using client-side requeue: {e}")
+            self._use_fallback = True
+            self._run_fallback()
+            return None
+        except Exception as e:
+            logger.warning(f"[WARN] Stale job sweep failed (non-fatal): {e}")
+            return None
+
+        if result.requeued or result.failed:
+            logger.info(f"[REQUEUE] Swept stale jobs: {result.requeued} requeued, {result.failed} failed")
+        return result
+
+    def _run_fallback(self) -> None:
+        if self.fallback is None:
+            return
+        try:
+            self.fallback(self.supabase_client)
+        except Exception as e:
+            logger.warning(f"[WARN] Client-side requeue failed: {e}")
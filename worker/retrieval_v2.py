@@ -7,14 +7,26 @@ via configuration without altering the legacy retrieval path.
 """
 from __future__ import annotations
 
+import time
 from typing import Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 from PIL import Image
 
 from openclip_embedder import build_default_embedder
+from vector_codec import format_vector, parse_vector
+from stage_timing import record as record_stage, span
+import adaptive_search
+import confusion_rerank
+from crop_dedupe import EmbeddingMemo
+import set_routing
 from config import (
+    ADAPTIVE_SEARCH,
+    CONFUSION_RERANK,
+    CROP_DEDUPE,
     FUSION_WEIGHTS,
+    RETRIEVAL_SEARCH,
+    SET_ROUTING_MIN_SCORE,
     TTA_VIEWS,
     UNKNOWN_THRESHOLD,
 )
@@ -73,25 +85,66 @@ def identify_v2(
               'fused': float,
           }],
           'thresholded': bool,
-          'raw_template_matches': int
+          'raw_template_matches': int,
+          'second_look': bool,  # contested confusion pair reordered by confusion_rerank
+          'routed_sets': List[str],  # sets searched by hierarchical retrieval, [] for a global search
+          'shared_retrieval': bool,  # optional, identify_v2_batch only: present (True) when copied from a near-identical crop
         }
     """
     embedder = _get_embedder()
-    query_vec = embedder.embed(pil_image, tta_views=TTA_VIEWS).astype(np.float32)
-    if topk <= 0:
-        topk = 200
-
-    payload = {
-        "qvec": query_vec.tolist(),
-        "match_count": int(topk),
-        "set_hint": set_hint,
-    }
-    
+    with span("embed"):
+        query_vec = embedder.embed(pil_image, tta_views=TTA_VIEWS).astype(np.float32)
     # Clear the original PIL image reference now that we have embedding
     del pil_image
+    return _identify_vector(query_vec, supabase_client, topk=topk, set_hint=set_hint)
 
+
+def identify_v2_batch(
+    pil_images: Sequence[Image.Image],
+    supabase_client,
+    topk: int = 200,
+    set_hint: Optional[str] = None,
+    preprocessed: bool = False,
+    memo: Optional[EmbeddingMemo] = None,
+) -> List[Dict]:
+    """
+    ``identify_v2`` for several crops: one batched embedder forward pass, then the
+    per-crop gallery lookups. Results are in input order, same shape as ``identify_v2``.
+    Pass ``preprocessed=True`` for inputs that are already strict 336-px squares.
+
+    Crops whose embedding is near-identical to an earlier one reuse its result
+    (``shared_retrieval``) instead of repeating the RPCs. Pass the scan's ``memo``
+    to dedupe across batches as well as within this one.
+    """
+    if not pil_images:
+        return []
+    embedder = _get_embedder()
+    with span("embed"):
+        query_vecs = embedder.embed_batch(pil_images, tta_views=TTA_VIEWS, preprocessed=preprocessed).astype(np.float32)
+    if memo is None and CROP_DEDUPE:
+        memo = EmbeddingMemo()
+    results = []
+    for vec in query_vecs:
+        result = memo.lookup(vec) if memo is not None else None
+        if result is None:
+            result = _identify_vector(vec, supabase_client, topk=topk, set_hint=set_hint)
+            if memo is not None:
+                memo.add(vec, result)
+        results.append(result)
+    return results
+
+
+def _match_templates_global(supabase_client, payload: Dict) -> Optional[List[Dict]]:
+    """``match_card_templates`` over the whole gallery; None when the RPC fails."""
+    if ADAPTIVE_SEARCH and adaptive_search.available():
+        # Small K and ef_search first, deeper only for ambiguous queries
+        rows = adaptive_search.search(supabase_client, payload["qvec"], payload["match_count"], payload["set_hint"])
+        if rows is not None:
+            return rows
+        # No step answered (failure or first-step timeout): fall back to the fixed-TopK RPC
     try:
-        response = supabase_client.rpc("match_card_templates", payload).execute()
+        with span("template_rpc"):
+            response = supabase_client.rpc("match_card_templates", payload).execute()
         template_rows = response.data or []
     except Exception as exc:  # pragma: no cover - defensive
         error_msg = str(exc)
@@ -100,31 +153,75 @@ def identify_v2(
             print(f"[retrieval_v2] RPC timeout, retrying with TopK=25...")
             payload["match_count"] = 25
             try:
-                response = supabase_client.rpc("match_card_templates", payload).execute()
+                with span("template_rpc"):
+                    response = supabase_client.rpc("match_card_templates", payload).execute()
                 template_rows = response.data or []
                 print(f"[retrieval_v2] Retry successful with TopK=25")
             except Exception as retry_exc:
                 print(f"[retrieval_v2] RPC match_card_templates failed after retry: {retry_exc}")
-                return {
-                    "card_id": None,
-                    "best_score": 0.0,
-                    "best_template_score": 0.0,
-                    "best_proto_score": None,
-                    "candidates": [],
-                    "thresholded": True,
-                    "raw_template_matches": 0,
-                }
+                return None
         else:
             print(f"[retrieval_v2] RPC match_card_templates failed: {exc}")
-            return {
-                "card_id": None,
-                "best_score": 0.0,
-                "best_template_score": 0.0,
-                "best_proto_score": None,
-                "candidates": [],
-                "thresholded": True,
-                "raw_template_matches": 0,
-            }
+            return None
+    return template_rows
+
+
+def _match_templates_routed(query_vec: np.ndarray, supabase_client, topk: int) -> Tuple[Optional[List[Dict]], List[str]]:
+    """
+    Hierarchical search: templates of the sets whose centroids best match the query.
+    Returns ``(None, [])`` (search globally) when there are no centroids, the RPC
+    fails, or the best routed template scores under ``SET_ROUTING_MIN_SCORE``.
+    """
+    routed_sets = set_routing.route(query_vec, supabase_client)
+    if not routed_sets:
+        return None, []
+    try:
+        rows = set_routing.match_templates_in_sets(query_vec, supabase_client, routed_sets, topk)
+    except Exception as exc:  # pragma: no cover - defensive
+        print(f"[retrieval_v2] RPC match_card_templates_in_sets failed, searching globally: {exc}")
+        return None, []
+    if max((float(row.get("score", 0.0)) for row in rows), default=-1.0) < SET_ROUTING_MIN_SCORE:
+        return None, []
+    return rows, routed_sets
+
+
+def _no_match(routed_sets: Sequence[str]) -> Dict:
+    """``identify_v2`` result for a query that reached no gallery rows."""
+    return {
+        "card_id": None,
+        "best_score": 0.0,
+        "best_template_score": 0.0,
+        "best_proto_score": None,
+        "candidates": [],
+        "thresholded": True,
+        "raw_template_matches": 0,
+        "second_look": False,
+        "routed_sets": list(routed_sets),
+    }
+
+
+def _identify_vector(
+    query_vec: np.ndarray,
+    supabase_client,
+    topk: int = 200,
+    set_hint: Optional[str] = None,
+) -> Dict:
+    """Template ANN search + prototype fusion for one L2-normalized query embedding."""
+    if topk <= 0:
+        topk = 200
+
+    template_rows: Optional[List[Dict]] = None
+    routed_sets: List[str] = []
+    if RETRIEVAL_SEARCH == "hierarchical" and set_hint is None:
+        template_rows, routed_sets = _match_templates_routed(query_vec, supabase_client, topk)
+    if template_rows is None:
+        template_rows = _match_templates_global(supabase_client, {
+            "qvec": format_vector(query_vec),
+            "match_count": int(topk),
+            "set_hint": set_hint,
+        })
+    if template_rows is None:
+        return _no_match(routed_sets)
 
     grouped: Dict[str, Dict] = {}
     for row in template_rows:
@@ -142,30 +239,25 @@ def identify_v2(
             }
 
     if not grouped:
-        return {
-            "card_id": None,
-            "best_score": 0.0,
-            "best_template_score": 0.0,
-            "best_proto_score": None,
-            "candidates": [],
-            "thresholded": True,
-            "raw_template_matches": 0,
-        }
+        return _no_match(routed_sets)
 
     card_ids = list(grouped.keys())
     prototype_map: Dict[str, np.ndarray] = {}
     try:
-        proto_resp = supabase_client.rpc(
-            "get_card_prototypes", {"ids": card_ids}
-        ).execute()
+        with span("prototype_rpc"):
+            proto_resp = supabase_client.rpc(
+                "get_card_prototypes", {"ids": card_ids}
+            ).execute()
         for row in proto_resp.data or []:
             cid = row.get("card_id")
             emb = row.get("emb")
-            if cid and emb:
-                prototype_map[cid] = np.asarray(emb, dtype=np.float32)
+            proto_vec = parse_vector(emb)
+            if cid and proto_vec is not None:
+                prototype_map[cid] = proto_vec
     except Exception as exc:  # pragma: no cover - defensive
         print(f"[retrieval_v2] RPC get_card_prototypes failed: {exc}")
 
+    fusion_started = time.perf_counter()
     w_template, w_proto = _safe_weights(FUSION_WEIGHTS)
     candidates: List[Dict] = []
     for card_id, data in grouped.items():
@@ -192,6 +284,11 @@ def identify_v2(
         )
 
     candidates.sort(key=lambda x: x["fused"], reverse=True)
+    record_stage("fusion", (time.perf_counter() - fusion_started) * 1000.0)
+    second_look = False
+    if CONFUSION_RERANK:
+        # Extra compute only when the leader and a close runner-up are a known confusion pair
+        candidates, second_look = confusion_rerank.rerank(query_vec, candidates, supabase_client, (w_template, w_proto))
     top_candidates = candidates[:5]  # Keep only top 5 for response
 
     best = top_candidates[0]
@@ -217,6 +314,8 @@ def identify_v2(
         ],
         "thresholded": bool(thresholded),
         "raw_template_matches": int(len(template_rows)),
+        "second_look": bool(second_look),
+        "routed_sets": list(routed_sets),
     }
     
     # NOW safe to clear all intermediate heavy objects (tensors, arrays, large dicts)
@@ -226,7 +325,5 @@ def identify_v2(
     del candidates
     del top_candidates
     del template_rows
-    import gc
-    gc.collect()  # Only after we've dropped all references
-    
+
     return result
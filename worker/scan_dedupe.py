@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Idempotent scan processing keyed on the uploaded image bytes.
+
+A scan that finishes successfully is stamped with the SHA-256 of its image
+(``scans.content_sha256``, migration 20251030060000_scan_content_hash.sql). When
+the same user sends the same bytes again, whether as a duplicate upload or as a retry
+of a job that already wrote its results, the worker copies the earlier scan's
+detections and user_cards links instead of re-running detection and embedding.
+Lookups never cross users: a detection row carries its owner's manual corrections
+and points at crops in their scan. Crops and the
+summary image are shared with the source scan, not re-uploaded.
+
+Set ``force_reprocess`` in the job payload (the retry route does) or
+``SCAN_CONTENT_DEDUPE=0`` to always run the full pipeline.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Columns that identify a detection row rather than describe it; regenerated on clone
+_DETECTION_IDENTITY_COLUMNS = ("id", "scan_id", "bbox_hash", "created_at", "updated_at")
+
+
+def compute_bbox_hash(scan_id: str, bbox: List[int]) -> str:
+    base = f"{scan_id}:{bbox[0]}:{bbox[1]}:{bbox[2]}:{bbox[3]}"
+    return hashlib.md5(base.encode("utf-8")).hexdigest()
+
+
+def content_hash(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def find_completed_scan(supabase_client, content_sha256: str, scan_id: str, user_id: str) -> Optional[Dict]:
+    """
+    Most recent scan whose results can be reused for these bytes: any of ``user_id``'s
+    ``ready`` scans with the same hash, or ``scan_id`` itself if an earlier attempt already finished
+    (its status was reset to processing when this attempt started).
+    """
+    try:
+        response = (
+            supabase_client.from_("scans")
+            .select("id, status, summary_image_path")
+            .eq("content_sha256", content_sha256)
+            .eq("user_id", user_id)
+            .order("created_at", desc=True)
+            .limit(10)
+            .execute()
+        )
+    except Exception as e:
+        logger.warning(f"[WARN] Content-hash lookup failed, processing normally: {e}")
+        return None
+    for row in response.data or []:
+        if row.get("id") == scan_id or row.get("status") == "ready":
+            return row
+    return None
+
+
+def record_content_hash(supabase_client, scan_id: str, content_sha256: Optional[str]) -> None:
+    """Stamp (or with None, clear) the hash of a scan's image. Best effort."""
+    try:
+        supabase_client.from_("scans").update({"content_sha256": content_sha256}).eq("id", scan_id).execute()
+    except Exception as e:
+        logger.warning(f"[WARN] Could not record content hash for scan {scan_id}: {e}")
+
+
+def clone_scan_results(supabase_client, source_scan: Dict, scan_id: str, user_id: str) -> Dict:
+    """
+    Copy ``source_scan``'s detections into ``scan_id`` and link them to ``user_id``'s
+    collection. If ``source_scan`` is ``scan_id`` itself, the existing rows are returned
+    as they are. Returns the same summary dict as a full pipeline run.
+    """
+    source_id = source_scan["id"]
+    source_rows = (
+        supabase_client.from_("card_detections").select("*").eq("scan_id", source_id).execute().data or []
+    )
+
+    if source_id == scan_id:
+        detections = source_rows
+    else:
+        payload = []
+        for row in source_rows:
+            cloned = {k: v for k, v in row.items() if k not in _DETECTION_IDENTITY_COLUMNS}
+            cloned["scan_id"] = scan_id
+            cloned["bbox_hash"] = compute_bbox_hash(scan_id, row["bbox"])
+            payload.append(cloned)
+        detections = []
+        if payload:
+            detections = (
+                supabase_client.from_("card_detections")
+                .upsert(payload, on_conflict="scan_id,bbox_hash")
+                .execute()
+                .data or []
+            )
+            if len(detections) != len(payload):
+                raise ValueError(f"Cloned {len(detections)} of {len(payload)} detections from scan {source_id}")
+
+    # One row per card: a batch upsert may not touch the same (user_id, card_id) twice.
+    # The last detection wins, as with the pipeline's per-detection upserts.
+    identified = [d for d in detections if d.get("guess_card_id")]
+    user_cards = {
+        d["guess_card_id"]: {"user_id": user_id, "detection_id": d["id"], "card_id": d["guess_card_id"], "condition": "unknown"}
+        for d in identified
+    }
+    if user_cards and source_id != scan_id:
+        supabase_client.from_("user_cards").upsert(list(user_cards.values()), on_conflict="user_id,card_id").execute()
+
+    summary_path = source_scan.get("summary_image_path")
+    update = {"status": "ready", "progress": 100.0}
+    if summary_path:
+        update["summary_image_path"] = summary_path
+    supabase_client.from_("scans").update(update).eq("id", scan_id).execute()
+
+    return {
+        "scan_id": scan_id,
+        "total_detections": len(detections),
+        "user_cards_created": len(identified),
+        "detection_records": [d["id"] for d in detections],
+        "summary_image_path": summary_path,
+        "status": "ready",
+        "cloned_from_scan_id": source_id,
+    }
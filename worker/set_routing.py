@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Hierarchical set -> card retrieval (``RETRIEVAL_SEARCH=hierarchical``).
+
+``card_set_centroids`` holds one L2-normalized mean prototype per set. The table
+is a few hundred rows, so ``SetCentroids`` keeps it in memory as one matrix and
+scores a query against every set with a single matrix-vector product. Retrieval
+then searches only the templates of the best ``SET_ROUTING_TOP_SETS`` sets
+(``match_card_templates_in_sets``). That work grows with the size of the chosen
+sets, not the whole gallery. ``retrieval_v2`` falls back to the global search
+when routing is unavailable or the routed match is weak.
+"""
+from __future__ import annotations
+
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from config import SET_CENTROID_REFRESH_SECONDS, SET_ROUTING_TOP_SETS
+    from stage_timing import span
+    from table_cache import TableCache
+    from vector_codec import format_vector, parse_vector
+except ImportError:  # imported as worker.set_routing from scripts
+    from worker.config import SET_CENTROID_REFRESH_SECONDS, SET_ROUTING_TOP_SETS
+    from worker.stage_timing import span
+    from worker.table_cache import TableCache
+    from worker.vector_codec import format_vector, parse_vector
+
+
+def set_of(card_id: str, set_id: Optional[str]) -> Optional[str]:
+    """A prototype's set, falling back to the ``<set>-<number>`` card id prefix (as build_prototypes does)."""
+    if set_id:
+        return set_id
+    if card_id and "-" in card_id:
+        return card_id.split("-", 1)[0]
+    return None
+
+
+def compute_set_centroids(prototype_rows: Iterable[Dict]) -> List[Dict]:
+    """``card_set_centroids`` rows (normalized mean prototype per set) from ``card_prototypes`` rows."""
+    sums: Dict[str, np.ndarray] = {}
+    counts: Dict[str, int] = {}
+    for row in prototype_rows:
+        set_id = set_of(row.get("card_id"), row.get("set_id"))
+        vec = parse_vector(row.get("emb"))
+        if set_id is None or vec is None:
+            continue
+        if set_id in sums:
+            sums[set_id] += vec
+        else:
+            sums[set_id] = vec.astype(np.float64)
+        counts[set_id] = counts.get(set_id, 0) + 1
+    now = datetime.now(timezone.utc).isoformat()
+    records = []
+    for set_id, total in sorted(sums.items()):
+        norm = np.linalg.norm(total)
+        if not np.isfinite(norm) or norm <= 0:
+            continue
+        records.append({
+            "set_id": set_id,
+            "emb": (total / norm).astype(np.float32).tolist(),
+            "card_count": counts[set_id],
+            "updated_at": now,
+        })
+    return records
+
+
+class SetCentroids(TableCache):
+    """In-memory ``card_set_centroids``: an (n_sets, dim) matrix, reloaded at most every ``refresh_seconds``."""
+
+    table = "card_set_centroids"
+    columns = "set_id, emb"
+
+    def __init__(self, refresh_seconds: float = SET_CENTROID_REFRESH_SECONDS, clock=time.monotonic):
+        super().__init__(refresh_seconds, clock)
+        self.set_ids: List[str] = []
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+
+    def load_rows(self, rows: Iterable[Dict]) -> None:
+        ids, vecs = [], []
+        for row in rows:
+            vec = parse_vector(row.get("emb"))
+            if row.get("set_id") and vec is not None:
+                ids.append(row["set_id"])
+                vecs.append(vec)
+        self.set_ids = ids
+        self.matrix = np.vstack(vecs).astype(np.float32) if vecs else np.zeros((0, 0), dtype=np.float32)
+
+    def describe(self) -> str:
+        return f"{len(self.set_ids)} set centroids"
+
+    def top_sets(self, query_vec: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        """The ``k`` sets whose centroid is closest to the query, best first."""
+        if not self.set_ids or k <= 0:
+            return []
+        scores = self.matrix @ np.asarray(query_vec, dtype=np.float32)
+        k = min(k, len(self.set_ids))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(self.set_ids[i], float(scores[i])) for i in best]
+
+
+set_centroids = SetCentroids()
+
+
+def route(query_vec: np.ndarray, supabase_client, top_sets: int = SET_ROUTING_TOP_SETS,
+          centroids: Optional[SetCentroids] = None) -> List[str]:
+    """Set ids to search for this query (empty when no centroids are available)."""
+    centroids = centroids if centroids is not None else set_centroids
+    centroids.refresh(supabase_client)
+    return [set_id for set_id, _ in centroids.top_sets(query_vec, top_sets)]
+
+
+def match_templates_in_sets(query_vec: np.ndarray, supabase_client, set_ids: List[str], topk: int) -> List[Dict]:
+    """Template rows (same shape as ``match_card_templates``) restricted to ``set_ids``."""
+    with span("template_rpc"):
+        response = supabase_client.rpc(
+            "match_card_templates_in_sets",
+            {"qvec": format_vector(query_vec), "set_ids": list(set_ids), "match_count": int(topk)},
+        ).execute()
+    return response.data or []
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Read-only model weights shared between worker processes through the page cache.
+
+``torch.load``/open_clip copy a checkpoint into each process's private heap, so
+two workers on one host hold two copies of ViT-L/14. Here the weights are written
+once to a safetensors file and every process maps it with ``MAP_PRIVATE``
+(copy-on-write): tensors are views straight into the mapping, pages are only read
+from disk once and are shared by all processes on the host, and nothing is copied
+unless a process writes to a weight (none do in inference).
+
+The safetensors format (8-byte little-endian header length, JSON header, raw
+tensor bytes) is read and written directly, so neither the ``safetensors``
+package nor torch is needed to parse it; ``mmap_state_dict`` wraps the arrays as
+torch tensors without copying.
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Dict, Mapping, Optional, Tuple
+
+import numpy as np
+
+# safetensors dtype tag -> numpy dtype. BF16 has no numpy dtype; it is carried as
+# uint16 and reinterpreted by mmap_state_dict.
+_NUMPY_DTYPES = {
+    "F64": np.float64, "F32": np.float32, "F16": np.float16, "BF16": np.uint16,
+    "I64": np.int64, "I32": np.int32, "I16": np.int16, "I8": np.int8, "U8": np.uint8, "BOOL": np.bool_,
+}
+_TAGS = {np.dtype(v): k for k, v in _NUMPY_DTYPES.items() if k != "BF16"}
+_ALIGN = 8
+
+
+def visual_weights_path(cache_dir: str, model_name: str, pretrained: str) -> Path:
+    """Where the shared visual-tower weights for a model/checkpoint pair live."""
+    return Path(cache_dir) / f"{model_name}-{pretrained}.visual.safetensors"
+
+
+def write_safetensors(path: Path, arrays: Mapping[str, np.ndarray], metadata: Optional[Dict[str, str]] = None,
+                      dtype_tags: Optional[Mapping[str, str]] = None) -> None:
+    """Write ``arrays`` as a safetensors file, atomically (temp file + rename)."""
+    path = Path(path)
+    header: Dict[str, Dict] = {"__metadata__": dict(metadata or {})}
+    offset = 0
+    ordered = []
+    # Widest dtypes first: tensors stay contiguous (as the format requires) and every
+    # one starts at a multiple of its item size, so it can be viewed in place
+    for name, array in sorted(arrays.items(), key=lambda kv: -np.asarray(kv[1]).dtype.itemsize):
+        array = np.ascontiguousarray(array)
+        tag = (dtype_tags or {}).get(name) or _TAGS[array.dtype]
+        header[name] = {"dtype": tag, "shape": list(array.shape), "data_offsets": [offset, offset + array.nbytes]}
+        offset += array.nbytes
+        ordered.append(array)
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    header_bytes += b" " * (-len(header_bytes) % _ALIGN)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}-", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(struct.pack("<Q", len(header_bytes)))
+            handle.write(header_bytes)
+            for array in ordered:
+                handle.write(array.tobytes())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def read_header(path: Path) -> Tuple[int, Dict[str, Dict]]:
+    """``(data_start, header)`` of a safetensors file."""
+    with open(path, "rb") as handle:
+        (length,) = struct.unpack("<Q", handle.read(8))
+        header = json.loads(handle.read(length))
+    return 8 + length, header
+
+
+def mmap_arrays(path: Path) -> Tuple[Dict[str, np.ndarray], Dict[str, str], Dict[str, str]]:
+    """
+    Map ``path`` copy-on-write and return ``(arrays, dtype_tags, metadata)``. The
+    arrays are views into the mapping (no copy) and keep it alive.
+    """
+    data_start, header = read_header(path)
+    metadata = header.pop("__metadata__", None) or {}
+    with open(path, "rb") as handle:
+        mapping = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_COPY)
+    arrays: Dict[str, np.ndarray] = {}
+    tags: Dict[str, str] = {}
+    for name, entry in header.items():
+        start, end = entry["data_offsets"]
+        dtype = np.dtype(_NUMPY_DTYPES[entry["dtype"]])
+        count = (end - start) // dtype.itemsize
+        arrays[name] = np.frombuffer(mapping, dtype=dtype, count=count, offset=data_start + start).reshape(entry["shape"])
+        tags[name] = entry["dtype"]
+    return arrays, tags, metadata
+
+
+def export_state_dict(state_dict: Mapping, path: Path, metadata: Optional[Dict[str, str]] = None) -> None:
+    """Write a torch ``state_dict`` (CPU, any float/int dtype incl. bf16) to ``path``."""
+    import torch
+
+    arrays: Dict[str, np.ndarray] = {}
+    tags: Dict[str, str] = {}
+    for name, tensor in state_dict.items():
+        tensor = tensor.detach().to("cpu").contiguous()
+        if tensor.dtype == torch.bfloat16:
+            arrays[name], tags[name] = tensor.view(torch.int16).numpy().view(np.uint16), "BF16"
+        else:
+            arrays[name] = tensor.numpy()
+    write_safetensors(path, arrays, metadata=metadata, dtype_tags=tags)
+
+
+def mmap_state_dict(path: Path) -> Tuple[Dict, Dict[str, str]]:
+    """``(state_dict, metadata)`` of torch tensors backed by a shared mapping of ``path``."""
+    import torch
+
+    arrays, tags, metadata = mmap_arrays(path)
+    state_dict = {}
+    for name, array in arrays.items():
+        tensor = torch.from_numpy(array)
+        if tags[name] == "BF16":
+            tensor = tensor.view(torch.int16).view(torch.bfloat16)
+        state_dict[name] = tensor
+    return state_dict, metadata
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Graceful SIGTERM/SIGINT handling for rolling deploys.
+
+On the first signal the worker stops claiming jobs and gives the in-flight job
+``WORKER_DRAIN_GRACE_SECONDS`` to finish. If it is still running at the deadline,
+its lease is released back to ``pending`` (no retry consumed) so another worker
+can pick it up immediately instead of waiting out the lease. A second signal
+releases at once and exits.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Render sends SIGTERM and kills the process 30s later by default
+WORKER_DRAIN_GRACE_SECONDS = float(os.getenv("WORKER_DRAIN_GRACE_SECONDS", "25"))
+
+
+class GracefulShutdown:
+    def __init__(self, grace_seconds: float = WORKER_DRAIN_GRACE_SECONDS, clock=time.monotonic):
+        self.grace_seconds = max(float(grace_seconds), 0.0)
+        self._clock = clock
+        self._draining = threading.Event()
+        self._lock = threading.RLock()  # re-entered when a signal lands while the main thread holds it
+        self._lease = None  # JobLease of the in-flight job, if any
+        self._timer: Optional[threading.Timer] = None
+        self.deadline: Optional[float] = None
+        self.signals_received = 0
+
+    @property
+    def draining(self) -> bool:
+        return self._draining.is_set()
+
+    def install(self, signals=(signal.SIGTERM, signal.SIGINT)) -> "GracefulShutdown":
+        for sig in signals:
+            signal.signal(sig, self._handle_signal)
+        return self
+
+    def _handle_signal(self, signum, frame) -> None:  # noqa: ARG002 - signal API
+        self.signals_received += 1
+        if self.signals_received > 1:
+            logger.warning("[DRAIN] Second signal received, releasing in-flight job and exiting now")
+            self.release_in_flight()
+            raise SystemExit(128 + signum)
+        self.request(reason=signal.Signals(signum).name)
+
+    def request(self, reason: str = "shutdown") -> None:
+        """Start draining: no new claims; release the in-flight job after the grace period."""
+        if self._draining.is_set():
+            return
+        self.deadline = self._clock() + self.grace_seconds
+        self._draining.set()
+        with self._lock:
+            in_flight = self._lease is not None
+            if in_flight:
+                self._start_timer()
+        if in_flight:
+            logger.info(f"[DRAIN] {reason}: finishing in-flight job (grace {self.grace_seconds:.0f}s), no new claims")
+        else:
+            logger.info(f"[DRAIN] {reason}: idle, exiting")
+
+    def _start_timer(self) -> None:
+        remaining = max((self.deadline or self._clock()) - self._clock(), 0.0)
+        self._timer = threading.Timer(remaining, self.release_in_flight)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def release_in_flight(self) -> bool:
+        """Release the in-flight job's lease (called at the grace deadline)."""
+        with self._lock:
+            lease, self._lease = self._lease, None
+        if lease is None:
+            return False
+        released = lease.release()
+        if released:
+            logger.warning(f"[DRAIN] Grace period over; released job {lease.job_id} back to the queue (retry not consumed)")
+        return released
+
+    @contextmanager
+    def track(self, lease) -> Iterator[None]:
+        """Register ``lease`` as the in-flight job for the duration of the block."""
+        with self._lock:
+            self._lease = lease
+            if self._draining.is_set() and lease is not None and self._timer is None:
+                self._start_timer()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._lease = None
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+
+    def wait(self, seconds: float) -> bool:
+        """Sleep up to ``seconds`` unless draining starts. Returns True when draining."""
+        return self._draining.wait(seconds)
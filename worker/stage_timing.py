@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Lightweight per-stage latency tracing for the scan pipeline.
+
+Code wraps each stage in ``with span("yolo"):``. Every span is recorded twice:
+
+* in a process-wide HDR-style histogram per stage (log-linear buckets, ~4%
+  relative error, fixed memory no matter how many samples), which is periodically
+  flushed as p50/p95/p99 summaries by ``maybe_flush``;
+* in the current job's ``JobTrace`` (set with ``job_trace``), whose ``breakdown()``
+  is attached to the per-job result JSON together with the highest RSS seen at the
+  end of each stage.
+
+Stages used by the worker: claim, download, dedupe, decode, exif_transpose, resize,
+yolo, crop_encode, crop_gate, upload, embed, embed_view, template_rpc, prototype_rpc, fusion, confusion_rerank,
+resolve_uuid, db_write, summary_render, summary_upload, identify, memory_reclaim, job_total.
+"""
+from __future__ import annotations
+
+import contextvars
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STAGE_TIMING_FLUSH_SECONDS = float(os.getenv("STAGE_TIMING_FLUSH_SECONDS", "300"))
+DEFAULT_SUMMARY_PATH = Path(__file__).parent / "output" / "stage_latency.json"
+
+
+class LatencyHistogram:
+    """
+    Log-linear latency histogram (HDR-style).
+
+    Values are bucketed at ``2 ** (1 / BUCKETS_PER_OCTAVE)`` ratio steps from 1 µs,
+    so any reported percentile is within ~4.4% of the true value while storage is
+    a small sparse dict of bucket counts.
+    """
+
+    BUCKETS_PER_OCTAVE = 8
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = math.inf
+        self.max_ms = 0.0
+
+    @classmethod
+    def bucket_index(cls, value_ms: float) -> int:
+        micros = value_ms * 1000.0
+        if micros <= 1.0:
+            return 0
+        return int(math.log2(micros) * cls.BUCKETS_PER_OCTAVE) + 1
+
+    @classmethod
+    def bucket_upper_ms(cls, index: int) -> float:
+        """Upper bound (ms) of bucket ``index``."""
+        return (2.0 ** (index / cls.BUCKETS_PER_OCTAVE)) / 1000.0
+
+    def record(self, value_ms: float) -> None:
+        value_ms = max(float(value_ms), 0.0)
+        idx = self.bucket_index(value_ms)
+        self.counts[idx] = self.counts.get(idx, 0) + 1
+        self.count += 1
+        self.total_ms += value_ms
+        self.min_ms = min(self.min_ms, value_ms)
+        self.max_ms = max(self.max_ms, value_ms)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        for idx, n in other.counts.items():
+            self.counts[idx] = self.counts.get(idx, 0) + n
+        self.count += other.count
+        self.total_ms += other.total_ms
+        self.min_ms = min(self.min_ms, other.min_ms)
+        self.max_ms = max(self.max_ms, other.max_ms)
+
+    def percentile(self, q: float) -> float:
+        """Approximate q-th percentile (0..100) in ms."""
+        if self.count == 0:
+            return 0.0
+        rank = max(1, math.ceil(q / 100.0 * self.count))
+        seen = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            if seen >= rank:
+                if idx == 0:
+                    return min(self.max_ms, 0.001)
+                # Geometric midpoint of the bucket, clamped to observed range
+                mid = math.sqrt(self.bucket_upper_ms(idx - 1) * self.bucket_upper_ms(idx))
+                return min(max(mid, self.min_ms), self.max_ms)
+        return self.max_ms
+
+    def cumulative_buckets(self) -> List[Tuple[float, int]]:
+        """``[(upper_bound_ms, cumulative_count), ...]`` in ascending order."""
+        out: List[Tuple[float, int]] = []
+        running = 0
+        for idx in sorted(self.counts):
+            running += self.counts[idx]
+            out.append((self.bucket_upper_ms(idx), running))
+        return out
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50), 3),
+            "p95_ms": round(self.percentile(95), 3),
+            "p99_ms": round(self.percentile(99), 3),
+            "max_ms": round(self.max_ms, 3),
+        }
+
+
+class JobTrace:
+    """Per-job stage timings (count, total and max per stage)."""
+
+    def __init__(self, job_id: Optional[str] = None):
+        self.job_id = job_id
+        self.started = time.perf_counter()
+        self.stages: Dict[str, Dict[str, float]] = {}
+        # Innermost open span; left pointing at the failing stage when a span raises
+        self.active_stage: Optional[str] = None
+
+    def record(self, stage: str, elapsed_ms: float, rss_bytes: Optional[int] = None) -> None:
+        entry = self.stages.setdefault(stage, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        entry["count"] += 1
+        entry["total_ms"] += elapsed_ms
+        entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+        if rss_bytes is not None:
+            entry["rss_max_bytes"] = max(entry.get("rss_max_bytes", 0), rss_bytes)
+
+    def breakdown(self) -> Dict:
+        return {
+            "wall_ms": round((time.perf_counter() - self.started) * 1000.0, 3),
+            "stages": {
+                name: {
+                    "count": int(v["count"]),
+                    "total_ms": round(v["total_ms"], 3),
+                    "max_ms": round(v["max_ms"], 3),
+                    **({"rss_max_mb": round(v["rss_max_bytes"] / 2**20, 1)} if "rss_max_bytes" in v else {}),
+                }
+                for name, v in sorted(self.stages.items(), key=lambda kv: -kv[1]["total_ms"])
+            },
+        }
+
+
+class StageRegistry:
+    """Process-wide histograms, one per stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._last_flush = time.monotonic()
+
+    def record(self, stage: str, elapsed_ms: float) -> None:
+        with self._lock:
+            hist = self._histograms.get(stage)
+            if hist is None:
+                hist = self._histograms[stage] = LatencyHistogram()
+            hist.record(elapsed_ms)
+
+    def snapshot(self) -> Dict[str, LatencyHistogram]:
+        """Copy of every histogram (safe to read without the lock)."""
+        with self._lock:
+            copies = {}
+            for name, hist in self._histograms.items():
+                copy = LatencyHistogram()
+                copy.merge(hist)
+                copies[name] = copy
+            return copies
+
+    def summaries(self) -> Dict[str, Dict[str, float]]:
+        return {name: hist.summary() for name, hist in sorted(self.snapshot().items())}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._last_flush = time.monotonic()
+
+    def maybe_flush(self, interval_seconds: float = STAGE_TIMING_FLUSH_SECONDS, path: Optional[Path] = DEFAULT_SUMMARY_PATH, force: bool = False) -> bool:
+        """Log (and write to ``path``) per-stage summaries if ``interval_seconds`` elapsed."""
+        now = time.monotonic()
+        if not force and now - self._last_flush < interval_seconds:
+            return False
+        self._last_flush = now
+        summaries = self.summaries()
+        if not summaries:
+            return False
+        for name, s in summaries.items():
+            logger.info(
+                f"[STAGES] {name:<15} n={s['count']:<6} p50={s['p50_ms']:.1f}ms "
+                f"p95={s['p95_ms']:.1f}ms p99={s['p99_ms']:.1f}ms max={s['max_ms']:.1f}ms"
+            )
+        if path is not None:
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(prefix=".stages-", dir=str(path.parent))
+                with os.fdopen(fd, "w") as handle:
+                    json.dump({"updated_at": time.time(), "stages": summaries}, handle, indent=2)
+                os.replace(tmp, path)
+            except OSError as e:
+                logger.warning(f"[WARN] Could not write stage summary to {path}: {e}")
+        return True
+
+
+registry = StageRegistry()
+_current_trace: contextvars.ContextVar[Optional[JobTrace]] = contextvars.ContextVar("job_trace", default=None)
+
+
+def resident_memory_bytes() -> Optional[int]:
+    """Current RSS from /proc (Linux); peak RSS via getrusage elsewhere."""
+    try:
+        with open("/proc/self/statm", "r") as handle:
+            return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        import sys
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return int(peak if sys.platform == "darwin" else peak * 1024)
+    except Exception:
+        return None
+
+
+def record(stage: str, elapsed_ms: float) -> None:
+    """Record an externally measured duration for ``stage``."""
+    registry.record(stage, elapsed_ms)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.record(stage, elapsed_ms, resident_memory_bytes())
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time the enclosed block as ``stage`` (recorded even if it raises)."""
+    trace = _current_trace.get()
+    outer = trace.active_stage if trace is not None else None
+    if trace is not None:
+        trace.active_stage = stage
+    started = time.perf_counter()
+    try:
+        yield
+        if trace is not None:
+            trace.active_stage = outer  # not reached on error: the trace keeps the failing stage
+    finally:
+        record(stage, (time.perf_counter() - started) * 1000.0)
+
+
+@contextmanager
+def job_trace(job_id: Optional[str] = None) -> Iterator[JobTrace]:
+    """Make a fresh JobTrace current for the enclosed block; records ``job_total`` on exit."""
+    trace = JobTrace(job_id)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        registry.record("job_total", (time.perf_counter() - trace.started) * 1000.0)
+
+
+def current_trace() -> Optional[JobTrace]:
+    return _current_trace.get()
+
+
+def maybe_flush(force: bool = False) -> bool:
+    return registry.maybe_flush(force=force)
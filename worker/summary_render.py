@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Background rendering of the scan summary preview (detected cards boxed and numbered).
+
+The summary is only a UI preview, so it is kept off the user-visible path: the
+pipeline marks the scan ready first and then ``submit``s the detection-sized
+image and boxes here. A single background thread downsizes it to at most
+``SUMMARY_MAX_SIDE`` pixels, draws the boxes, uploads ``<scan_id>/summary.jpeg``
+and patches ``scans.summary_image_path``. A failed render only leaves the scan
+without a preview.
+
+A scan cloned from an earlier one (scan_dedupe) shares that scan's preview.
+When the source's render has not landed yet, ``submit_link`` queues a copy of its
+path behind any render already queued, so it runs after this process's pending
+render of the source.
+"""
+from __future__ import annotations
+
+import io
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import List, Optional, Sequence
+
+from PIL import Image, ImageDraw, ImageFont
+
+from config import STORAGE_BUCKET, SUMMARY_JPEG_QUALITY, SUMMARY_MAX_SIDE
+from stage_timing import span
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_pending: List[Future] = []
+_lock = threading.Lock()
+
+
+def summary_path_for(scan_id: str) -> str:
+    return f"{scan_id}/summary.jpeg"
+
+
+def render_summary(image: Image.Image, boxes: Sequence[Sequence[float]], max_side: int = SUMMARY_MAX_SIDE,
+                   quality: int = SUMMARY_JPEG_QUALITY) -> bytes:
+    """
+    JPEG preview of ``image`` with ``boxes`` ([x1, y1, x2, y2] in ``image``'s pixel
+    coordinates) outlined and numbered in order. ``image`` is not modified.
+    """
+    w, h = image.size
+    factor = min(1.0, max_side / max(w, h)) if max_side > 0 else 1.0
+    if factor < 1.0:
+        preview = image.resize((max(1, round(w * factor)), max(1, round(h * factor))), Image.Resampling.BILINEAR)
+    else:
+        preview = image.copy()
+    if preview.mode != "RGB":
+        preview = preview.convert("RGB")
+
+    draw = ImageDraw.Draw(preview)
+    font = ImageFont.load_default()
+    for i, box in enumerate(boxes):
+        x1, y1, x2, y2 = (c * factor for c in box)
+        draw.rectangle((x1, y1, x2, y2), outline="red", width=2)
+        draw.text((x1 + 4, y1 + 4), f"Card {i+1}", fill="red", font=font)
+
+    buffer = io.BytesIO()
+    preview.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def publish_summary(supabase_client, scan_id: str, image: Image.Image, boxes: Sequence[Sequence[float]]) -> Optional[str]:
+    """Render, upload and link the summary for ``scan_id``. Returns its storage path, None on failure."""
+    path = summary_path_for(scan_id)
+    try:
+        with span("summary_render"):
+            data = render_summary(image, boxes)
+        with span("summary_upload"):
+            supabase_client.storage.from_(STORAGE_BUCKET).upload(
+                path=path, file=data,
+                file_options={"content-type": "image/jpeg", "upsert": "true"}
+            )
+        supabase_client.from_("scans").update({"summary_image_path": path}).eq("id", scan_id).execute()
+    except Exception as e:
+        logger.warning(f"[WARN] Summary image for scan {scan_id} failed: {e}")
+        return None
+    logger.info(f"[OK] Summary image uploaded for scan {scan_id} ({len(data) / 1024:.0f} KB)")
+    return path
+
+
+def link_summary(supabase_client, scan_id: str, source_scan_id: str) -> Optional[str]:
+    """Point ``scan_id`` at ``source_scan_id``'s summary. Returns the path, None if the source has none."""
+    try:
+        rows = (
+            supabase_client.from_("scans").select("summary_image_path").eq("id", source_scan_id).execute()
+        ).data or []
+        path = rows[0].get("summary_image_path") if rows else None
+        if path:
+            supabase_client.from_("scans").update({"summary_image_path": path}).eq("id", scan_id).execute()
+    except Exception as e:
+        logger.warning(f"[WARN] Summary image link for scan {scan_id} failed: {e}")
+        return None
+    if not path:
+        logger.warning(f"[WARN] Scan {source_scan_id} has no summary image to share with scan {scan_id}")
+    return path
+
+
+def _submit(fn, *args) -> Future:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary-render")
+        future = _executor.submit(fn, *args)
+        _pending[:] = [f for f in _pending if not f.done()] + [future]
+    return future
+
+
+def submit(supabase_client, scan_id: str, image: Image.Image, boxes: Sequence[Sequence[float]]) -> Future:
+    """Queue ``publish_summary`` on the background thread."""
+    return _submit(publish_summary, supabase_client, scan_id, image, [list(b) for b in boxes])
+
+
+def submit_link(supabase_client, scan_id: str, source_scan_id: str) -> Future:
+    """Queue ``link_summary`` behind the renders already queued (including the source's, if pending here)."""
+    return _submit(link_summary, supabase_client, scan_id, source_scan_id)
+
+
+def wait_pending(timeout: Optional[float] = None) -> bool:
+    """Block until queued summaries finish (e.g. before exiting). True if none are left."""
+    with _lock:
+        pending = list(_pending)
+    _, not_done = wait(pending, timeout=timeout)
+    return not not_done
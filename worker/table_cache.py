@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Small Supabase tables mirrored in worker memory.
+
+``TableCache`` reads a whole table through PostgREST in ``PAGE_SIZE`` pages and
+reloads it at most every ``refresh_seconds`` (on the next ``refresh`` call, under
+a lock, with an injectable clock for tests). A failed reload keeps serving the
+previous data. Subclasses name the table and columns, optionally narrow the
+query, and turn the rows into their in-memory form in ``load_rows``.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 1000  # PostgREST max rows per request
+
+
+class TableCache:
+    table = ""
+    columns = "*"
+
+    def __init__(self, refresh_seconds: float, clock=time.monotonic):
+        self.refresh_seconds = refresh_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._loaded_at: Optional[float] = None
+
+    def filter(self, query):
+        """Narrow the select (e.g. ``.gte(...)``); the default reads every row."""
+        return query
+
+    def load_rows(self, rows: Iterable[Dict]) -> None:
+        """Replace the in-memory data with ``rows``."""
+        raise NotImplementedError
+
+    def describe(self) -> str:
+        """What is loaded, for log lines (e.g. ``"412 set centroids"``)."""
+        raise NotImplementedError
+
+    def fetch(self, supabase_client) -> List[Dict]:
+        rows: List[Dict] = []
+        start = 0
+        while True:
+            query = self.filter(supabase_client.from_(self.table).select(self.columns))
+            page = query.range(start, start + PAGE_SIZE - 1).execute().data or []
+            rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                return rows
+            start += PAGE_SIZE
+
+    def refresh(self, supabase_client, force: bool = False) -> None:
+        """Reload when stale; a failed load keeps the previous data."""
+        with self._lock:
+            now = self._clock()
+            if not force and self._loaded_at is not None and now - self._loaded_at < self.refresh_seconds:
+                return
+            self._loaded_at = now
+            try:
+                self.load_rows(self.fetch(supabase_client))
+                logger.info(f"[CACHE] Loaded {self.describe()} from {self.table}")
+            except Exception as e:
+                logger.warning(f"[WARN] {self.table} refresh failed, keeping {self.describe()}: {e}")
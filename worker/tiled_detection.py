@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Tiled (two-level pyramid) YOLO detection for high-resolution binder photos.
+
+A single pass squeezes a 12-48 MP page into one ``MAX_IMAGE_SIZE`` image, which
+YOLO letterboxes again, so each card ends up only a few hundred pixels wide.
+In tiled mode the page is also cut into an overlapping grid whose size follows
+the photo's resolution (``plan_tiles``). The downscaled full page plus every
+tile go through YOLO as one batch. Boxes are mapped back to page coordinates
+and merged with cross-tile NMS (``merge_boxes``).
+
+Overlap is a fraction of the tile, large enough that a card in a 3x3 pocket
+page lies whole inside at least one tile. Fragments cut by an interior tile
+edge lose to whole boxes of the same card, which are matched by IoU or by
+intersection-over-smaller.
+"""
+from __future__ import annotations
+
+import math
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+try:
+    from config import DETECT_TILE_INPUT, DETECT_TILE_MAX_GRID, DETECT_TILE_OVERLAP, DETECT_TILE_SIDE
+except ImportError:  # imported as worker.tiled_detection from scripts
+    from worker.config import DETECT_TILE_INPUT, DETECT_TILE_MAX_GRID, DETECT_TILE_OVERLAP, DETECT_TILE_SIDE
+
+Tile = Tuple[int, int, int, int]  # x0, y0, x1, y1 in page pixels
+Box = Tuple[float, float, float, float, float]  # x1, y1, x2, y2, confidence
+
+MERGE_IOU = 0.5
+MERGE_IOS = 0.7  # a box mostly inside a larger one is the same card seen through a tile edge
+EDGE_MARGIN_PX = 4
+
+
+def _axis_tiles(length: int, cells: int, overlap: float) -> List[Tuple[int, int]]:
+    if cells <= 1:
+        return [(0, length)]
+    extent = min(length, int(math.ceil(length / cells * (1.0 + overlap))))
+    stride = (length - extent) / (cells - 1)
+    return [(int(round(k * stride)), int(round(k * stride)) + extent) for k in range(cells)]
+
+
+def plan_tiles(size: Tuple[int, int], tile_side: int = DETECT_TILE_SIDE, overlap: float = DETECT_TILE_OVERLAP,
+               max_grid: int = DETECT_TILE_MAX_GRID) -> List[Tile]:
+    """
+    Overlapping grid for an image of ``size``: ``ceil(side / tile_side)`` cells per
+    axis, capped at ``max_grid``. Empty when one cell per axis would do, i.e. the
+    single downscaled pass already sees the page at full detail.
+    """
+    w, h = size
+    cols = max(1, min(max_grid, math.ceil(w / tile_side)))
+    rows = max(1, min(max_grid, math.ceil(h / tile_side)))
+    if cols == 1 and rows == 1:
+        return []
+    return [(x0, y0, x1, y1) for y0, y1 in _axis_tiles(h, rows, overlap) for x0, x1 in _axis_tiles(w, cols, overlap)]
+
+
+def _pairwise_overlap(box: np.ndarray, others: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    ix1 = np.maximum(box[0], others[:, 0])
+    iy1 = np.maximum(box[1], others[:, 1])
+    ix2 = np.minimum(box[2], others[:, 2])
+    iy2 = np.minimum(box[3], others[:, 3])
+    inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (others[:, 2] - others[:, 0]) * (others[:, 3] - others[:, 1])
+    iou = inter / np.maximum(area + areas - inter, 1e-9)
+    ios = inter / np.maximum(np.minimum(area, areas), 1e-9)
+    return iou, ios
+
+
+def merge_boxes(boxes: Sequence[Box], clipped: Sequence[bool], iou_threshold: float = MERGE_IOU,
+                ios_threshold: float = MERGE_IOS) -> List[int]:
+    """
+    Cross-tile NMS. Whole boxes outrank boxes cut by an interior tile edge, then
+    higher confidence wins; a box is dropped when it overlaps a kept one by IoU or
+    intersection-over-smaller. Returns the indices kept, best first.
+    """
+    if not boxes:
+        return []
+    arr = np.asarray([b[:4] for b in boxes], dtype=np.float64)
+    order = sorted(range(len(boxes)), key=lambda i: (bool(clipped[i]), -boxes[i][4]))
+    kept: List[int] = []
+    for i in order:
+        if kept:
+            iou, ios = _pairwise_overlap(arr[i], arr[kept])
+            if np.any(iou >= iou_threshold) or np.any(ios >= ios_threshold):
+                continue
+        kept.append(i)
+    return kept
+
+
+def _fit(image: Image.Image, max_side: int) -> Tuple[Image.Image, float]:
+    w, h = image.size
+    if max(w, h) <= max_side:
+        return image, 1.0
+    scale = max_side / max(w, h)
+    return image.resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.Resampling.BILINEAR), scale
+
+
+def detect(model, image: Image.Image, overview: Image.Image, overview_scale: float, tiles: Sequence[Tile],
+           conf: float, tile_input: int = DETECT_TILE_INPUT) -> List[Box]:
+    """
+    Run ``model`` once over ``overview`` (``image`` downscaled by
+    ``overview_scale``) plus every tile, and return merged page-space boxes.
+    """
+    w, h = image.size
+    inputs = [overview]
+    placements = [(0, 0, overview_scale, None)]
+    for tile in tiles:
+        region, scale = _fit(image.crop(tile), tile_input)
+        inputs.append(region)
+        placements.append((tile[0], tile[1], scale, tile))
+    results = model.predict(inputs, conf=conf, verbose=False)
+    del inputs
+
+    boxes: List[Box] = []
+    clipped: List[bool] = []
+    for result, (ox, oy, scale, tile) in zip(results, placements):
+        for box_data in result.boxes:
+            x1, y1, x2, y2 = (v / scale for v in box_data.xyxy[0].tolist())
+            x1, y1, x2, y2 = x1 + ox, y1 + oy, x2 + ox, y2 + oy
+            cut = False
+            if tile is not None:
+                # Only edges inside the page can cut a card
+                tx0, ty0, tx1, ty1 = tile
+                cut = ((tx0 > 0 and x1 - tx0 <= EDGE_MARGIN_PX) or (ty0 > 0 and y1 - ty0 <= EDGE_MARGIN_PX)
+                       or (tx1 < w and tx1 - x2 <= EDGE_MARGIN_PX) or (ty1 < h and ty1 - y2 <= EDGE_MARGIN_PX))
+            boxes.append((x1, y1, x2, y2, float(box_data.conf[0].item())))
+            clipped.append(cut)
+    return [boxes[i] for i in merge_boxes(boxes, clipped)]
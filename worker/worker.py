@@ -7,6 +7,7 @@ Production-ready version addressing o3 feedback:
 - Optimized imports and network error handling
 - Delayed client initialization to gracefully handle env var errors
 """
+import contextlib
 import io
 import os
 import sys
@@ -14,20 +15,35 @@ import time
 import json
 from pathlib import Path
 import uuid
-import hashlib
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timedelta, timezone
 import traceback
 
-from PIL import Image, ImageDraw, ImageFont, ImageOps
+from PIL import Image, ImageOps
 from ultralytics import YOLO
-from config import get_supabase_client
+from config import get_supabase_client, CROP_BUNDLE, CROP_DEDUPE, CROP_GATE, CROP_WINDOW, DETECT_TILING, MAX_JOB_RETRIES, STALE_JOB_MINUTES, SCAN_CONTENT_DEDUPE, STORAGE_BUCKET
+from queue_maintenance import StaleJobSweeper
+from job_lease import JobLease, LeaseLost, WORKER_ID, complete_job_lease, dequeue_job_with_lease
+import stage_timing
+from stage_timing import span
+import metrics
+import job_failures
+import memory_governor
+import scan_dedupe
+from crop_artifact import JPEG_BACKEND, cut_crop
+from crop_bundle import CropBundle
+from crop_dedupe import EmbeddingMemo
+import crop_gate
+import summary_render
+import tiled_detection
+from scan_dedupe import compute_bbox_hash
+from shutdown import GracefulShutdown
 from clip_lookup import CLIPCardIdentifier  # Legacy CLIP identification
 import logging
 
 # Import retrieval v2 if enabled
 try:
-    from retrieval_v2 import identify_v2
+    from retrieval_v2 import identify_v2_batch
     from config import RETRIEVAL_IMPL, RETRIEVAL_TOPK
     USE_RETRIEVAL_V2 = (RETRIEVAL_IMPL == "v2")
     if USE_RETRIEVAL_V2:
@@ -76,7 +92,6 @@ def startup_env_check():
 CONFIDENCE_THRESHOLD = 0.25
 MAX_IMAGE_SIZE = 2048
 MAX_REASONABLE_CARDS = 18
-STORAGE_BUCKET = "scans"
 VISIBILITY_TIMEOUT_COLUMNS = ("visibility_timeout_at", None)  # Fallback removed - column is always visibility_timeout_at
 
 def get_yolo_model(model_path=str(Path(__file__).parent / 'pokemon_cards_trained.pt')):
@@ -170,9 +185,11 @@ def resolve_card_uuid(supabase_client, source: str, external_card_id: str) -> Op
             .execute()
         )
         if key_res.data and key_res.data.get("card_id"):
+            metrics.record_cache("card_keys", hit=True)
             return key_res.data["card_id"]
     except Exception:
         pass
+    metrics.record_cache("card_keys", hit=False)
 
     # 2) Try to find existing card by vendor id column
     try:
@@ -266,11 +283,6 @@ def resolve_card_uuid(supabase_client, source: str, external_card_id: str) -> Op
 
     return None
 
-def compute_bbox_hash(scan_id: str, bbox: List[int]) -> str:
-    base = f"{scan_id}:{bbox[0]}:{bbox[1]}:{bbox[2]}:{bbox[3]}"
-    return hashlib.md5(base.encode("utf-8")).hexdigest()
-
-
 def log_training_feedback(
     supabase_client,
     *,
@@ -364,7 +376,162 @@ def download_image_with_retry(supabase_client, storage_path: str, max_retries: i
             else:
                 raise e
 
-def run_normalized_pipeline(supabase_client, job: dict, model: YOLO, clip_identifier):
+def identify_crops(crops: List[Image.Image], supabase_client, clip_identifier, memo: Optional[EmbeddingMemo] = None) -> List[Dict]:
+    """
+    Identify one window of crops (``CropArtifact.embed_input``s: strict 336-px squares
+    for retrieval v2, plain crops for the legacy identifier). Returns one minimal
+    result dict per crop, in order. ``memo`` is the scan's near-duplicate memo
+    (retrieval v2 only), shared across windows.
+    """
+    if USE_RETRIEVAL_V2:
+        with span("identify"):
+            results = identify_v2_batch(crops, supabase_client, topk=RETRIEVAL_TOPK, preprocessed=True, memo=memo)
+        # Keep only what downstream DB insertion needs, not the full candidate lists
+        return [
+            {
+                'success': True,
+                'card_id': result['card_id'],
+                'name': result['card_id'],  # Will be enriched later
+                'confidence': result['best_score'],
+                'similarity': result['best_score'],
+                'method': 'retrieval_v2'
+            }
+            if result.get('card_id') else
+            {
+                'success': False,
+                'error': 'No match found (below threshold)',
+                'method': 'retrieval_v2'
+            }
+            for result in results
+        ]
+    with span("identify"):
+        return clip_identifier.identify_cards_batch(crops, similarity_threshold=0.6)
+
+
+def persist_detection(supabase_client, scan_id: str, user_id: str, i: int, det: Dict, clip_result: Dict, crop_path: str) -> Tuple[str, bool]:
+    """Write one identified detection (plus training feedback and user_cards link). Returns (detection_id, user_card_created)."""
+    user_card_created = False
+    # Use CLIP result directly
+    if clip_result.get('success'):
+        card_name = clip_result.get('name', '')
+        card_id = clip_result.get('card_id')  # CLIP already provides this!
+        confidence = clip_result.get('confidence', 0.0)
+        logging.info(f"   Card {i+1}: {card_name} ({card_id}) | Similarity: {confidence:.2f}")
+        enrichment = clip_result  # Keep for backward compatibility
+    else:
+        card_name = None
+        card_id = None
+        confidence = 0.0
+        enrichment = {'success': False}  # Keep for backward compatibility
+        print(f"   Card {i+1}: No match found")
+
+    # Detection data matching actual card_detections schema
+    detection_data = {
+        "scan_id": scan_id, 
+        "crop_url": crop_path, 
+        "bbox": det['bbox'],
+        "confidence": det['confidence'], 
+        "tile_source": get_tile_source(i % 9),
+        "identification_method": 'clip',
+        "identification_cost": 0.0,  # CLIP is free
+        "identification_confidence": confidence
+    }
+
+    # External guess metadata
+    if card_id:
+        detection_data["guess_external_id"] = card_id
+        detection_data["guess_source"] = "clip"  # Changed from "sv_text" to "clip"
+
+    # Resolve external card_id to internal UUID when available via mapping
+    resolved_uuid: Optional[str] = None
+    if card_id:
+        with span("resolve_uuid"):
+            resolved_uuid = resolve_card_uuid(supabase_client, "clip", card_id)
+        if resolved_uuid:
+            detection_data["guess_card_id"] = resolved_uuid
+        # If no UUID resolved, we don't set guess_card_id at all
+
+    # Idempotency key
+    detection_data["bbox_hash"] = compute_bbox_hash(scan_id, det['bbox'])
+
+    # Try upsert with AI columns first, fallback to basic columns or without guess_card_id if schema mismatch
+    db_write_started = time.perf_counter()
+    try:
+        detection_response = supabase_client.from_("card_detections").upsert(
+            detection_data, on_conflict="scan_id,bbox_hash"
+        ).execute()
+    except Exception as e:
+        err_msg = str(e)
+        if "identification_confidence" in err_msg or "identification_method" in err_msg:
+            print("[WARN] AI tracking columns not available, using basic schema")
+            basic_data = {k: v for k, v in detection_data.items()
+                          if k not in ['identification_method', 'identification_cost', 'identification_confidence']}
+            detection_response = supabase_client.from_("card_detections").upsert(
+                basic_data, on_conflict="scan_id,bbox_hash"
+            ).execute()
+        elif "invalid input syntax for type uuid" in err_msg or "guess_card_id" in err_msg:
+            print("[WARN] DB expects UUID for guess_card_id. Retrying insert without guess_card_id.")
+            fallback_data = {k: v for k, v in detection_data.items() if k != 'guess_card_id'}
+            detection_response = supabase_client.from_("card_detections").upsert(
+                fallback_data, on_conflict="scan_id,bbox_hash"
+            ).execute()
+        else:
+            raise e
+
+    if not detection_response.data:
+        raise ValueError("Failed to insert detection record")
+    detection_id = detection_response.data[0]["id"]
+    stage_timing.record("db_write", (time.perf_counter() - db_write_started) * 1000.0)
+
+    # Log identification in training feedback table
+    predicted_card_id = card_id or "UNKNOWN"
+    prediction_method = (
+        clip_result.get("method")
+        or ("retrieval_v2" if USE_RETRIEVAL_V2 else "clip_embedding")
+    )
+    prediction_score = float(confidence or 0.0)
+    log_training_feedback(
+        supabase_client,
+        scan_id=scan_id,
+        detection_id=detection_id,
+        crop_storage_path=crop_path,
+        predicted_card_id=predicted_card_id,
+        prediction_score=prediction_score,
+        prediction_method=prediction_method,
+    )
+
+    # Only create user_cards when we have a valid UUID for the card
+    if resolved_uuid:  # Use the resolved UUID, not the external card_id
+        user_card_data = {
+            "user_id": user_id,
+            "detection_id": detection_id,
+            "card_id": resolved_uuid,  # Use the UUID
+            "condition": "unknown",
+            "estimated_value": enrichment.get("estimated_value")
+        }
+        try:
+            # Use upsert with the proper constraint that now exists
+            with span("db_write"):
+                supabase_client.from_("user_cards").upsert(
+                    user_card_data, 
+                    on_conflict="user_id,card_id"
+                ).execute()
+            user_card_created = True
+            print(f"[OK] Created/updated user card: {card_name}")
+        except Exception as e:
+            print(f"[WARN] Failed to create user_card for {card_name}: {e}")
+    elif card_id:
+        print(f"[INFO] Skipping user_cards creation for {card_name} ({card_id}) - no UUID mapping found")
+
+    return detection_id, user_card_created
+
+
+def run_normalized_pipeline(supabase_client, job: dict, model: YOLO, clip_identifier, lease: Optional[JobLease] = None):
+    def ensure_lease():
+        # Stop before side-effecting writes once another worker may own this job
+        if lease is not None:
+            lease.ensure_held()
+
     job_id_for_logging = job.get('job_id')
     print(f"[INFO] Starting pipeline for job: {job_id_for_logging}")
 
@@ -422,252 +589,178 @@ def run_normalized_pipeline(supabase_client, job: dict, model: YOLO, clip_identi
         logging.info(f"[OK] Created scan: {scan_id}")
         
         logging.info(f"[..] Downloading image: {storage_path}")
-        image_bytes = download_image_with_retry(supabase_client, storage_path)
+        with span("download"):
+            image_bytes = download_image_with_retry(supabase_client, storage_path)
         logging.info(f"[OK] Image downloaded ({len(image_bytes) / 1024:.1f} KB)")
+
+        image_sha256 = scan_dedupe.content_hash(image_bytes)
+        job['content_sha256'] = image_sha256  # failure fingerprint input
+        if job.get('payload', {}).get('force_reprocess'):
+            # The stamp marks reusable results; they are about to be replaced
+            scan_dedupe.record_content_hash(supabase_client, scan_id, None)
+        elif SCAN_CONTENT_DEDUPE:
+            with span("dedupe"):
+                source_scan = scan_dedupe.find_completed_scan(supabase_client, image_sha256, scan_id, user_id)
+                if source_scan:
+                    ensure_lease()
+                    cloned = scan_dedupe.clone_scan_results(supabase_client, source_scan, scan_id, user_id)
+            if source_scan:
+                if not cloned['summary_image_path'] and source_scan['id'] != scan_id:
+                    # The source's preview is still rendering; share it once it lands
+                    summary_render.submit_link(supabase_client, scan_id, source_scan['id'])
+                scan_dedupe.record_content_hash(supabase_client, scan_id, image_sha256)
+                metrics.SCANS_CLONED.inc()
+                logging.info(f"[OK] Same image as scan {source_scan['id']}; reused {cloned['total_detections']} detections without inference")
+                return cloned
         
-        try:
-            original_image = Image.open(io.BytesIO(image_bytes))
-        except Exception:
-            logging.warning("Standard open failed, attempting HEIC conversion...")
+        with span("decode"):
             try:
-                import pillow_heif
-                heif_file = pillow_heif.read_heif(io.BytesIO(image_bytes))
-                original_image = Image.frombytes(heif_file.mode, heif_file.size, heif_file.data, "raw")
-                logging.info("[OK] HEIC conversion successful")
-            except Exception as heic_error:
-                raise Exception(f"Pillow and pillow-heif failed. Error: {heic_error}")
-
-        image = ImageOps.exif_transpose(original_image)
+                original_image = Image.open(io.BytesIO(image_bytes))
+            except Exception:
+                logging.warning("Standard open failed, attempting HEIC conversion...")
+                try:
+                    import pillow_heif
+                    heif_file = pillow_heif.read_heif(io.BytesIO(image_bytes))
+                    original_image = Image.frombytes(heif_file.mode, heif_file.size, heif_file.data, "raw")
+                    logging.info("[OK] HEIC conversion successful")
+                except Exception as heic_error:
+                    raise Exception(f"Pillow and pillow-heif failed. Error: {heic_error}")
+            original_image.load()  # Image.open is lazy; decode here so the span measures it
+
+        with span("exif_transpose"):
+            image = ImageOps.exif_transpose(original_image)
         w, h = image.size
         logging.info(f"[OK] Image loaded: {w}x{h} pixels")
         
         supabase_client.from_("scans").update({"progress": 30.0}).eq("id", scan_id).execute()
-        detection_image, scale = resize_for_detection(image)
+        with span("resize"):
+            detection_image, scale = resize_for_detection(image)
         
-        logging.info(f"[..] Detecting cards (YOLO) on {detection_image.size[0]}x{detection_image.size[1]} image")
-        results = model.predict(detection_image, conf=CONFIDENCE_THRESHOLD, verbose=False)
+        tiles = tiled_detection.plan_tiles(image.size) if DETECT_TILING else []
+        logging.info(f"[..] Detecting cards (YOLO) on {detection_image.size[0]}x{detection_image.size[1]} image"
+                     + (f" + {len(tiles)} tiles" if tiles else ""))
+        with span("yolo"):
+            if tiles:
+                raw_boxes = tiled_detection.detect(model, image, detection_image, scale, tiles, conf=CONFIDENCE_THRESHOLD)
+            else:
+                raw_boxes = []
+                for r in model.predict(detection_image, conf=CONFIDENCE_THRESHOLD, verbose=False):
+                    for box_data in r.boxes:
+                        x1, y1, x2, y2 = box_data.xyxy[0].tolist()
+                        if scale != 1.0:
+                            x1, y1, x2, y2 = x1/scale, y1/scale, x2/scale, y2/scale
+                        raw_boxes.append((x1, y1, x2, y2, box_data.conf[0].item()))
         detections = []
-        for r in results:
-            for box_data in r.boxes:
-                x1, y1, x2, y2 = box_data.xyxy[0].tolist()
-                if scale != 1.0:
-                    x1, y1, x2, y2 = x1/scale, y1/scale, x2/scale, y2/scale
-                bbox = safe_bbox_calculation([int(x1), int(y1), int(x2), int(y2)])
-                detections.append({
-                    'box': [bbox[0], bbox[1], bbox[0] + bbox[2], bbox[1] + bbox[3]],
-                    'bbox': bbox, 'confidence': box_data.conf[0].item()
-                })
+        for x1, y1, x2, y2, confidence in raw_boxes:
+            bbox = safe_bbox_calculation([int(x1), int(y1), int(x2), int(y2)])
+            detections.append({
+                'box': [bbox[0], bbox[1], bbox[0] + bbox[2], bbox[1] + bbox[3]],
+                'bbox': bbox, 'confidence': confidence
+            })
+        if CROP_GATE:
+            # Drop boxes that cannot be a card before they cost a crop, upload and embed
+            with span("crop_gate"):
+                detections, rejected = crop_gate.screen_boxes(detections, image.size)
+            for _, reason in rejected:
+                metrics.CROPS_GATED.inc(verdict="reject", reason=reason)
+            if rejected:
+                logging.info(f"[GATE] Rejected {len(rejected)} detection(s): {', '.join(reason for _, reason in rejected)}")
 
         final_detections = sorted(detections, key=lambda x: x['confidence'], reverse=True)[:MAX_REASONABLE_CARDS]
         logging.info(f"[OK] Detection complete: {len(final_detections)} cards found")
+        metrics.CROPS_PER_SCAN.observe(len(final_detections))
         supabase_client.from_("scans").update({"progress": 50.0}).eq("id", scan_id).execute()
 
         detection_records = []
         user_cards_created = 0
         
         if final_detections:
-            summary_img = image.copy()
-            draw = ImageDraw.Draw(summary_img)
-            font = ImageFont.load_default()
-            print(f"[INFO] Processing {len(final_detections)} detections...")
-            
-            # First, prepare all crops and save them to storage
-            # TODO: Future optimization - stream crops (create → identify → delete) instead of batching
-            # This would reduce peak memory from "15 crops + 15 inferences" to "1 crop + 1 inference"
-            card_crops = []
-            crop_paths = []
-            for i, det in enumerate(final_detections):
-                box = det['box']
-                draw.rectangle(box, outline="red", width=3)
-                draw.text((box[0] + 5, box[1] + 5), f"Card {i+1}", fill="red", font=font)
-                card_crop = image.crop(box)
-                card_crops.append(card_crop)
-                
-                # Save crop for storage (PIL image still held in card_crops list until identification)
-                card_buffer = io.BytesIO()
-                card_crop.save(card_buffer, format='JPEG', quality=95)
-                card_buffer.seek(0)
-                crop_path = f"{scan_id}/crop_{i+1}.jpeg"
-                supabase_client.storage.from_(STORAGE_BUCKET).upload(
-                    path=crop_path, file=card_buffer.getvalue(), 
-                    file_options={"content-type": "image/jpeg", "upsert": "true"}
-                )
-                crop_paths.append(crop_path)
-            
-            # Identify all cards - process one at a time, keep only minimal summaries
-            if USE_RETRIEVAL_V2:
-                logging.info(f"[..] Identifying cards (Retrieval v2): {len(card_crops)} cards")
-                batch_results = []
-                import gc
-                for i, crop in enumerate(card_crops):
-                    # Run identification (this handles its own cleanup internally)
-                    result = identify_v2(crop, supabase_client, topk=RETRIEVAL_TOPK)
-                    
-                    # Extract ONLY the minimal data we need for downstream DB insertion
-                    # Don't keep the full result dict around
-                    if result.get('card_id'):
-                        batch_results.append({
-                            'success': True,
-                            'card_id': result['card_id'],
-                            'name': result['card_id'],  # Will be enriched later
-                            'confidence': result['best_score'],
-                            'similarity': result['best_score'],
-                            'method': 'retrieval_v2'  # Don't get from result, just set directly
-                        })
+            window = max(1, CROP_WINDOW)
+            print(f"[INFO] Processing {len(final_detections)} detections, {window} crop(s) in flight at a time...")
+
+            # Stream windows of crops through crop -> upload -> identify -> persist, then drop
+            # them, so peak memory is bounded by the window size rather than cards per page
+            numbered = list(enumerate(final_detections))
+            bundle = CropBundle(scan_id) if CROP_BUNDLE else None
+            # Copies of the same card later in the scan reuse the first copy's retrieval
+            retrieval_memo = EmbeddingMemo() if CROP_DEDUPE and USE_RETRIEVAL_V2 else None
+            for window_start in range(0, len(numbered), window):
+                chunk = numbered[window_start:window_start + window]
+                card_crops = []
+                crop_paths = []
+                deferred = []
+                for i, det in chunk:
+                    with span("crop_encode"):
+                        # One cut: storage JPEG + embedding input, full-size region freed
+                        artifact = cut_crop(image, det['box'], target_short=336 if USE_RETRIEVAL_V2 else None)
+                    crop_path = f"{scan_id}/crop_{i+1}.jpeg"
+                    if bundle is not None:
+                        bundle.add(crop_path, artifact.jpeg)
                     else:
-                        batch_results.append({
-                            'success': False,
-                            'error': 'No match found (below threshold)',
-                            'method': 'retrieval_v2'
-                        })
-                    
-                    # Explicit cleanup: del crop and result immediately after extracting what we need
-                    del crop
-                    del result
-                    
-                    # Only gc.collect() periodically (not every card) - Python will free most refs automatically
-                    if (i + 1) % 5 == 0:  # Every 5 cards
-                        gc.collect()
-                
-                # After all identifications: clear the crop list and final cleanup
+                        with span("upload"):
+                            supabase_client.storage.from_(STORAGE_BUCKET).upload(
+                                path=crop_path, file=artifact.jpeg, 
+                                file_options={"content-type": "image/jpeg", "upsert": "true"}
+                            )
+                    reason = None
+                    if CROP_GATE:
+                        with span("crop_gate"):
+                            reason = crop_gate.defer_reason(
+                                artifact.embed_input, det['confidence'],
+                                content_size=artifact.size if artifact.preprocessed else None
+                            )
+                    if reason is None:
+                        card_crops.append(artifact.embed_input)
+                    else:
+                        metrics.CROPS_GATED.inc(verdict="defer", reason=reason)
+                    deferred.append(reason)
+                    crop_paths.append(crop_path)
+                    del artifact
+
+                ensure_lease()
+                identified = iter(identify_crops(card_crops, supabase_client, clip_identifier, retrieval_memo) if card_crops else [])
                 del card_crops
-                gc.collect()
-            else:
-                logging.info(f"[..] Identifying cards (Legacy CLIP): {len(card_crops)} cards in batch")
-                batch_results = clip_identifier.identify_cards_batch(card_crops, similarity_threshold=0.6)
-                # Force garbage collection after CLIP batch to free tensor memory immediately
-                import gc
-                gc.collect()
+                # Deferred crops are stored unidentified, without an embed or RPC
+                batch_results = [
+                    next(identified) if reason is None else
+                    {'success': False, 'error': f'Skipped by crop gate ({reason})', 'method': 'crop_gate'}
+                    for reason in deferred
+                ]
+                ensure_lease()
+
+                for (i, det), clip_result, crop_path in zip(chunk, batch_results, crop_paths):
+                    detection_id, user_card_created = persist_detection(
+                        supabase_client, scan_id, user_id, i, det, clip_result, crop_path
+                    )
+                    detection_records.append(detection_id)
+                    user_cards_created += int(user_card_created)
+                    progress = 50.0 + (i + 1) / len(final_detections) * 40.0
+                    supabase_client.from_("scans").update({"progress": round(progress, 1)}).eq("id", scan_id).execute()
+                del batch_results
+                memory_governor.checkpoint("crop_window")
             logging.info(f"[OK] Identifications complete")
+            if retrieval_memo is not None and retrieval_memo.hits:
+                logging.info(f"   {retrieval_memo.hits} duplicate crop(s) reused {len(retrieval_memo)} distinct retrieval(s)")
+            del retrieval_memo
+
+            if bundle is not None:
+                # Every crop in one object; crop_url paths resolve through crop_bundle.download_crop
+                with span("upload"):
+                    bundle.upload(supabase_client, STORAGE_BUCKET)
+                del bundle
             
-            # Process results
-            for i, (det, clip_result, crop_path) in enumerate(zip(final_detections, batch_results, crop_paths)):
-                # Use CLIP result directly
-                if clip_result.get('success'):
-                    card_name = clip_result.get('name', '')
-                    card_id = clip_result.get('card_id')  # CLIP already provides this!
-                    confidence = clip_result.get('confidence', 0.0)
-                    logging.info(f"   Card {i+1}: {card_name} ({card_id}) | Similarity: {confidence:.2f}")
-                    enrichment = clip_result  # Keep for backward compatibility
-                else:
-                    card_name = None
-                    card_id = None
-                    confidence = 0.0
-                    enrichment = {'success': False}  # Keep for backward compatibility
-                    print(f"   Card {i+1}: No match found")
-
-                # Detection data matching actual card_detections schema
-                detection_data = {
-                    "scan_id": scan_id, 
-                    "crop_url": crop_path, 
-                    "bbox": det['bbox'],
-                    "confidence": det['confidence'], 
-                    "tile_source": get_tile_source(i % 9),
-                    "identification_method": 'clip',
-                    "identification_cost": 0.0,  # CLIP is free
-                    "identification_confidence": confidence
-                }
-                
-                # External guess metadata
-                if card_id:
-                    detection_data["guess_external_id"] = card_id
-                    detection_data["guess_source"] = "clip"  # Changed from "sv_text" to "clip"
-
-                # Resolve external card_id to internal UUID when available via mapping
-                resolved_uuid: Optional[str] = None
-                if card_id:
-                    resolved_uuid = resolve_card_uuid(supabase_client, "clip", card_id)
-                    if resolved_uuid:
-                        detection_data["guess_card_id"] = resolved_uuid
-                    # If no UUID resolved, we don't set guess_card_id at all
-
-                # Idempotency key
-                detection_data["bbox_hash"] = compute_bbox_hash(scan_id, det['bbox'])
-                
-                # Try upsert with AI columns first, fallback to basic columns or without guess_card_id if schema mismatch
-                try:
-                    detection_response = supabase_client.from_("card_detections").upsert(
-                        detection_data, on_conflict="scan_id,bbox_hash"
-                    ).execute()
-                except Exception as e:
-                    err_msg = str(e)
-                    if "identification_confidence" in err_msg or "identification_method" in err_msg:
-                        print("[WARN] AI tracking columns not available, using basic schema")
-                        basic_data = {k: v for k, v in detection_data.items()
-                                      if k not in ['identification_method', 'identification_cost', 'identification_confidence']}
-                        detection_response = supabase_client.from_("card_detections").upsert(
-                            basic_data, on_conflict="scan_id,bbox_hash"
-                        ).execute()
-                    elif "invalid input syntax for type uuid" in err_msg or "guess_card_id" in err_msg:
-                        print("[WARN] DB expects UUID for guess_card_id. Retrying insert without guess_card_id.")
-                        fallback_data = {k: v for k, v in detection_data.items() if k != 'guess_card_id'}
-                        detection_response = supabase_client.from_("card_detections").upsert(
-                            fallback_data, on_conflict="scan_id,bbox_hash"
-                        ).execute()
-                    else:
-                        raise e
-                
-                if not detection_response.data:
-                    raise ValueError("Failed to insert detection record")
-                detection_id = detection_response.data[0]["id"]
-                detection_records.append(detection_id)
-
-                # Log identification in training feedback table
-                predicted_card_id = card_id or "UNKNOWN"
-                prediction_method = (
-                    clip_result.get("method")
-                    or ("retrieval_v2" if USE_RETRIEVAL_V2 else "clip_embedding")
-                )
-                prediction_score = float(confidence or 0.0)
-                log_training_feedback(
-                    supabase_client,
-                    scan_id=scan_id,
-                    detection_id=detection_id,
-                    crop_storage_path=crop_path,
-                    predicted_card_id=predicted_card_id,
-                    prediction_score=prediction_score,
-                    prediction_method=prediction_method,
-                )
-                
-                # Only create user_cards when we have a valid UUID for the card
-                if resolved_uuid:  # Use the resolved UUID, not the external card_id
-                    user_card_data = {
-                        "user_id": user_id,
-                        "detection_id": detection_id,
-                        "card_id": resolved_uuid,  # Use the UUID
-                        "condition": "unknown",
-                        "estimated_value": enrichment.get("estimated_value")
-                    }
-                    try:
-                        # Use upsert with the proper constraint that now exists
-                        supabase_client.from_("user_cards").upsert(
-                            user_card_data, 
-                            on_conflict="user_id,card_id"
-                        ).execute()
-                        user_cards_created += 1
-                        print(f"[OK] Created/updated user card: {card_name}")
-                    except Exception as e:
-                        print(f"[WARN] Failed to create user_card for {card_name}: {e}")
-                elif card_id:
-                    print(f"[INFO] Skipping user_cards creation for {card_name} ({card_id}) - no UUID mapping found")
-                
-                progress = 50.0 + (i + 1) / len(final_detections) * 40.0
-                supabase_client.from_("scans").update({"progress": round(progress, 1)}).eq("id", scan_id).execute()
-            
-            logging.info("[..] Uploading results + writing DB")
-            summary_buffer = io.BytesIO()
-            summary_img.save(summary_buffer, format='JPEG', quality=90)
-            summary_buffer.seek(0)
-            summary_path = f"{scan_id}/summary.jpeg"
-            supabase_client.storage.from_(STORAGE_BUCKET).upload(
-                path=summary_path, file=summary_buffer.getvalue(), 
-                file_options={"content-type": "image/jpeg", "upsert": "true"}
-            )
-            
+            ensure_lease()
             supabase_client.from_("scans").update({
-                "status": "ready", "progress": 100.0, "summary_image_path": summary_path
+                "status": "ready", "progress": 100.0
             }).eq("id", scan_id).execute()
-            logging.info("[OK] Results uploaded")
+            logging.info("[OK] Results written")
+
+            # The preview is drawn on the detection-sized image and uploaded in the
+            # background; summary_image_path is patched once it lands
+            summary_render.submit(
+                supabase_client, scan_id, detection_image,
+                [[c * scale for c in det['box']] for det in final_detections]
+            )
             
             # Update scans status so it shows in scan history
             try:
@@ -678,12 +771,16 @@ def run_normalized_pipeline(supabase_client, job: dict, model: YOLO, clip_identi
             except Exception as status_err:
                 logging.warning(f"Failed to update scan_uploads status: {status_err}")
 
+        scan_dedupe.record_content_hash(supabase_client, scan_id, image_sha256)
         return {
             "scan_id": scan_id, "total_detections": len(final_detections),
             "user_cards_created": user_cards_created, "detection_records": detection_records,
-            "summary_image_path": summary_path if final_detections else None, "status": "ready"
+            "status": "ready"
         }
         
+    except LeaseLost:
+        # The job now belongs to another worker; leave its scan status alone
+        raise
     except Exception as e:
         if scan_id:
             try:
@@ -695,19 +792,25 @@ def run_normalized_pipeline(supabase_client, job: dict, model: YOLO, clip_identi
             print(f"[ERROR] Traceback: {traceback.format_exc()}")
         raise e
 
-def save_output_log(job_id: str, results: Dict):
+def save_output_log(job_id: str, results: Dict) -> Path:
     output_dir = Path(__file__).parent / "output"
     output_dir.mkdir(exist_ok=True)
     file_path = output_dir / f"{job_id}_result.json"
     with open(file_path, 'w') as f:
         json.dump(results, f, indent=2, sort_keys=True)
     print(f"[LOG] Saved detailed output log to: {file_path}")
+    return file_path
 
 
 # Heartbeat functionality removed - use external monitoring instead
 
 def requeue_stale_jobs(supabase_client):
-    """Enhanced stale job recovery with retry tracking"""
+    """
+    Client-side stale job recovery with retry tracking.
+
+    Only used as the StaleJobSweeper fallback when the sweep_stale_jobs RPC
+    has not been deployed; the RPC does the same work in one statement.
+    """
     try:
         now_iso = datetime.now(timezone.utc).isoformat()
         
@@ -722,9 +825,9 @@ def requeue_stale_jobs(supabase_client):
             else:
                 raise
         
-        # Find jobs stuck by time (15+ minutes)
-        fifteen_mins_ago = (datetime.now(timezone.utc) - timedelta(minutes=15)).isoformat()
-        stale_by_time = supabase_client.from_("job_queue").select("id, retry_count, scan_upload_id").in_("status", ["processing"]).lte("started_at", fifteen_mins_ago).execute().data or []
+        # Find jobs stuck by time (STALE_JOB_MINUTES+)
+        stale_cutoff = (datetime.now(timezone.utc) - timedelta(minutes=STALE_JOB_MINUTES)).isoformat()
+        stale_by_time = supabase_client.from_("job_queue").select("id, retry_count, scan_upload_id").in_("status", ["processing"]).lte("started_at", stale_cutoff).execute().data or []
         
         # Combine unique stale jobs
         stale_jobs = {j['id']: j for j in stale_by_timeout}
@@ -740,8 +843,8 @@ def requeue_stale_jobs(supabase_client):
             retry_count = job_data.get('retry_count', 0)
             scan_upload_id = job_data.get('scan_upload_id')
             
-            # Check retry limit (max 3 auto-retries)
-            if retry_count >= 3:
+            # Check retry limit
+            if retry_count >= MAX_JOB_RETRIES:
                 print(f"  [FAIL] Job {job_id} exceeded retry limit, marking as failed")
                 # Mark as permanently failed
                 failed_update = {
@@ -781,7 +884,21 @@ def requeue_stale_jobs(supabase_client):
         print(f"[WARN] Requeue stale jobs failed: {e}")
         # Duplicate log line removed
 
+_LEASE_RPC_AVAILABLE = True
+
+
 def fetch_and_lock_job(supabase_client):
+    """Claim the next job. Prefers a renewable lease; falls back to a fixed 10-minute visibility timeout."""
+    global _LEASE_RPC_AVAILABLE
+    if _LEASE_RPC_AVAILABLE:
+        try:
+            return dequeue_job_with_lease(supabase_client, WORKER_ID)
+        except Exception as e:
+            if "PGRST202" not in str(e) and "Could not find the function" not in str(e):
+                print(f"[ERROR] Error fetching job: {e}")
+                return None
+            print(f"[WARN] dequeue_job_with_lease RPC not available, using fixed visibility timeout: {e}")
+            _LEASE_RPC_AVAILABLE = False
     try:
         response = supabase_client.rpc("dequeue_and_start_job").execute()
         job = response.data[0] if response.data else None
@@ -794,7 +911,12 @@ def fetch_and_lock_job(supabase_client):
         print(f"[ERROR] Error fetching job: {e}")
         return None
 
-def update_job_status(supabase_client, job_id, upload_id, status, error_message=None, results=None):
+def update_job_status(supabase_client, job_id, upload_id, status, error_message=None, lease_token=None):
+    """
+    Write the final job + scan status. With ``lease_token`` the job update is fenced on
+    lease ownership; returns False (and leaves the scan untouched) if another worker
+    has taken the job over.
+    """
     try:
         # Map processing_status to job_status for job_queue table
         job_status_map = {
@@ -812,7 +934,11 @@ def update_job_status(supabase_client, job_id, upload_id, status, error_message=
         if job_status in ['completed', 'failed']:
             job_update_data['completed_at'] = datetime.now(timezone.utc).isoformat()
             job_update_data['started_at'] = None
-        if not update_job_visibility_timeout(supabase_client, job_id, None, job_update_data):
+        if lease_token:
+            if not complete_job_lease(supabase_client, job_id, lease_token, job_status, error_message):
+                print(f"[FENCED] Job {job_id} is leased to another worker; discarding status {status}")
+                return False
+        elif not update_job_visibility_timeout(supabase_client, job_id, None, job_update_data):
             supabase_client.from_("job_queue").update(job_update_data).eq("id", job_id).execute()
         
         # Avoid setting a status that may propagate to scans.status illegally
@@ -830,20 +956,96 @@ def update_job_status(supabase_client, job_id, upload_id, status, error_message=
         upload_update_data = {"status": upload_status}
         if error_message:
             upload_update_data["error_message"] = error_message
-        # Carry over summary image if available
-        if results and results.get("summary_image_path"):
-            upload_update_data["summary_image_path"] = results["summary_image_path"]
-
         supabase_client.from_("scans").update(upload_update_data).eq("id", upload_id).execute()
         print(f"[UPDATE] Status for job {job_id} updated to {status}.")
+        return True
     except Exception as e:
         print(f"[ERROR] Failed to update job/upload status for job {job_id}: {e}")
+        return False
+
+def handle_job_failure(supabase_client, job, error: Exception, trace):
+    """Fingerprint a failed job, then requeue it with backoff or dead-letter it."""
+    job_id, upload_id = job.get('job_id'), job.get('scan_upload_id')
+    failure = job_failures.classify_failure(error, trace.active_stage, job_failures.input_hash_for(job))
+    tb = traceback.format_exc()
+    log_path = save_output_log(job_id, {
+        "error": str(error), "traceback": tb, "timings": trace.breakdown(),
+        "failure": {"fingerprint": failure.fingerprint, "error_class": failure.error_class,
+                    "stage": failure.stage, "transient": failure.transient},
+    })
+    action = job_failures.record_job_failure(
+        supabase_client, job_id, job.get('lease_token'), failure,
+        traceback_text=tb, output_log_path=str(log_path), worker_id=WORKER_ID,
+    )
+    if action == 'retry':
+        metrics.JOBS_RETRIED.inc()
+        logging.warning(f"[RETRY] Job {job_id} requeued with backoff ({failure.error_class} in {failure.stage}, transient={failure.transient})")
+    elif action == 'dead_letter':
+        metrics.JOBS_DEAD_LETTERED.inc()
+        logging.error(f"[DEAD] Job {job_id} moved to job_dead_letter ({failure.error_class} in {failure.stage}, fingerprint {failure.fingerprint})")
+    elif action == 'fenced':
+        metrics.JOBS_FENCED.inc()
+        print(f"[FENCED] Job {job_id} is leased to another worker; discarding failure")
+    else:
+        update_job_status(supabase_client, job_id, upload_id, 'failed', error_message=str(error), lease_token=job.get('lease_token'))
+
+
+def process_job(supabase_client, job, yolo_model, clip_identifier, claim_ms=None, shutdown: Optional[GracefulShutdown] = None):
+    """Run one claimed job: lease heartbeat, pipeline, fenced status write and result log."""
+    job_id, upload_id = job.get('job_id'), job.get('scan_upload_id')
+    lease_token = job.get('lease_token')
+    logging.info("=" * 60)
+    logging.info(f"[OK] Job dequeued: {job_id}")
+    logging.info(f"   Upload ID: {upload_id}")
+    
+    with stage_timing.job_trace(job_id) as trace:
+        if claim_ms is not None:
+            stage_timing.record("claim", claim_ms)
+        lease = JobLease(supabase_client, job_id, lease_token).start() if lease_token else None
+        # While draining, the shutdown handler releases this lease once the grace period runs out
+        tracked = shutdown.track(lease) if shutdown is not None and lease is not None else contextlib.nullcontext()
+        try:
+            with tracked:
+                pipeline_results = run_normalized_pipeline(supabase_client, job, yolo_model, clip_identifier, lease=lease)
+                
+                logging.info("[..] Finalizing job")
+                if not update_job_status(supabase_client, job_id, upload_id, 'review_pending', lease_token=lease_token):
+                    logging.warning(f"[WARN] Job {job_id} was not finalized by this worker")
+                    metrics.JOBS_FENCED.inc()
+                    return
+            logging.info("[OK] Job finalized")
+            
+            if pipeline_results:
+                logging.info(f"[STATS] Created {pipeline_results.get('user_cards_created', 0)} user cards from {pipeline_results.get('total_detections', 0)} detections")
+            
+            metrics.JOBS_PROCESSED.inc()
+            pipeline_results["timings"] = trace.breakdown()
+            save_output_log(job_id, pipeline_results)
+            logging.info(f"[COMPLETE] Job {job_id} completed successfully in {pipeline_results['timings']['wall_ms'] / 1000:.1f}s")
+            logging.info("=" * 60)
+        except LeaseLost as e:
+            if lease is not None and lease.released:
+                logging.warning(f"[DRAIN] Job {job_id} released back to the queue before finishing")
+            else:
+                logging.warning(f"[LEASE] {e}")
+                metrics.JOBS_FENCED.inc()
+        except Exception as e:
+            logging.error(f"Job {job_id} failed: {e}")
+            traceback.print_exc()
+            metrics.JOBS_FAILED.inc()
+            handle_job_failure(supabase_client, job, e, trace)
+        finally:
+            if lease is not None:
+                lease.stop()
+            memory_governor.checkpoint("job")
 
 def main():
     """Main worker loop."""
     logging.info("=" * 60)
     logging.info("[START] Normalized Worker v3 starting...")
     logging.info("=" * 60)
+    logging.info(f"   Crop JPEG encoder: {JPEG_BACKEND}")
+    logging.info(f"   Crop storage: {'one bundle per scan' if CROP_BUNDLE else 'one object per crop'}")
     
     # Validate environment first
     startup_env_check()
@@ -866,6 +1068,13 @@ def main():
             clip_identifier = CLIPCardIdentifier(supabase_client=supabase_client)
             logging.info("[OK] Legacy CLIP identifier initialized")
         
+        stale_job_sweeper = StaleJobSweeper(supabase_client, fallback=requeue_stale_jobs)
+        shutdown = GracefulShutdown().install()
+        try:
+            metrics.start_metrics_server(queue_sampler=metrics.QueueSampler(supabase_client))
+        except OSError as e:
+            logging.warning(f"Metrics endpoint disabled: {e}")
+        
         logging.info("=" * 60)
         logging.info("[OK] Worker initialized successfully, starting main loop...")
         logging.info("=" * 60)
@@ -874,45 +1083,32 @@ def main():
         traceback.print_exc()
         return
     
-    while True:
+    while not shutdown.draining:
         try:
             # Heartbeat removed - use external monitoring
-            requeue_stale_jobs(supabase_client)
+            # Stale-job recovery runs server-side on a jittered cadence, not every iteration
+            stale_job_sweeper.maybe_sweep()
+            stage_timing.maybe_flush()
+            claim_started = time.perf_counter()
             job = fetch_and_lock_job(supabase_client)
+            claim_ms = (time.perf_counter() - claim_started) * 1000.0
             if not job:
                 logging.info("[WAIT] No jobs found, waiting...")
-                time.sleep(10)
+                shutdown.wait(10)
                 continue
 
-            job_id, upload_id = job.get('job_id'), job.get('scan_upload_id')
-            logging.info("=" * 60)
-            logging.info(f"[OK] Job dequeued: {job_id}")
-            logging.info(f"   Upload ID: {upload_id}")
-            
-            try:
-                pipeline_results = run_normalized_pipeline(supabase_client, job, yolo_model, clip_identifier)
-                
-                logging.info("[..] Finalizing job")
-                update_job_status(supabase_client, job_id, upload_id, 'review_pending', results=pipeline_results)
-                logging.info("[OK] Job finalized")
-                
-                if pipeline_results:
-                    logging.info(f"[STATS] Created {pipeline_results.get('user_cards_created', 0)} user cards from {pipeline_results.get('total_detections', 0)} detections")
-                
-                save_output_log(job_id, pipeline_results)
-                logging.info(f"[COMPLETE] Job {job_id} completed successfully")
-                logging.info("=" * 60)
-            except Exception as e:
-                logging.error(f"Job {job_id} failed: {e}")
-                traceback.print_exc()
-                update_job_status(supabase_client, job_id, upload_id, 'failed', error_message=str(e))
-                save_output_log(job_id, {"error": str(e), "traceback": traceback.format_exc()})
+            process_job(supabase_client, job, yolo_model, clip_identifier, claim_ms=claim_ms, shutdown=shutdown)
 
         except Exception as e:
             logging.critical(f"A critical error occurred in the main loop: {e}")
             logging.critical("This might be due to missing env vars or a DB connection issue.")
             logging.critical("Waiting for 30 seconds before retrying...")
-            time.sleep(30)
+            shutdown.wait(30)
+
+    if not summary_render.wait_pending(timeout=10):
+        logging.warning("[DRAIN] Exiting with summary images still uploading")
+    stage_timing.maybe_flush(force=True)
+    logging.info("[DRAIN] Worker stopped cleanly")
 
 if __name__ == "__main__":
     main()